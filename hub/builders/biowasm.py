@@ -1,16 +1,23 @@
+from functools import lru_cache
 from pathlib import Path
 import docker
 import os
 import tarfile
 import io
 
+from tracing.tracing import span
+
 IMAGE_NAME = "biochef-biowasm-builder"
-bclient = docker.from_env()
 BUILDERS_DIR = Path(__file__).resolve().parent
 
+@lru_cache(maxsize=None)
+def get_client():
+    # Connects to the Docker daemon on the first biowasm build only
+    return docker.from_env()
+
 def image_exists():
     try:
-        bclient.images.get(IMAGE_NAME)
+        get_client().images.get(IMAGE_NAME)
         return True
     except docker.errors.ImageNotFound:
         return False
@@ -19,7 +26,7 @@ def image_exists():
 def build_image(dockerfile_dir=".", dockerfile_name="Dockerfile"):
     print("Building Biowasm Docker image...")
 
-    image, logs = bclient.images.build(
+    image, logs = get_client().images.build(
         path=dockerfile_dir,
         dockerfile=dockerfile_name,
         tag=IMAGE_NAME,
@@ -39,55 +46,63 @@ def copy_from_container(container, source_path, destination):
     from inside the container to the destination
     """
     
-    buffer = io.BytesIO()
-    
-    stream, _ = container.get_archive(source_path)
-    for chunk in stream:
-        buffer.write(chunk)
+    with span("copy_from_container", "build", source=source_path) as s:
+        buffer = io.BytesIO()
+        
+        stream, _ = container.get_archive(source_path)
+        for chunk in stream:
+            buffer.write(chunk)
 
-    buffer.seek(0)
+        s.set(bytes=buffer.tell())
+        buffer.seek(0)
 
-    destination = Path(destination)
-    destination.mkdir(parents=True, exist_ok=True)
+        destination = Path(destination)
+        destination.mkdir(parents=True, exist_ok=True)
 
-    with tarfile.open(fileobj=buffer) as tar:
-        members = tar.getmembers()
+        with tarfile.open(fileobj=buffer) as tar:
+            members = tar.getmembers()
 
-        for member in members:
-            # Remove the top-level directory so only the contents are extracted
-            path_parts = Path(member.name).parts
-            member.name = str(Path(*path_parts[1:]))
+            for member in members:
+                # Remove the top-level directory so only the contents are extracted
+                path_parts = Path(member.name).parts
+                member.name = str(Path(*path_parts[1:]))
 
-        tar.extractall(destination, members)
+            tar.extractall(destination, members)
 
 def build(tool_name, version, output_dir="build"):
-    if not image_exists():
-        build_image(str(BUILDERS_DIR), dockerfile_name="biowasm.Dockerfile")
+    with span("docker_build", "build", image=IMAGE_NAME) as s:
+        cached = image_exists()
+        s.set(cached=cached)
+        if not cached:
+            build_image(str(BUILDERS_DIR), dockerfile_name="biowasm.Dockerfile")
 
     output_dir = Path(output_dir).resolve()
     output_dir.mkdir(parents=True, exist_ok=True)
     
-    container = bclient.containers.run(
-        image=IMAGE_NAME,
-        user=f"{os.getuid()}:{os.getgid()}",
-        working_dir="/biowasm",
-        command=[
-            "bash",
-            "-c",
-            (   
-                f"python3 ./bin/compile.py "
-                f"--tools {tool_name} "
-                f"--versions {version}"
-            ),
-        ],
-        detach=True,
-    )
+    with span("container_start", "build", image=IMAGE_NAME):
+        container = get_client().containers.run(
+            image=IMAGE_NAME,
+            user=f"{os.getuid()}:{os.getgid()}",
+            working_dir="/biowasm",
+            command=[
+                "bash",
+                "-c",
+                (   
+                    f"python3 ./bin/compile.py "
+                    f"--tools {tool_name} "
+                    f"--versions {version}"
+                ),
+            ],
+            detach=True,
+        )
 
     try:
-        for line in container.logs(stream=True):
-            print(line.decode(), end="")
+        with span("compile", "build", tool=tool_name, runtime="wasm", builder="biowasm") as s:
+            for line in container.logs(stream=True):
+                print(line.decode(), end="")
 
-        result = container.wait()
+            result = container.wait()
+            s.set(exit_code=result["StatusCode"])
 
         if result["StatusCode"] != 0:
             print(f"Build failed with code {result['StatusCode']}")
@@ -5,12 +5,11 @@ import yaml
 import os
 import shutil
 import hashlib
-import requests
 import stat
 
-from builders.biowasm import build as build_biowasm
-from builders.emscripten import build as build_emscripten
-from builders.native import build as build_native
+from builders.registry import get_builder
+from state.state import artifact_digest, build_inputs_hash
+from tracing.tracing import span
 
 def reset_dir(dir_to_reset):
     if os.path.exists(dir_to_reset):
@@ -20,13 +19,22 @@ def reset_dir(dir_to_reset):
 def generate_digest(file_path: str) -> str:
     sha256_hash = hashlib.sha256()
 
-    with open(file_path, "rb") as f:
-        for chunk in iter(lambda: f.read(4096), b""):
-            sha256_hash.update(chunk)
+    with span("generate_digest", "build", path=str(file_path)) as s:
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(4096), b""):
+                sha256_hash.update(chunk)
+            s.set(bytes=f.tell())
 
     return f"sha256:{sha256_hash.hexdigest()}"
 
+def copy_file(source, destination):
+    with span("copyfile", "build", path=str(destination)) as s:
+        shutil.copyfile(source, destination)
+        s.set(bytes=os.path.getsize(destination))
+
 def download_github_license(repo_url: str, target_path: str, license_files=None):
+    import requests
+
     parts = urlparse(repo_url).path.strip("/").split("/")
     if len(parts) < 2:
         raise ValueError("Invalid GitHub repo URL")
@@ -38,21 +46,26 @@ def download_github_license(repo_url: str, target_path: str, license_files=None)
     candidates = [c for c in candidates if not (c in seen or seen.add(c))]
 
     last_error = None
-    for branch in ["main", "master"]:
-        for filename in candidates:
-            raw_url = f"https://raw.githubusercontent.com/{owner}/{repo}/{branch}/{filename}"
-            response = requests.get(raw_url)
-            if response.status_code == 200:
-                target_file = Path(target_path)
-                target_file.parent.mkdir(parents=True, exist_ok=True)
-                target_file.write_text(response.text, encoding="utf-8")
-                return
-            else:
-                last_error = response.status_code
+    with span("license_download", "build", repo=repo_url) as s:
+        attempts = 0
+        for branch in ["main", "master"]:
+            for filename in candidates:
+                raw_url = f"https://raw.githubusercontent.com/{owner}/{repo}/{branch}/{filename}"
+                response = requests.get(raw_url)
+                attempts += 1
+                if response.status_code == 200:
+                    target_file = Path(target_path)
+                    target_file.parent.mkdir(parents=True, exist_ok=True)
+                    target_file.write_text(response.text, encoding="utf-8")
+                    s.set(requests=attempts, bytes=len(response.content))
+                    return
+                else:
+                    last_error = response.status_code
+        s.set(requests=attempts)
 
     raise Exception(f"Failed to fetch license (tried {candidates}): {last_error}")
 
-def build_wasm(recipe, recipe_dir, build_dir):
+def build_wasm(recipe, recipe_dir, build_dir, source_dir=None):
     tool_name = recipe["name"]
     wasm_settings = recipe['build']['wasm']
     wasm_strategy = wasm_settings['strategy']
@@ -60,7 +73,7 @@ def build_wasm(recipe, recipe_dir, build_dir):
     def build_biowasm_wrapper():
         package_name = wasm_settings.get("biowasm",{}).get("package", "")
         if not package_name: package_name = tool_name
-        return build_biowasm(package_name, recipe["source"].get("version"), output_dir=build_dir)
+        return get_builder("biowasm")(package_name, recipe["source"].get("version"), output_dir=build_dir)
 
     def build_emscripten_wrapper():
         source = (
@@ -68,7 +81,9 @@ def build_wasm(recipe, recipe_dir, build_dir):
             recipe["source"].get("tag"),
             recipe["source"].get("commit") 
         )
-        return build_emscripten(tool_name, recipe_dir, wasm_settings["emscripten"], source, output_dir=build_dir)
+        return get_builder("emscripten")(
+            tool_name, recipe_dir, wasm_settings["emscripten"], source, output_dir=build_dir, source_dir=source_dir
+        )
 
     output_dir = None
     if wasm_strategy == "biowasm":
@@ -84,86 +99,196 @@ def build_wasm(recipe, recipe_dir, build_dir):
 
     return output_dir
 
-def build_plugins(file_paths, build_dir, registry_dir):
+def build_plugins(file_paths, build_dir, registry_dir, state=None):
+    """
+    Builds the recipes into the registry directory. With a state store,
+    recipes whose last build is still valid are not rebuilt, and only the
+    plugins of other recipes are removed from the registry directory.
+    """
     print(f"Building recipes: {file_paths}")
 
-    if os.path.exists(registry_dir) and os.path.isdir(registry_dir):
-        shutil.rmtree(registry_dir)
-
-    for path in file_paths:
-        path = Path(path).resolve()
-
-        with open(path, 'r') as file:
-            recipe = yaml.safe_load(file)
-
-        print(f"Attempting to build: {recipe["name"]}")
-        reset_dir(build_dir)
-
-        outputs = {}
-        build_runtimes = recipe['build'].keys()
-        for runtime in build_runtimes:
+    if state is None:
+        if os.path.exists(registry_dir) and os.path.isdir(registry_dir):
+            shutil.rmtree(registry_dir)
+
+        for path in file_paths:
+            build_recipe(path, build_dir, registry_dir)
+    else:
+        plugin_dirs = []
+        for path in file_paths:
+            plugin_dirs.extend(build_recipe_incremental(path, build_dir, registry_dir, state))
+        prune_registry(registry_dir, plugin_dirs)
+
+    if os.path.exists(build_dir):
+        shutil.rmtree(build_dir)
+
+def prune_registry(registry_dir, keep):
+    """
+    Removes the plugin versions of the registry directory that are not in keep
+    """
+    keep = {Path(plugin_dir).resolve() for plugin_dir in keep}
+    registry_path = Path(registry_dir)
+    if not registry_path.is_dir():
+        return
+
+    for plugin_dir in registry_path.iterdir():
+        if not plugin_dir.is_dir():
+            continue
+        for version_dir in plugin_dir.iterdir():
+            if version_dir.resolve() not in keep:
+                shutil.rmtree(version_dir)
+        if not any(plugin_dir.iterdir()):
+            plugin_dir.rmdir()
+
+def plugin_artifacts(plugin_dirs):
+    """
+    (path, plugin, version, digest, size) of every file of the given plugin directories
+    """
+    artifacts = []
+    for plugin_dir in plugin_dirs:
+        plugin_dir = Path(plugin_dir)
+        for file in sorted(plugin_dir.rglob("*")):
+            if file.is_file():
+                artifacts.append((
+                    file.resolve(), plugin_dir.parent.name, plugin_dir.name,
+                    artifact_digest(file), file.stat().st_size
+                ))
+    return artifacts
+
+def build_recipe_incremental(path, build_dir, registry_dir, state):
+    """
+    Reuses the outputs of the recipe's last build if its inputs are unchanged
+    and the outputs are intact, otherwise builds it. Builds are recorded in the state store.
+    """
+    with span("build_cache_check", "build", recipe=str(path)) as s:
+        inputs_hash = build_inputs_hash(path)
+        plugin_dirs = state.reusable_build(path, inputs_hash)
+        s.set(cached=plugin_dirs is not None)
+    if plugin_dirs is not None:
+        print(f"[CACHED] {path} is unchanged since its last build")
+        return plugin_dirs
+
+    build_id = state.start_build(path, inputs_hash)
+    try:
+        plugin_dirs = build_recipe(path, build_dir, registry_dir)
+    except Exception as e:
+        state.finish_build(build_id, "failed", log=str(e))
+        raise
+
+    state.finish_build(build_id, "passed", plugin_dirs, plugin_artifacts(plugin_dirs))
+    return plugin_dirs
+
+def build_recipe(path, build_dir, registry_dir):
+    """
+    Builds one recipe and writes a plugin to the registry directory for each
+    of its operations. Returns the version directories of those plugins.
+    """
+    path = Path(path).resolve()
+
+    with open(path, 'r') as file:
+        recipe = yaml.safe_load(file)
+
+    print(f"Attempting to build: {recipe["name"]}")
+    with span("build_recipe", "build", recipe=recipe["name"], path=str(path)):
+        outputs = build_outputs(recipe, path.parent, build_dir)
+        plugin_dirs = [
+            write_plugin(recipe, operation, outputs, registry_dir, recipe_dir=path.parent)
+            for operation in recipe["operations"]
+        ]
+
+    print(f"Finished building {recipe["name"]}")
+    return plugin_dirs
+
+def build_outputs(recipe, recipe_dir, build_dir, source_dirs=None):
+    """
+    Builds every runtime of a recipe into the build directory.
+    source_dirs: runtime -> checkout to build in and keep, instead of a fresh clone
+    Returns the output directory of each runtime.
+    """
+    source_dirs = source_dirs or {}
+    reset_dir(build_dir)
+
+    outputs = {}
+    for runtime in recipe['build'].keys():
+        with span("build_runtime", "build", recipe=recipe["name"], runtime=runtime) as s:
             if runtime == "wasm":
-                recipe_dir = path.parent
-                outputs["wasm"] = build_wasm(recipe, recipe_dir, build_dir)
+                outputs["wasm"] = build_wasm(recipe, recipe_dir, build_dir, source_dirs.get("wasm"))
             elif runtime == "native":
                 source = (
                     recipe["source"]["repo"],
                     recipe["source"].get("tag"),
                     recipe["source"].get("commit")
                 )
-                outputs["native"] = build_native(
+                outputs["native"] = get_builder("native")(
                     recipe["name"],
                     recipe['build']["native"],
                     source,
-                    output_dir=build_dir
+                    output_dir=build_dir,
+                    source_dir=source_dirs.get("native")
                 )
+            s.set(built=bool(outputs.get(runtime)))
+    return outputs
+
+def write_plugin(recipe, operation, outputs, registry_dir, fetch_license=True, recipe_dir=None):
+    """
+    Writes the plugin of one operation from the built outputs: its runtime
+    files, bundle.json and license. Returns its version directory.
+    Benchmarks stored next to the recipe by hub bench are merged into bundle.json.
+    """
+    with span("write_plugin", "build", operation=operation["id"]):
+        return _write_plugin(recipe, operation, outputs, registry_dir, fetch_license, recipe_dir)
+
+def _write_plugin(recipe, operation, outputs, registry_dir, fetch_license, recipe_dir):
+    plugin_dir = f"{registry_dir}/{operation['id']}/{recipe['version']}"
+    os.makedirs(plugin_dir, exist_ok=True)
+
+    bundle = operation
+    bundle["runtime"] = {
+        "modes": recipe["runtime"]["modes"],
+    }
+
+    if "github" in recipe['source']["repo"] and fetch_license:
+        license_files = recipe.get("license", {}).get("files")
+        download_github_license(recipe["source"]["repo"], f"{plugin_dir}/LICENSE", license_files)
+
+    for runtime in recipe['build'].keys():
+        runtime_dir = f"{plugin_dir}/runtime/{runtime}"
+        os.makedirs(runtime_dir, exist_ok=True)
+
+        # TODO deal with shared binaries
+        bin_name = operation["bin"]
+        output_dir = outputs[runtime]
+        if not output_dir: continue
+
+        if runtime == "wasm":
+            copy_file(f"{output_dir}/{bin_name}.js", f"{runtime_dir}/{bin_name}.js")
+            copy_file(f"{output_dir}/{bin_name}.wasm", f"{runtime_dir}/{bin_name}.wasm")
+        elif runtime == "native":
+            copy_file(f"{output_dir}/{bin_name}", f"{runtime_dir}/{bin_name}")
+            st = os.stat(f"{runtime_dir}/{bin_name}")
+            os.chmod(f"{runtime_dir}/{bin_name}", st.st_mode | stat.S_IEXEC)
+
+        if runtime == "wasm":
+            bundle["runtime"]["wasm"] = {
+                "wasm_digest": generate_digest(f"{runtime_dir}/{bin_name}.wasm"),
+                "js_digest":generate_digest(f"{runtime_dir}/{bin_name}.js"),
+            }
 
-        for operation in recipe["operations"]:
-            plugin_dir = f"{registry_dir}/{operation['id']}/{recipe['version']}"
-            os.makedirs(plugin_dir, exist_ok=True)
-
-            bundle = operation
-            bundle["runtime"] = {
-                "modes": recipe["runtime"]["modes"],
+        elif runtime == "native":
+            bundle["runtime"]["native"] = {
+                "digest": generate_digest(f"{runtime_dir}/{bin_name}"),
             }
 
-            if "github" in recipe['source']["repo"]:
-                license_files = recipe.get("license", {}).get("files")
-                download_github_license(recipe["source"]["repo"], f"{plugin_dir}/LICENSE", license_files)
-
-            for runtime in build_runtimes:
-                runtime_dir = f"{plugin_dir}/runtime/{runtime}"
-                os.makedirs(runtime_dir, exist_ok=True)
-
-                # TODO deal with shared binaries
-                bin_name = operation["bin"]
-                output_dir = outputs[runtime]
-                if not output_dir: continue
-
-                if runtime == "wasm":
-                    shutil.copyfile(f"{output_dir}/{bin_name}.js", f"{runtime_dir}/{bin_name}.js")
-                    shutil.copyfile(f"{output_dir}/{bin_name}.wasm", f"{runtime_dir}/{bin_name}.wasm")
-                elif runtime == "native":
-                    shutil.copyfile(f"{output_dir}/{bin_name}", f"{runtime_dir}/{bin_name}")
-                    st = os.stat(f"{runtime_dir}/{bin_name}")
-                    os.chmod(f"{runtime_dir}/{bin_name}", st.st_mode | stat.S_IEXEC)
-
-                if runtime == "wasm":
-                    bundle["runtime"]["wasm"] = {
-                        "wasm_digest": generate_digest(f"{runtime_dir}/{bin_name}.wasm"),
-                        "js_digest":generate_digest(f"{runtime_dir}/{bin_name}.js"),
-                    }
-
-                elif runtime == "native":
-                    bundle["runtime"]["native"] = {
-                        "digest": generate_digest(f"{runtime_dir}/{bin_name}"),
-                    }
-
-            with open(f"{plugin_dir}/bundle.json", "w") as f:
-                json.dump(bundle, f, indent=4)
-            
-            #TODO sbom.json
-
-        print(f"Finished building {recipe["name"]}")
-
-    shutil.rmtree(build_dir)
\ No newline at end of file
+    if recipe_dir:
+        from tests.bench import load_benchmarks
+
+        benchmarks = load_benchmarks(recipe_dir, operation["id"], recipe["version"])
+        if benchmarks:
+            bundle["benchmarks"] = benchmarks
+
+    with open(f"{plugin_dir}/bundle.json", "w") as f:
+        json.dump(bundle, f, indent=4)
+    
+    #TODO sbom.json
+
+    return Path(plugin_dir).resolve()
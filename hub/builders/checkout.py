@@ -0,0 +1,34 @@
+import shutil
+import subprocess
+import tempfile
+
+from tracing.tracing import span
+
+
+def clone_source(source, directory):
+    """
+    Clones the recipe's source repository into directory, at its tag or commit
+    """
+    repo_url, tag, commit = source
+
+    with span("git_clone", "build", repo=repo_url, ref=tag or commit):
+        subprocess.run(["git", "clone", repo_url, str(directory)], check=True)
+
+        if tag:
+            subprocess.run(["git", "checkout", "tags/" + tag], cwd=directory, check=True)
+        elif commit:
+            subprocess.run(["git", "checkout", commit], cwd=directory, check=True)
+
+
+def fresh_clone(source, tool_name):
+    """
+    Clones the source into a new temporary directory, which the caller
+    removes. Directories that already exist are never built in or removed.
+    """
+    directory = tempfile.mkdtemp(prefix=f"biochef-{tool_name}-")
+    try:
+        clone_source(source, directory)
+    except BaseException:
+        shutil.rmtree(directory, ignore_errors=True)
+        raise
+    return directory
@@ -1,11 +1,16 @@
 import subprocess
 import os
 import shutil
+from functools import lru_cache
 
-def activate_emscripten_version(emscripten_version):
-    if not emscripten_version:
-        return
+from builders.checkout import clone_source, fresh_clone
+from tracing.tracing import span, tree_size
+
+# Version activated by this process, a daemon only reactivates emsdk when it changes
+active_version = None
 
+@lru_cache(maxsize=None)
+def emsdk_versions():
     emsdk = os.environ.get("EMSDK", "/opt/emsdk")
 
     result = subprocess.run(
@@ -14,8 +19,19 @@ def activate_emscripten_version(emscripten_version):
         text=True,
         check=True,
     )
+    return result.stdout
 
-    if emscripten_version not in result.stdout:
+def activate_emscripten_version(emscripten_version):
+    global active_version
+
+    if not emscripten_version:
+        return
+    if emscripten_version == active_version:
+        return True
+
+    emsdk = os.environ.get("EMSDK", "/opt/emsdk")
+
+    if emscripten_version not in emsdk_versions():
         print(
             f"Emscripten version {emscripten_version} does not exist\n"
         )
@@ -31,25 +47,30 @@ def activate_emscripten_version(emscripten_version):
         check=True,
     )
     
+    active_version = emscripten_version
     return True
 
-def build(tool_name, recipe_dir, emscripten_settings, source, output_dir="build"):
-    repo_url, tag, commit = source
-    
+def build(tool_name, recipe_dir, emscripten_settings, source, output_dir="build", source_dir=None):
+    """
+    Builds in a fresh clone of the source in a temporary directory, removed afterwards.
+    With a source_dir, builds in that checkout instead, cloned there if
+    missing, and keeps it so the next build only recompiles what changed.
+    """
     emscripten_version = emscripten_settings.get("emscriptenVersion")
-    if not activate_emscripten_version(emscripten_version):
-        return None
-    
-    if os.path.exists(tool_name): shutil.rmtree(tool_name)
-    subprocess.run(["git", "clone", repo_url, tool_name], check=True)
+    with span("emsdk_activate", "build", version=emscripten_version, cached=emscripten_version == active_version):
+        if not activate_emscripten_version(emscripten_version):
+            return None
     
-    base_dir = os.getcwd()
-    os.chdir(tool_name)
+    keep_source = source_dir is not None
+    if not keep_source:
+        source_dir = fresh_clone(source, tool_name)
+    elif not os.path.exists(source_dir):
+        clone_source(source, source_dir)
     
-    if tag:
-        subprocess.run(["git", "checkout", "tags/" + tag], check=True)
-    elif commit:
-        subprocess.run(["git", "checkout", commit], check=True)
+    # Resolved here, the build runs with cwd set instead of changing the
+    # process directory, which other threads of `hub run` rely on
+    dest_dir = os.path.join(os.path.abspath(output_dir), tool_name)
+    source_dir = os.path.abspath(source_dir)
 
     # NOTE(Andrade) 
     # this should probably be somewhere else instead of being hardcoded here
@@ -73,26 +94,28 @@ def build(tool_name, recipe_dir, emscripten_settings, source, output_dir="build"
     try:
         build_script = emscripten_settings["buildScript"]
         
-        shutil.copy(f"{recipe_dir}/{build_script}", ".")
-        subprocess.run(f"bash ./{build_script}", shell=True, check=True, env=env)
+        shutil.copy(f"{recipe_dir}/{build_script}", source_dir)
+        with span("compile", "build", tool=tool_name, runtime="wasm", builder="emscripten") as s:
+            subprocess.run(f"bash ./{build_script}", shell=True, check=True, env=env, cwd=source_dir)
+            s.set(exit_code=0)
         
         outputDir = emscripten_settings.get('outputDir', '.')
-        from_dir = f"{base_dir}/{tool_name}/{outputDir}"
-        dest_dir = f"{base_dir}/{output_dir}/{tool_name}"
-        shutil.copytree(
-            from_dir,
-            dest_dir,
-            dirs_exist_ok=True,
-            symlinks=True,
-            ignore=shutil.ignore_patterns(".*")
-        )
+        from_dir = f"{source_dir}/{outputDir}"
+        with span("copy_outputs", "build", tool=tool_name) as s:
+            shutil.copytree(
+                from_dir,
+                dest_dir,
+                dirs_exist_ok=True,
+                symlinks=True,
+                ignore=shutil.ignore_patterns(".*")
+            )
+            s.set(bytes=tree_size(dest_dir))
 
         return dest_dir
     except subprocess.CalledProcessError as e:
         print(f"Error building with emscripten: {e}")
         return None
     finally:
-        # Remove the git repository
-        shutil.rmtree(f"{base_dir}/{tool_name}")
-        # Return to the correct dir
-        os.chdir(base_dir)
\ No newline at end of file
+        # Remove the git repository, unless it is kept for the next build
+        if not keep_source:
+            shutil.rmtree(source_dir)
\ No newline at end of file
@@ -2,47 +2,54 @@ import subprocess
 import os
 import shutil
 
-def build(tool_name, settings, source, output_dir="build"):
+from builders.checkout import clone_source, fresh_clone
+from tracing.tracing import span, tree_size
+
+def build(tool_name, settings, source, output_dir="build", source_dir=None):
+    """
+    Builds in a fresh clone of the source in a temporary directory, removed afterwards.
+    With a source_dir, builds in that checkout instead, cloned there if
+    missing, and keeps it so the next build only recompiles what changed.
+    """
     buildsystem = settings['buildsystem']
 
     if buildsystem == "make":
-        repo_url, tag, commit = source
-
-        subprocess.run(["git", "clone", repo_url, tool_name], check=True)
-
-        base_dir = os.getcwd()
-        os.chdir(tool_name)
-
-        if tag:
-            subprocess.run(["git", "checkout", "tags/" + tag], check=True)
-        elif commit:
-            subprocess.run(["git", "checkout", commit], check=True)
-
-        workdir = settings.get("workDir", ".")
-        os.chdir(workdir)
+        keep_source = source_dir is not None
+        if not keep_source:
+            source_dir = fresh_clone(source, tool_name)
+        elif not os.path.exists(source_dir):
+            clone_source(source, source_dir)
+
+        # Resolved here, the build runs with cwd set instead of changing the
+        # process directory, which other threads of `hub run` rely on
+        dest_dir = os.path.join(os.path.abspath(output_dir), tool_name)
+        source_dir = os.path.abspath(source_dir)
+        workdir = os.path.join(source_dir, settings.get("workDir", "."))
 
         try:
-            subprocess.run(f"make", shell=True, check=True)
+            with span("compile", "build", tool=tool_name, runtime="native", builder="make") as s:
+                subprocess.run(f"make", shell=True, check=True, cwd=workdir)
+                s.set(exit_code=0)
 
             outputDir = settings.get('outputDir', '')
-            from_dir = f"{base_dir}/{tool_name}/{outputDir}"
-            dest_dir = f"{base_dir}/{output_dir}/{tool_name}"
-            shutil.copytree(
-                from_dir,
-                dest_dir,
-                dirs_exist_ok=True,
-                symlinks=True,
-                ignore=shutil.ignore_patterns(".*")
-            )
+            from_dir = f"{source_dir}/{outputDir}"
+            with span("copy_outputs", "build", tool=tool_name) as s:
+                shutil.copytree(
+                    from_dir,
+                    dest_dir,
+                    dirs_exist_ok=True,
+                    symlinks=True,
+                    ignore=shutil.ignore_patterns(".*")
+                )
+                s.set(bytes=tree_size(dest_dir))
             
             return dest_dir
         except subprocess.CalledProcessError as e:
             print(f"Error building native binary: {e}")
             return None
         finally:
-            # Remove the git repository
-            shutil.rmtree(f"{base_dir}/{tool_name}")
-            # Return to the correct dir
-            os.chdir(base_dir)
+            # Remove the git repository, unless it is kept for the next build
+            if not keep_source:
+                shutil.rmtree(source_dir)
 
     return ""
\ No newline at end of file
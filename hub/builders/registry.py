@@ -0,0 +1,27 @@
+import importlib
+from functools import lru_cache
+
+# Builder name: module with its build function, only imported when a recipe uses the builder
+BUILDERS = {
+    "biowasm": "builders.biowasm",
+    "emscripten": "builders.emscripten",
+    "native": "builders.native",
+}
+# Builders installed by other packages register their build function under this group
+ENTRY_POINT_GROUP = "biochef.builders"
+
+
+@lru_cache(maxsize=None)
+def get_builder(name):
+    """
+    Returns the build function of a builder, importing its module on first use
+    """
+    if name in BUILDERS:
+        return importlib.import_module(BUILDERS[name]).build
+
+    from importlib.metadata import entry_points
+
+    for entry_point in entry_points(group=ENTRY_POINT_GROUP):
+        if entry_point.name == name:
+            return entry_point.load()
+    raise ValueError(f"Unknown builder: {name}")
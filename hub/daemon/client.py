@@ -0,0 +1,71 @@
+import json
+import socket
+import sys
+
+
+def connect(socket_path):
+    """
+    Returns a connection to the daemon, or None if none is running
+    """
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(str(socket_path))
+    except (FileNotFoundError, ConnectionRefusedError):
+        connection.close()
+        return None
+    return connection
+
+
+def request(connection, message):
+    """
+    Sends a request and yields the messages the daemon answers with
+    """
+    connection.sendall(json.dumps(message).encode() + b"\n")
+    with connection.makefile("rb") as answers:
+        for line in answers:
+            yield json.loads(line)
+
+
+def follow(connection, message):
+    """
+    Prints the output of a job as the daemon streams it.
+    Returns the exit code of the job.
+    """
+    job_id = None
+    try:
+        for answer in request(connection, message):
+            if "error" in answer and "job" not in answer:
+                print(f"[ERROR] {answer['error']}", file=sys.stderr)
+                return 1
+            if "output" in answer:
+                sys.stdout.write(answer["output"])
+                sys.stdout.flush()
+            elif answer.get("status") == "queued" and answer.get("position", 0) > 1:
+                job_id = answer["job"]
+                print(f"[INFO] Job {job_id} queued behind {answer['position'] - 1} others")
+            elif answer.get("done"):
+                if answer["status"] == "failed":
+                    print(f"[ERROR] Job {answer['job']} failed: {answer['error']}", file=sys.stderr)
+                    return 1
+                return 0
+            else:
+                job_id = answer.get("job", job_id)
+    except KeyboardInterrupt:
+        print(f"\n[INFO] Job {job_id} keeps running in the daemon, follow it with: hub jobs {job_id}", file=sys.stderr)
+        return 130
+    finally:
+        connection.close()
+
+    print("[ERROR] The daemon closed the connection", file=sys.stderr)
+    return 1
+
+
+def forward(socket_path, argv):
+    """
+    Runs a command in the daemon if one is running.
+    Returns its exit code, or None to run the command in this process.
+    """
+    connection = connect(socket_path)
+    if connection is None:
+        return None
+    return follow(connection, {"action": "run", "argv": argv})
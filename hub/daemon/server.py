@@ -0,0 +1,298 @@
+import codecs
+import json
+import os
+import socket
+import socketserver
+import sys
+import threading
+import time
+import traceback
+from collections import OrderedDict
+from pathlib import Path
+
+# Finished jobs kept so clients can still read their output
+JOB_HISTORY = 100
+READ_SIZE = 1 << 16
+
+
+class Job:
+    """
+    A command the daemon runs, with its output as it is produced.
+    Clients stream the output from any offset until the job is finished.
+    """
+
+    def __init__(self, job_id, argv):
+        self.id = job_id
+        self.argv = argv
+        self.status = "queued"
+        self.error = None
+        self.output = []
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.condition = threading.Condition()
+
+    def append(self, text):
+        with self.condition:
+            self.output.append(text)
+            self.condition.notify_all()
+
+    def set_status(self, status, error=None):
+        with self.condition:
+            self.status = status
+            self.error = error
+            if status == "running":
+                self.started = time.time()
+            elif status in ("passed", "failed"):
+                self.finished = time.time()
+            self.condition.notify_all()
+
+    def done(self):
+        return self.status in ("passed", "failed")
+
+    def stream(self):
+        """
+        Yields the output produced so far, then new output until the job is finished
+        """
+        sent = 0
+        while True:
+            with self.condition:
+                while sent == len(self.output) and not self.done():
+                    self.condition.wait()
+                chunks = self.output[sent:]
+                finished = self.done()
+            sent += len(chunks)
+            if chunks:
+                yield "".join(chunks)
+            if finished and sent == len(self.output):
+                return
+
+    def summary(self):
+        return {
+            "job": self.id,
+            "argv": self.argv,
+            "status": self.status,
+            "error": self.error,
+            "created": self.created,
+            "duration": (self.finished or time.time()) - self.started if self.started else None,
+        }
+
+
+class OutputCapture:
+    """
+    Redirects the process stdout and stderr to a job while it runs, so the
+    output of the builders' subprocesses (git, emsdk, build scripts) is
+    streamed to the client along with what hub prints
+    """
+
+    def __init__(self, job):
+        self.job = job
+
+    def read(self, fd):
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        while data := os.read(fd, READ_SIZE):
+            self.job.append(decoder.decode(data))
+        self.job.append(decoder.decode(b"", final=True))
+        os.close(fd)
+
+    def __enter__(self):
+        sys.stdout.flush()
+        sys.stderr.flush()
+        read_fd, write_fd = os.pipe()
+        self.saved = os.dup(1), os.dup(2)
+        os.dup2(write_fd, 1)
+        os.dup2(write_fd, 2)
+        os.close(write_fd)
+        self.reader = threading.Thread(target=self.read, args=(read_fd,), daemon=True)
+        self.reader.start()
+        return self
+
+    def __exit__(self, *exc):
+        sys.stdout.flush()
+        sys.stderr.flush()
+        # Closing the last write end ends the reader
+        os.dup2(self.saved[0], 1)
+        os.dup2(self.saved[1], 2)
+        for fd in self.saved:
+            os.close(fd)
+        self.reader.join()
+
+
+def warm_up(registries=()):
+    """
+    Imports and initializes what every command would otherwise redo:
+    modules, the compiled recipe schema, the Docker client, the emsdk
+    versions and the registry logins
+    """
+    from validate.validate import get_validator
+    import builders.builder  # noqa: F401
+    import utils.data_types  # noqa: F401
+    import tests.test  # noqa: F401
+
+    get_validator()
+
+    try:
+        from builders.biowasm import get_client
+
+        get_client().ping()
+        print("[INFO] Connected to Docker")
+    except Exception as e:
+        print(f"[WARNING] Docker is not available, biowasm builds will fail: {e}")
+
+    from builders.emscripten import emsdk_versions
+
+    if Path(os.environ.get("EMSDK", "/opt/emsdk"), "emsdk").exists():
+        emsdk_versions()
+        print("[INFO] Listed the emsdk versions")
+
+    if registries:
+        from publish.publish import get_oras_client
+
+        for registry in registries:
+            get_oras_client(registry)
+            print(f"[INFO] Logged in to {registry}")
+
+
+class Daemon:
+    """
+    Keeps a hub process warm and runs the commands clients send over a Unix
+    socket. Commands share the build directory, the registry tree and the
+    working directory, so they run one at a time in the order received.
+
+    Every request is a JSON line, answered with JSON lines:
+      {"action": "run", "argv": [...]}  queues a command and streams its output
+      {"action": "attach", "job": id}   streams the output of a queued or past job
+      {"action": "jobs"}                lists the jobs
+      {"action": "shutdown"}            stops the daemon after the running job
+    """
+
+    def __init__(self, socket_path, execute):
+        self.socket_path = Path(socket_path)
+        self.execute = execute
+        self.lock = threading.Lock()
+        self.jobs = OrderedDict()
+        self.next_id = 1
+        self.pending = []
+        self.wakeup = threading.Condition(self.lock)
+        self.stopping = False
+
+    def submit(self, argv):
+        with self.lock:
+            job = Job(self.next_id, argv)
+            self.next_id += 1
+            self.jobs[job.id] = job
+            if self.stopping:
+                job.set_status("failed", "the daemon is stopping")
+            else:
+                self.pending.append(job)
+                self.wakeup.notify()
+
+            finished = [job_id for job_id, old in self.jobs.items() if old.done()]
+            for job_id in finished[:max(len(finished) - JOB_HISTORY, 0)]:
+                del self.jobs[job_id]
+        return job
+
+    def run_job(self, job):
+        job.set_status("running")
+        print(f"[INFO] Job {job.id} started: hub {' '.join(job.argv)}")
+        status, error = "passed", None
+        with OutputCapture(job):
+            try:
+                self.execute(job.argv)
+            except SystemExit as e:
+                if e.code:
+                    status, error = "failed", f"exited with {e.code}"
+            except BaseException as e:
+                traceback.print_exc()
+                status, error = "failed", str(e) or type(e).__name__
+        job.set_status(status, error)
+        print(f"[INFO] Job {job.id} {status} in {job.finished - job.started:.1f}s")
+
+    def worker(self):
+        while True:
+            with self.lock:
+                while not self.pending and not self.stopping:
+                    self.wakeup.wait()
+                if self.stopping:
+                    for job in self.pending:
+                        job.set_status("failed", "the daemon stopped before running it")
+                    self.pending.clear()
+                    return
+                job = self.pending.pop(0)
+            self.run_job(job)
+
+    def handle(self, request, send):
+        action = request.get("action")
+        if action == "run":
+            job = self.submit(request["argv"])
+            send({"job": job.id, "status": job.status, "position": len(self.pending)})
+            self.stream(job, send)
+        elif action == "attach":
+            job = self.jobs.get(request.get("job"))
+            if job is None:
+                send({"error": f"No job {request.get('job')}"})
+                return
+            send({"job": job.id, "status": job.status})
+            self.stream(job, send)
+        elif action == "jobs":
+            with self.lock:
+                send({"jobs": [job.summary() for job in self.jobs.values()]})
+        elif action == "shutdown":
+            with self.lock:
+                self.stopping = True
+                self.wakeup.notify()
+            send({"status": "stopping"})
+            threading.Thread(target=self.server.shutdown, daemon=True).start()
+        else:
+            send({"error": f"Unknown action {action}"})
+
+    def stream(self, job, send):
+        for text in job.stream():
+            send({"output": text})
+        send({"job": job.id, "status": job.status, "error": job.error, "done": True})
+
+    def serve(self):
+        if self.socket_path.exists():
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(str(self.socket_path))
+                raise RuntimeError(f"A hub daemon is already listening on {self.socket_path}")
+            except (ConnectionRefusedError, FileNotFoundError):
+                self.socket_path.unlink(missing_ok=True)
+            finally:
+                probe.close()
+
+        daemon = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                line = self.rfile.readline()
+                if not line:
+                    return
+
+                def send(message):
+                    self.wfile.write(json.dumps(message).encode() + b"\n")
+                    self.wfile.flush()
+
+                try:
+                    daemon.handle(json.loads(line), send)
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client went away, its job keeps running
+                    pass
+
+        self.server = socketserver.ThreadingUnixStreamServer(str(self.socket_path), Handler)
+        self.server.daemon_threads = True
+        worker = threading.Thread(target=self.worker, name="jobs")
+        worker.start()
+        print(f"[INFO] Listening on {self.socket_path}")
+        try:
+            self.server.serve_forever()
+        except KeyboardInterrupt:
+            print("[INFO] Stopping after the running job")
+        finally:
+            with self.lock:
+                self.stopping = True
+                self.wakeup.notify()
+            worker.join()
+            self.server.server_close()
+            self.socket_path.unlink(missing_ok=True)
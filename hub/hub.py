@@ -1,19 +1,29 @@
 import argparse
 import json
 import os
+import sys
 
-BUILD_FILE = ".build" # file containing the validation results
+STATE_FILE = ".build.db" # SQLite database of validations, builds, artifacts, test results and publishes
 BUILD_DIR = "build" # directory where the builders should output the results
 REGISTRY_DIR = "registry"
+TEST_CACHE_FILE = ".test_cache" # results of passed tests, reused while their inputs are unchanged
+INDEX_CACHE_DIR = ".index_cache" # blobs of the published index artifacts, by digest
+VERIFY_CACHE_FILE = ".verify_cache" # digests of verified files, reused while their size and mtime are unchanged
+WATCH_DIR = ".watch" # source checkouts, build outputs and plugins of hub watch, kept between changes
+SOCKET_FILE = ".hub.sock" # Unix socket of the daemon started by hub serve in this directory
+DAEMON_COMMANDS = ["validate", "build", "test", "publish", "run"] # forwarded to the daemon when it is running
+
+def get_state():
+    from state.state import StateStore
+
+    return StateStore(STATE_FILE)
 
 def get_valid_recipes():
-    if os.path.exists(BUILD_FILE):
-        with open(BUILD_FILE) as f:
-            build_data = json.load(f)
-            return build_data["paths"]
-    else:
+    paths = get_state().valid_recipes()
+    if not paths:
         print("No validated paths found. Run validation first.")
         return None
+    return paths
 
 def validate_cmd(args):
     paths = args.paths
@@ -33,6 +43,7 @@ def validate_cmd(args):
     else:
         print("Type definition example validation successful")
 
+    state = get_state()
     print(f"Validating files: {paths}")
     valid_paths = []
     for path in paths:
@@ -41,25 +52,26 @@ def validate_cmd(args):
                 print(f"Recipe validation successful: {path}")
                 valid_paths.append(path)
             else:
+                state.record_recipe(path, "invalid")
                 raise ValueError(f"Recipe validation failed: {path}")
-            
 
-    build_data = {
-        "paths": valid_paths
-    }
-    with open(BUILD_FILE, "w") as f:
-        json.dump(build_data, f)
+    validation_id = state.new_validation()
+    for path in valid_paths:
+        state.record_recipe(path, "valid", validation_id)
 
 def build_cmd(args):
     from builders.builder import build_plugins
 
     recipes = get_valid_recipes()
     if not recipes: return
-    build_plugins(recipes, BUILD_DIR, REGISTRY_DIR)
+    build_plugins(recipes, BUILD_DIR, REGISTRY_DIR, get_state())
 
 def test_cmd(args):
-    from tests.test import test_tools
+    from tests.test import test_tools, set_seed, format_case_matrix
+    from tests.cache import TestCache
+    from tests.perf import load_baselines, update_baselines, format_diff_table
     from utils.type_definitions import validate_type_examples
+    from utils.data_types import sample_windows_for_confidence
 
     type_example_failures = validate_type_examples()
     if type_example_failures:
@@ -70,15 +82,124 @@ def test_cmd(args):
     else:
         print("Type definition example validation successful")
 
-    failed_tests = test_tools(REGISTRY_DIR)
-    
+    sample_windows = args.sample
+    if args.sample_confidence:
+        sample_windows = sample_windows_for_confidence(args.sample_confidence, args.sample_defect_rate)
+
+    baselines, baseline_sources = load_baselines(get_valid_recipes())
+
+    if args.scale:
+        from utils.generators import validate_generators
+
+        generator_failures = validate_generators()
+        if generator_failures:
+            raise RuntimeError(f"The following generators failed: {generator_failures}")
+
+    if args.seed is not None:
+        set_seed(args.seed)
+
+    # Baselines are only updated from fresh measurements
+    cache = None if args.no_cache or args.update_baselines else TestCache(TEST_CACHE_FILE)
+    report = test_tools(
+        REGISTRY_DIR, sample_windows, args.jobs, args.repeat, baselines, args.tolerance,
+        args.scale, args.timeout, cache
+    )
+    if cache is not None:
+        cache.save()
+        print(f"[INFO] {cache.misses} tools executed, {cache.hits} results reused from {TEST_CACHE_FILE}")
+    get_state().record_tests(report)
+
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=4)
+
+    if report:
+        print(format_case_matrix(report))
+
+    diff_table = format_diff_table(report)
+    if diff_table:
+        print(diff_table)
+
+    if args.update_baselines:
+        update_baselines(report, baseline_sources)
+
+    failed_tests = [result["case"]["id"] for result in report if result["status"] == "failed"]
     if len(failed_tests) > 0:
         print(f"The following tools failed the tests: {failed_tests}")
     else:
         print("All tests passed")
+
+    regressed = [result["id"] for result in report if result.get("regressions")]
+    if regressed:
+        raise RuntimeError(f"Performance regressions in: {regressed}")
         
     pass
 
+def bench_cmd(args):
+    from tests.test import set_seed
+    from tests.bench import bench_tools, format_bench_table, BENCH_SIZES
+
+    if args.seed is not None:
+        set_seed(args.seed)
+
+    sizes = args.sizes.split(",") if args.sizes else BENCH_SIZES
+    report = bench_tools(REGISTRY_DIR, get_valid_recipes(), sizes, args.repeat, args.timeout)
+    if not report:
+        print("No tools were benchmarked")
+        return
+
+    print(format_bench_table(report))
+
+def run_cmd(args):
+    from pipeline.pipeline import Pipeline
+    from tests.cache import TestCache
+    from tests.perf import load_baselines
+    from utils.type_definitions import validate_type_examples
+
+    type_example_failures = validate_type_examples()
+    if type_example_failures:
+        raise ValueError(f"Type definition example validation failed: {type_example_failures}")
+
+    baselines, _ = load_baselines(args.paths)
+    cache = None if args.no_cache else TestCache(TEST_CACHE_FILE)
+    pipeline = Pipeline(
+        BUILD_DIR, REGISTRY_DIR, args.registry, args.jobs, args.publish_jobs,
+        cache, baselines, args.tolerance, get_state()
+    )
+    failures = pipeline.run(args.paths)
+    if cache is not None:
+        cache.save()
+
+    if failures:
+        raise RuntimeError(f"The following recipes failed: {failures}")
+
+def watch_cmd(args):
+    from watch.watch import RecipeWatch
+    from tests.cache import TestCache
+
+    cache = None if args.no_cache else TestCache(TEST_CACHE_FILE)
+    RecipeWatch(args.recipe, WATCH_DIR, args.source, args.jobs, cache, args.tolerance).run()
+
+def status_cmd(args):
+    status = get_state().status()
+    if args.json:
+        print(json.dumps(status, indent=4))
+        return
+
+    if not status:
+        print("No recipes validated yet")
+    for recipe in status:
+        selected = "" if recipe["selected"] else " (not in the last validation)"
+        duration = f" in {recipe['build_duration']:.1f}s" if recipe["build_duration"] is not None else ""
+        print(f"{recipe['path']}{selected}")
+        print(f"  validation: {recipe['validation']}, build: {recipe['build'] or 'never'}{duration}")
+        if recipe["build"] == "failed" and recipe["build_log"]:
+            print(f"  error: {recipe['build_log']}")
+        for plugin in recipe["plugins"]:
+            tests = ", ".join(f"{count} {status}" for status, count in sorted(plugin["tests"].items())) or "not tested"
+            published = ", ".join(f"{registry} ({status})" for registry, status in plugin["published"].items()) or "not published"
+            print(f"  {plugin['plugin']}:{plugin['version']}: {plugin['files']} files, {plugin['bytes']} bytes, {tests}, {published}")
+
 def sbom_cmd(args):
     #TODO
     pass
@@ -91,14 +212,109 @@ def publish_cmd(args):
     from publish.publish import publish_plugins
 
     registry_url = args.registry
-    publish_plugins(registry_url, REGISTRY_DIR)
+    publish_plugins(registry_url, REGISTRY_DIR, args.jobs, get_state())
+
+def search_cmd(args):
+    from publish.search import load_search_index, search
+
+    store = None
+    if not args.offline:
+        if not args.registry:
+            raise argparse.ArgumentError(None, "--registry is required unless searching --offline")
+        from publish.publish import get_oras_client
+        from publish.index import IndexStore
+
+        store = IndexStore(get_oras_client(args.registry, read_only=True), args.registry)
+
+    index = load_search_index(store, INDEX_CACHE_DIR, args.offline)
+    if index is None:
+        print("No search index published yet")
+        return
+
+    results = search(index, " ".join(args.query), args.limit)
+    if args.json:
+        print(json.dumps(results, indent=4))
+        return
+
+    if not results:
+        print("No matching operations")
+    for result in results:
+        print(f"{result['package']:<40} {result['name'] or '':<30} {result['category'] or ''}")
+
+def mirror_cmd(args):
+    from publish.publish import get_oras_client
+    from mirror.mirror import mirror_registry
+
+    mirror_registry(get_oras_client(args.registry, args.jobs, read_only=True), args.registry, args.dir, args.jobs)
+
+def verify_cmd(args):
+    from verify.verify import verify, DigestCache
+
+    index_entries = None
+    if args.registry:
+        from publish.publish import get_oras_client
+        from publish.index import IndexStore
+
+        index_entries = IndexStore(get_oras_client(args.registry, read_only=True), args.registry).fetch(cache_dir=INDEX_CACHE_DIR)
+
+    cache = None if args.no_cache else DigestCache(VERIFY_CACHE_FILE)
+    mismatches, checked = verify(args.paths, args.jobs, cache, index_entries)
+    if cache is not None:
+        cache.save()
+        print(f"[INFO] {cache.misses} files hashed, {cache.hits} digests reused from {VERIFY_CACHE_FILE}")
+
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(mismatches, f, indent=4)
+
+    for mismatch in mismatches:
+        print(f"[ERROR] {mismatch['path']}: {mismatch['reason']}")
+    if mismatches:
+        raise RuntimeError(f"{len(mismatches)} of the verified files do not match their digests")
+    print(f"All {checked} files match their digests")
+
+def serve_cmd(args):
+    from daemon.server import Daemon, warm_up
+
+    parser = get_parser()
+
+    def execute(argv):
+        run_command(parser.parse_args(argv))
+
+    warm_up(args.registry)
+    Daemon(SOCKET_FILE, execute).serve()
+
+def jobs_cmd(args):
+    from daemon.client import connect, follow, request
+
+    connection = connect(SOCKET_FILE)
+    if connection is None:
+        print(f"No daemon is listening on {SOCKET_FILE}, start one with hub serve")
+        return
+
+    if args.stop:
+        for answer in request(connection, {"action": "shutdown"}):
+            print(f"[INFO] Daemon {answer['status']}")
+        return
+    if args.job is not None:
+        sys.exit(follow(connection, {"action": "attach", "job": args.job}))
+
+    for answer in request(connection, {"action": "jobs"}):
+        if not answer["jobs"]:
+            print("No jobs yet")
+        for job in answer["jobs"]:
+            duration = f" {job['duration']:.1f}s" if job["duration"] is not None else ""
+            error = f": {job['error']}" if job["error"] else ""
+            print(f"{job['job']:>4} {job['status']:<8}{duration} hub {' '.join(job['argv'])}{error}")
 
 def index_cmd(args):
     #TODO
     pass
 
-def main():
+def get_parser():
     parser = argparse.ArgumentParser()
+    parser.add_argument("--no-daemon", action="store_true", help=f"Run the command in this process even if hub serve is listening on {SOCKET_FILE}")
+    parser.add_argument("--trace", help="Write a Chrome trace (chrome://tracing, Perfetto) of the command's phases to this file and print a summary")
     subparsers = parser.add_subparsers(dest="command", required=True)
 
     validate_parser = subparsers.add_parser("validate")
@@ -109,8 +325,48 @@ def main():
     build_parser.set_defaults(func=build_cmd)
 
     test_parser = subparsers.add_parser("test")
+    test_parser.add_argument("--jobs", "-j", type=int, default=os.cpu_count(), help="Number of tests to run concurrently")
+    test_parser.add_argument("--report", help="Write a JSON report of the test results to this file")
+    test_parser.add_argument("--repeat", type=int, default=1, help="Run each tool N times and keep the median measurements")
+    test_parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown or memory growth over the baseline (0.25 = 25%%)")
+    test_parser.add_argument("--update-baselines", action="store_true", help="Store the measurements as the new baselines of the tested recipes, implies --no-cache")
+    test_parser.add_argument("--scale", help="Test with generated inputs of this size (e.g. 1GB, 100000records) instead of the examples")
+    test_parser.add_argument("--timeout", type=float, default=10, help="Timeout in seconds for tools without a baseline")
+    test_parser.add_argument("--sample", type=int, default=0, help="Validate large outputs using N random windows instead of in full")
+    test_parser.add_argument("--sample-confidence", type=float, help="Pick the number of windows needed to detect a defect with this confidence")
+    test_parser.add_argument("--sample-defect-rate", type=float, default=0.01, help="Fraction of a large output a defect is assumed to cover")
+    test_parser.add_argument("--seed", type=int, help="Use a fixed seed instead of a random one, cached results are only reused with the same seed")
+    test_parser.add_argument("--no-cache", action="store_true", help="Run every test instead of reusing cached results")
     test_parser.set_defaults(func=test_cmd)
 
+    bench_parser = subparsers.add_parser("bench")
+    bench_parser.add_argument("--sizes", help="Comma separated ladder of generated input sizes (default 64KB,1MB,16MB)")
+    bench_parser.add_argument("--repeat", type=int, default=3, help="Run each size N times and keep the median measurements")
+    bench_parser.add_argument("--timeout", type=float, default=60, help="Timeout in seconds for a single run")
+    bench_parser.add_argument("--seed", type=int, help="Seed of the generated inputs")
+    bench_parser.set_defaults(func=bench_cmd)
+
+    run_parser = subparsers.add_parser("run")
+    run_parser.add_argument("paths", nargs="+", help="Recipes to validate, build, test and publish")
+    run_parser.add_argument("--registry", help="URL of the registry to publish to, recipes are only tested without it")
+    run_parser.add_argument("--jobs", "-j", type=int, default=os.cpu_count(), help="Number of tests to run concurrently")
+    run_parser.add_argument("--publish-jobs", type=int, default=8, help="Number of plugins to push concurrently")
+    run_parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown or memory growth over the baseline (0.25 = 25%%)")
+    run_parser.add_argument("--no-cache", action="store_true", help="Run every test instead of reusing cached results")
+    run_parser.set_defaults(func=run_cmd)
+
+    watch_parser = subparsers.add_parser("watch")
+    watch_parser.add_argument("recipe", help="Recipe directory, or recipe file, to rebuild and retest on every change")
+    watch_parser.add_argument("--source", help="Local checkout of the tool's source to build from and watch, instead of a clone of the pinned source")
+    watch_parser.add_argument("--jobs", "-j", type=int, default=os.cpu_count(), help="Number of tests to run concurrently")
+    watch_parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown or memory growth over the baseline (0.25 = 25%%)")
+    watch_parser.add_argument("--no-cache", action="store_true", help="Run every test instead of reusing cached results")
+    watch_parser.set_defaults(func=watch_cmd)
+
+    status_parser = subparsers.add_parser("status")
+    status_parser.add_argument("--json", action="store_true", help="Print the state as JSON")
+    status_parser.set_defaults(func=status_cmd)
+
     sbom_parser = subparsers.add_parser("sbom")
     sbom_parser.set_defaults(func=sbom_cmd)
 
@@ -119,13 +375,71 @@ def main():
 
     publish_parser = subparsers.add_parser("publish")
     publish_parser.add_argument('--registry', required=True, help="URL of the registry to publish to")
+    publish_parser.add_argument('--jobs', '-j', type=int, default=8, help="Number of plugins to push concurrently")
     publish_parser.set_defaults(func=publish_cmd)
 
+    search_parser = subparsers.add_parser("search")
+    search_parser.add_argument("query", nargs="+", help="Words to look for, and category:, input: or output: filters")
+    search_parser.add_argument("--registry", help="URL of the registry to search")
+    search_parser.add_argument("--offline", action="store_true", help=f"Search the index last downloaded to {INDEX_CACHE_DIR}")
+    search_parser.add_argument("--limit", type=int, default=20, help="Maximum number of results")
+    search_parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    search_parser.set_defaults(func=search_cmd)
+
+    mirror_parser = subparsers.add_parser("mirror")
+    mirror_parser.add_argument("registry", help="URL of the registry to mirror")
+    mirror_parser.add_argument("dir", help="Directory of the local mirror, created or updated")
+    mirror_parser.add_argument("--jobs", "-j", type=int, default=8, help="Number of concurrent downloads")
+    mirror_parser.set_defaults(func=mirror_cmd)
+
+    verify_parser = subparsers.add_parser("verify")
+    verify_parser.add_argument("paths", nargs="*", default=[REGISTRY_DIR], help="Registry trees, mirrors or bundle.json files to verify")
+    verify_parser.add_argument("--registry", help="Also check the bundles against the index of this registry")
+    verify_parser.add_argument("--jobs", "-j", type=int, default=os.cpu_count(), help="Number of files hashed concurrently")
+    verify_parser.add_argument("--report", help="Write a JSON report of the mismatches to this file")
+    verify_parser.add_argument("--no-cache", action="store_true", help="Hash every file instead of reusing digests of unchanged files")
+    verify_parser.set_defaults(func=verify_cmd)
+
+    serve_parser = subparsers.add_parser("serve")
+    serve_parser.add_argument("--registry", action="append", default=[], help="Log in to this registry on start, can be repeated")
+    serve_parser.set_defaults(func=serve_cmd)
+
+    jobs_parser = subparsers.add_parser("jobs")
+    jobs_parser.add_argument("job", type=int, nargs="?", help="Follow the output of this job")
+    jobs_parser.add_argument("--stop", action="store_true", help="Stop the daemon once the running job is done")
+    jobs_parser.set_defaults(func=jobs_cmd)
+
     index_parser = subparsers.add_parser("index")
     index_parser.set_defaults(func=index_cmd)
 
-    args = parser.parse_args()
-    args.func(args)
+    return parser
+
+def run_command(args):
+    if not args.trace:
+        args.func(args)
+        return
+
+    from tracing.tracing import start_tracing, stop_tracing, span, format_summary
+
+    tracer = start_tracing()
+    try:
+        with span(args.command, "command"):
+            args.func(args)
+    finally:
+        stop_tracing()
+        tracer.export(args.trace)
+        print(format_summary(tracer))
+        print(f"[INFO] Trace of {len(tracer.spans)} spans written to {args.trace}")
+
+def main():
+    args = get_parser().parse_args()
+    if args.command in DAEMON_COMMANDS and not args.no_daemon:
+        from daemon.client import forward
+
+        exit_code = forward(SOCKET_FILE, sys.argv[1:])
+        if exit_code is not None:
+            sys.exit(exit_code)
+    run_command(args)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,267 @@
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import oras.defaults
+from publish import oci
+from publish.graph import GRAPH_TAG
+from publish.index import IndexStore, INDEX_REPOSITORY, INDEX_TAG
+from publish.search import SEARCH_TAG
+
+MIRROR_JOBS = 8
+CHUNK_SIZE = 1 << 20
+# Tags of the index repository, the index itself and its derived artifacts
+INDEX_TAGS = [INDEX_TAG, GRAPH_TAG, SEARCH_TAG]
+
+
+class MirrorStore:
+    """
+    Content addressed copy of a registry in a local directory:
+      blobs/sha256/<hex>  every manifest and blob, by digest
+      refs.json           repository -> tag -> manifest digest
+    Blobs being downloaded are kept next to their final path as
+    <hex>.partial, so an interrupted sync resumes where it stopped.
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.refs_path = self.root / "refs.json"
+
+    def blob_path(self, digest):
+        algorithm, hex_digest = digest.split(":")
+        return self.root / "blobs" / algorithm / hex_digest
+
+    def partial_path(self, digest):
+        path = self.blob_path(digest)
+        return path.with_name(f"{path.name}.partial")
+
+    def has(self, digest):
+        return self.blob_path(digest).exists()
+
+    def read(self, digest):
+        return self.blob_path(digest).read_bytes()
+
+    def write(self, digest, data):
+        if oci.bytes_digest(data) != digest:
+            raise ValueError(f"Content does not match its digest {digest}")
+        path = self.blob_path(digest)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        partial = self.partial_path(digest)
+        partial.write_bytes(data)
+        os.replace(partial, path)
+
+    def read_refs(self):
+        if not self.refs_path.exists():
+            return {}
+        return json.loads(self.refs_path.read_text())
+
+    def write_refs(self, refs):
+        # Replaced atomically, an interrupted sync leaves the previous refs
+        self.root.mkdir(parents=True, exist_ok=True)
+        temporary = self.refs_path.with_suffix(".tmp")
+        temporary.write_text(json.dumps(refs, indent=4, sort_keys=True))
+        os.replace(temporary, self.refs_path)
+
+    def manifest(self, digest):
+        return json.loads(self.read(digest))
+
+    def referenced(self, refs):
+        """
+        Digests of every manifest in refs and of the blobs they reference
+        """
+        digests = set()
+        for tags in refs.values():
+            for digest in tags.values():
+                digests.add(digest)
+                if self.has(digest):
+                    manifest = self.manifest(digest)
+                    digests.add(manifest["config"]["digest"])
+                    digests.update(layer["digest"] for layer in manifest["layers"])
+        return digests
+
+    def collect_garbage(self, refs):
+        """
+        Deletes the blobs, complete or partial, no manifest in refs references.
+        Returns the number of files and bytes removed.
+        """
+        referenced = self.referenced(refs)
+        removed = freed = 0
+        for path in self.root.glob("blobs/*/*"):
+            digest = f"{path.parent.name}:{path.name.removesuffix('.partial')}"
+            if digest in referenced:
+                continue
+            freed += path.stat().st_size
+            path.unlink()
+            removed += 1
+        return removed, freed
+
+
+def resolve_tag(client, container):
+    """
+    Returns the digest of the manifest a tag points to, or None if the tag doesn't exist.
+    A HEAD request is enough when the registry sends Docker-Content-Digest.
+    """
+    response = oci.request(
+        client, container.manifest_url(), "HEAD",
+        headers={"Accept": oras.defaults.default_manifest_media_type}
+    )
+    if response.status_code == 404:
+        return None
+    client._check_200_response(response)
+
+    digest = response.headers.get("Docker-Content-Digest")
+    if digest:
+        return digest
+    _, response = oci.get_manifest(client, container)
+    return oci.bytes_digest(response.content)
+
+
+def fetch_manifest(client, container, store, digest):
+    response = oci.request(
+        client, container.manifest_url(digest), "GET",
+        headers={"Accept": oras.defaults.default_manifest_media_type}
+    )
+    client._check_200_response(response)
+    store.write(digest, response.content)
+
+
+def fetch_blob(client, container, store, digest):
+    """
+    Downloads a blob into the store, continuing a previous partial download
+    with a Range request. The content is hashed while it is written and only
+    moved to its final path if it matches the digest.
+    Returns the number of bytes transferred.
+    """
+    path = store.blob_path(digest)
+    partial = store.partial_path(digest)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    sha256_hash = hashlib.sha256()
+    offset = partial.stat().st_size if partial.exists() else 0
+    headers = {"Range": f"bytes={offset}-"} if offset else {}
+
+    response = client.do_request(
+        f"{client.prefix}://{container.get_blob_url(digest)}", "GET", headers=headers, stream=True
+    )
+    transferred = 0
+    with response:
+        if response.status_code == 206:
+            with open(partial, "rb") as f:
+                for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                    sha256_hash.update(chunk)
+            mode = "ab"
+        elif response.status_code == 416:
+            # The partial file already holds the whole blob
+            with open(partial, "rb") as f:
+                for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                    sha256_hash.update(chunk)
+            mode = None
+        else:
+            client._check_200_response(response)
+            mode = "wb"
+
+        if mode:
+            with open(partial, mode) as f:
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    sha256_hash.update(chunk)
+                    f.write(chunk)
+                    transferred += len(chunk)
+
+    if f"sha256:{sha256_hash.hexdigest()}" != digest:
+        partial.unlink()
+        raise ValueError(f"Blob {digest} from {container} does not match its digest")
+    os.replace(partial, path)
+    return transferred
+
+
+def verify_bundle(store, manifest):
+    """
+    Checks the runtime layers of a plugin manifest against the digests
+    its bundle.json records. Returns the mismatching files.
+    """
+    layers = {oci.layer_title(layer): layer for layer in manifest.get("layers", [])}
+    bundle_layer = layers.get("bundle.json")
+    if not bundle_layer:
+        return ["bundle.json is missing"]
+
+    mismatches = []
+    bundle = json.loads(store.read(bundle_layer["digest"]))
+    for title, digest in oci.bundle_title_digests(bundle).items():
+        layer = layers.get(title)
+        if not layer:
+            mismatches.append(f"{title} is missing")
+        elif layer["digest"] != digest:
+            mismatches.append(f"{title} is {layer['digest']}, bundle.json records {digest}")
+    return mismatches
+
+
+def mirror_registry(client, registry_url, mirror_dir, jobs=MIRROR_JOBS):
+    """
+    Brings the mirror up to date with the registry: tags are resolved to
+    manifest digests, and only manifests and blobs missing from the store are
+    downloaded. Plugin bundles are verified before the refs are updated, then
+    blobs no longer referenced are deleted.
+    """
+    store = MirrorStore(mirror_dir)
+    previous = store.read_refs()
+
+    packages = sorted(IndexStore(client, registry_url).fetch())
+    print(f"[INFO] Index lists {len(packages)} plugins")
+
+    def container(repository, reference="latest"):
+        return client.get_container(f"{registry_url}/{repository}:{reference}")
+
+    def resolve_repository(repository, tags):
+        tags = tags if tags is not None else client.get_tags(container(repository))
+        return repository, {tag: resolve_tag(client, container(repository, tag)) for tag in tags}
+
+    with ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+        resolved = executor.map(
+            lambda args: resolve_repository(*args),
+            [(INDEX_REPOSITORY, INDEX_TAGS)] + [(package, None) for package in packages],
+        )
+        refs = {
+            repository: {tag: digest for tag, digest in tags.items() if digest}
+            for repository, tags in resolved
+        }
+
+        changed = [
+            (repository, digest)
+            for repository, tags in refs.items()
+            for tag, digest in tags.items()
+            if previous.get(repository, {}).get(tag) != digest or not store.has(digest)
+        ]
+        manifests = {digest: repository for repository, digest in changed if not store.has(digest)}
+        list(executor.map(
+            lambda item: fetch_manifest(client, container(item[1]), store, item[0]),
+            manifests.items(),
+        ))
+
+        missing = {}
+        for repository, digest in changed:
+            manifest = store.manifest(digest)
+            for descriptor in [manifest["config"]] + manifest["layers"]:
+                if not store.has(descriptor["digest"]):
+                    missing.setdefault(descriptor["digest"], repository)
+        transferred = sum(executor.map(
+            lambda item: fetch_blob(client, container(item[1]), store, item[0]),
+            missing.items(),
+        ))
+
+    mismatches = {}
+    for repository, digest in changed:
+        if repository == INDEX_REPOSITORY:
+            continue
+        failures = verify_bundle(store, store.manifest(digest))
+        if failures:
+            mismatches[f"{repository}@{digest}"] = failures
+    if mismatches:
+        raise RuntimeError(f"Bundles do not match their bundle.json digests, the mirror was not updated: {mismatches}")
+
+    store.write_refs(refs)
+    removed, freed = store.collect_garbage(refs)
+    print(f"[INFO] {len(changed)} tags changed, {len(manifests)} manifests and {len(missing)} blobs fetched "
+          f"({transferred} bytes), {removed} unreferenced blobs removed ({freed} bytes)")
+    return {"changed": len(changed), "blobs": len(missing), "bytes": transferred, "removed": removed}
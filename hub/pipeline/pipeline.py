@@ -0,0 +1,200 @@
+import json
+import os
+import queue
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import yaml
+
+from tracing.tracing import span
+
+# Recipes waiting between two stages, so a fast stage can't run far ahead of a slow one
+QUEUE_SIZE = 2
+STAGES = ["validate", "build", "test", "publish"]
+
+
+class Pipeline:
+    """
+    Streams recipes through validate -> build -> test -> publish, each stage
+    in its own thread with bounded queues between them, so a recipe is tested
+    and pushed while the next ones are built. A recipe failing a stage is
+    dropped from the following ones. The index is committed once, at the end,
+    with every plugin pushed.
+
+    Every path is made absolute before the threads start, so no stage
+    depends on the working directory of the process.
+    """
+
+    def __init__(self, build_dir, registry_dir, registry_url=None, jobs=1, publish_jobs=8,
+                 cache=None, baselines=None, tolerance=0.25, state=None):
+        self.build_dir = os.path.abspath(build_dir)
+        self.registry_dir = os.path.abspath(registry_dir)
+        self.registry_url = registry_url
+        self.jobs = jobs
+        self.publish_jobs = publish_jobs
+        self.cache = cache
+        self.baselines = baselines or {}
+        self.tolerance = tolerance
+        self.state = state
+        self.validation_id = state.new_validation() if state else None
+
+        self.lock = threading.Lock()
+        self.failures = {}
+        self.validated = []
+        self.reports = []
+        self.published = {}
+        self.plugin_dirs = []
+        self.busy = {stage: 0.0 for stage in STAGES}
+
+    def validate(self, item):
+        from validate.validate import validate_recipe
+
+        with open(item["path"]) as f:
+            valid = validate_recipe(yaml.safe_load(f))
+        if self.state:
+            self.state.record_recipe(item["path"], "valid" if valid else "invalid", self.validation_id)
+        if not valid:
+            raise ValueError("Recipe validation failed")
+        with self.lock:
+            self.validated.append(item["path"])
+
+    def build(self, item):
+        from builders.builder import build_recipe, build_recipe_incremental
+
+        if self.state:
+            item["plugin_dirs"] = build_recipe_incremental(item["path"], self.build_dir, self.registry_dir, self.state)
+        else:
+            item["plugin_dirs"] = build_recipe(item["path"], self.build_dir, self.registry_dir)
+        with self.lock:
+            self.plugin_dirs.extend(item["plugin_dirs"])
+
+    def test(self, item):
+        from tests.test import test_tools
+
+        bundles = []
+        for plugin_dir in item["plugin_dirs"]:
+            with open(plugin_dir / "bundle.json") as f:
+                bundles.append((plugin_dir, json.load(f)))
+
+        report = test_tools(
+            self.registry_dir, jobs=self.jobs, baselines=self.baselines, tolerance=self.tolerance,
+            cache=self.cache, bundles=bundles, wasm_pool=self.wasm_pool
+        )
+        with self.lock:
+            self.reports.extend(report)
+        if self.state:
+            self.state.record_tests(report)
+
+        failed = [result["case"]["id"] for result in report if result["status"] == "failed"]
+        if failed:
+            raise RuntimeError(f"Tests failed: {failed}")
+
+    def publish(self, item):
+        from publish.publish import load_plugin, publish_plugin, with_retry
+
+        plugins = [load_plugin(plugin_dir) for plugin_dir in item["plugin_dirs"]]
+        futures = [
+            (plugin, self.publish_executor.submit(
+                with_retry,
+                lambda plugin=plugin: publish_plugin(
+                    self.registry_url, *plugin[:4], self.locations,
+                    self.state.published_digest(self.registry_url, plugin[0], plugin[1]) if self.state else None
+                ),
+                f"Push of {plugin[0]}:{plugin[1]}",
+            ))
+            for plugin in plugins
+        ]
+
+        errors = []
+        for plugin, future in futures:
+            try:
+                package, stats = future.result()
+            except Exception as e:
+                errors.append(f"{plugin[0]}:{plugin[1]} ({e})")
+                continue
+            if self.state:
+                self.state.record_publish(self.registry_url, plugin[0], plugin[1], stats["digest"], "published")
+            with open(plugin[4].path) as f:
+                with self.lock:
+                    self.published[package] = json.load(f)
+        if errors:
+            raise RuntimeError(f"Failed to publish {errors}")
+
+    def run_stage(self, stage, inbox, outbox):
+        work = getattr(self, stage)
+        while (item := inbox.get()) is not None:
+            start = time.monotonic()
+            try:
+                with span(stage, "pipeline", recipe=item["path"]):
+                    work(item)
+            except Exception as e:
+                print(f"[ERROR] [{stage}] {item['path']}: {e}")
+                with self.lock:
+                    self.failures[item["path"]] = f"{stage}: {e}"
+                continue
+            finally:
+                with self.lock:
+                    self.busy[stage] += time.monotonic() - start
+            print(f"[INFO] [{stage}] {item['path']} done")
+            outbox.put(item)
+        outbox.put(None)
+
+    def run(self, paths):
+        from tests.wasm import NodeWorkerPool, node_available
+
+        stages = STAGES if self.registry_url else STAGES[:-1]
+        if self.registry_url:
+            from publish.publish import get_oras_client
+            from publish import oci
+
+            # Log in before anything is built, a bad token fails the run right away
+            get_oras_client(self.registry_url, self.publish_jobs)
+            self.locations = oci.BlobLocations()
+
+        # Reused builds keep their plugins, the others are pruned once all recipes are built
+        if not self.state and Path(self.registry_dir).is_dir():
+            shutil.rmtree(self.registry_dir)
+
+        queues = [queue.Queue()] + [queue.Queue(QUEUE_SIZE) for _ in stages[1:]] + [queue.Queue()]
+        for path in paths:
+            queues[0].put({"path": os.path.abspath(path)})
+        queues[0].put(None)
+
+        start = time.monotonic()
+        self.wasm_pool = NodeWorkerPool(self.jobs) if node_available() else None
+        self.publish_executor = ThreadPoolExecutor(max_workers=max(self.publish_jobs, 1))
+        try:
+            threads = [
+                threading.Thread(target=self.run_stage, args=(stage, queues[i], queues[i + 1]), name=stage)
+                for i, stage in enumerate(stages)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            self.publish_executor.shutdown()
+            if self.wasm_pool:
+                self.wasm_pool.close()
+            shutil.rmtree(self.build_dir, ignore_errors=True)
+
+        if self.state and not self.failures:
+            from builders.builder import prune_registry
+
+            prune_registry(self.registry_dir, self.plugin_dirs)
+
+        if self.registry_url:
+            if self.failures:
+                print("[WARNING] Some recipes failed, the index was not updated")
+            elif self.published:
+                from publish.publish import publish_index
+
+                publish_index(self.registry_url, self.published)
+
+        elapsed = time.monotonic() - start
+        print(f"[INFO] {len(paths) - len(self.failures)}/{len(paths)} recipes went through {' -> '.join(stages)} in {elapsed:.1f}s "
+              f"(busy: {', '.join(f'{stage} {self.busy[stage]:.1f}s' for stage in stages)})")
+        return self.failures
@@ -0,0 +1,178 @@
+import gzip
+import importlib.util
+import json
+import struct
+
+# Compact binary encoding of JSON documents (BCIX). Every string, keys
+# included, is stored once in a string table and referenced by index,
+# so type names, categories and field names repeated across thousands
+# of entries cost a varint each.
+#
+#   "BCIX" version:u8 count:varint (length:varint utf8)* value
+#
+# Values start with a tag byte; integers are zigzag varints,
+# floats big-endian doubles, strings string table indices.
+MAGIC = b"BCIX"
+VERSION = 1
+NULL, FALSE, TRUE, INT, FLOAT, STRING, LIST, DICT = range(8)
+
+
+def canonical_json(data):
+    """
+    Minified JSON with sorted keys, identical bytes for identical content
+    """
+    return json.dumps(data, sort_keys=True, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+def gzip_encode(data):
+    # No timestamp in the header, so the output only depends on the input
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def zstd_available():
+    return importlib.util.find_spec("zstandard") is not None
+
+
+def zstd_encode(data):
+    import zstandard
+
+    return zstandard.ZstdCompressor(level=19).compress(data)
+
+
+def zstd_decode(data):
+    import zstandard
+
+    return zstandard.ZstdDecompressor().decompress(data)
+
+
+def write_varint(out, value):
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return
+
+
+def read_varint(data, pos):
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
+
+
+def binary_encode(document):
+    strings = {}
+    body = bytearray()
+
+    def intern(value):
+        if value not in strings:
+            strings[value] = len(strings)
+        return strings[value]
+
+    def write(value):
+        if value is None:
+            body.append(NULL)
+        elif value is True:
+            body.append(TRUE)
+        elif value is False:
+            body.append(FALSE)
+        elif isinstance(value, int):
+            body.append(INT)
+            write_varint(body, value << 1 if value >= 0 else (-value << 1) - 1)
+        elif isinstance(value, float):
+            body.append(FLOAT)
+            body.extend(struct.pack(">d", value))
+        elif isinstance(value, str):
+            body.append(STRING)
+            write_varint(body, intern(value))
+        elif isinstance(value, (list, tuple)):
+            body.append(LIST)
+            write_varint(body, len(value))
+            for item in value:
+                write(item)
+        elif isinstance(value, dict):
+            body.append(DICT)
+            write_varint(body, len(value))
+            # Sorted like canonical_json so equal documents encode identically
+            for key in sorted(value):
+                write_varint(body, intern(key))
+                write(value[key])
+        else:
+            raise TypeError(f"Cannot encode {type(value).__name__}")
+
+    write(document)
+
+    out = bytearray(MAGIC)
+    out.append(VERSION)
+    write_varint(out, len(strings))
+    for string in strings:
+        encoded = string.encode()
+        write_varint(out, len(encoded))
+        out.extend(encoded)
+    return bytes(out + body)
+
+
+def binary_decode(data):
+    if data[:4] != MAGIC or data[4] != VERSION:
+        raise ValueError("Not a BCIX v1 document")
+
+    count, pos = read_varint(data, 5)
+    strings = []
+    for _ in range(count):
+        length, pos = read_varint(data, pos)
+        strings.append(data[pos:pos + length].decode())
+        pos += length
+
+    def read(pos):
+        tag = data[pos]
+        pos += 1
+        if tag == NULL:
+            return None, pos
+        if tag in (TRUE, FALSE):
+            return tag == TRUE, pos
+        if tag == INT:
+            value, pos = read_varint(data, pos)
+            return (value >> 1) ^ -(value & 1), pos
+        if tag == FLOAT:
+            return struct.unpack_from(">d", data, pos)[0], pos + 8
+        if tag == STRING:
+            index, pos = read_varint(data, pos)
+            return strings[index], pos
+        if tag == LIST:
+            length, pos = read_varint(data, pos)
+            items = []
+            for _ in range(length):
+                item, pos = read(pos)
+                items.append(item)
+            return items, pos
+        if tag == DICT:
+            length, pos = read_varint(data, pos)
+            items = {}
+            for _ in range(length):
+                index, pos = read_varint(data, pos)
+                items[strings[index]], pos = read(pos)
+            return items, pos
+        raise ValueError(f"Unknown tag {tag} at {pos - 1}")
+
+    document, _ = read(pos)
+    return document
+
+
+def available_encodings():
+    # zstandard is optional, without it the zstd variant is not published
+    return [name for name in ENCODINGS if name != "zstd" or zstd_available()]
+
+
+# encoding: (title suffix, media type suffix, encode, decode)
+ENCODINGS = {
+    "gzip": (".json.gz", "+json+gzip", gzip_encode, lambda data: json.loads(gzip.decompress(data))),
+    "zstd": (".json.zst", "+json+zstd", zstd_encode, lambda data: json.loads(zstd_decode(data))),
+    "binary": (".bcix", "+bcix", lambda data: binary_encode(json.loads(data)), binary_decode),
+}
@@ -0,0 +1,110 @@
+from collections import deque
+
+GRAPH_TAG = "type-graph"
+GRAPH_NAME = "type-graph"
+GRAPH_MEDIA_TYPE_PREFIX = "application/vnd.biochef.type-graph.v1"
+
+# Longest chain of operations precomputed between two types
+MAX_CHAIN_DEPTH = 4
+# Shortest chains kept per type pair
+MAX_CHAINS = 5
+
+
+def build_type_graph(entries):
+    """
+    Precomputes, for the index entries {package: entry}:
+      types: type -> operations producing and consuming it
+      adjacency: operation -> operations consuming one of its outputs
+      chains: input type -> output type -> shortest chains of operations,
+              up to MAX_CHAIN_DEPTH operations and MAX_CHAINS per pair
+    Operations are referenced by their position in "operations".
+    """
+    operations = sorted(entries)
+    position = {package: i for i, package in enumerate(operations)}
+
+    types = {}
+    for package in operations:
+        entry = entries[package]
+        for type_id in entry.get("outputTypes", []):
+            types.setdefault(type_id, {"producers": [], "consumers": []})["producers"].append(position[package])
+        for type_id in entry.get("inputTypes", []):
+            types.setdefault(type_id, {"producers": [], "consumers": []})["consumers"].append(position[package])
+    types = dict(sorted(types.items()))
+
+    adjacency = []
+    for package in operations:
+        consumers = set()
+        for type_id in entries[package].get("outputTypes", []):
+            consumers.update(types[type_id]["consumers"])
+        adjacency.append(sorted(consumers))
+
+    chains = {}
+    for source in types:
+        reachable = shortest_chains(source, entries, operations, types)
+        if reachable:
+            chains[source] = reachable
+
+    return {
+        "format": "v1",
+        "operations": operations,
+        "types": types,
+        "adjacency": adjacency,
+        "chains": chains,
+    }
+
+
+def shortest_chains(source, entries, operations, types):
+    """
+    Breadth first search over types, where an operation is an edge from each
+    of its input types to each of its output types. Every type reached keeps
+    the (previous type, operation) pairs reaching it at its shortest distance,
+    which are then walked back to enumerate the chains.
+    """
+    distance = {source: 0}
+    predecessors = {}
+    queue = deque([source])
+
+    while queue:
+        type_id = queue.popleft()
+        if distance[type_id] == MAX_CHAIN_DEPTH:
+            continue
+
+        for operation in types[type_id]["consumers"]:
+            for output in entries[operations[operation]].get("outputTypes", []):
+                if output not in distance:
+                    distance[output] = distance[type_id] + 1
+                    queue.append(output)
+                if distance[output] == distance[type_id] + 1:
+                    predecessors.setdefault(output, []).append((type_id, operation))
+
+    def walk(type_id):
+        if type_id == source:
+            yield []
+            return
+        for previous, operation in predecessors[type_id]:
+            for chain in walk(previous):
+                yield chain + [operation]
+
+    reachable = {}
+    for target in sorted(predecessors):
+        if target == source:
+            continue
+        found = []
+        for chain in walk(target):
+            found.append(chain)
+            if len(found) == MAX_CHAINS:
+                break
+        reachable[target] = found
+
+    return reachable
+
+
+def consumers_of(graph, type_id):
+    return [graph["operations"][i] for i in graph["types"].get(type_id, {}).get("consumers", [])]
+
+
+def chains_between(graph, source, target):
+    return [
+        [graph["operations"][i] for i in chain]
+        for chain in graph["chains"].get(source, {}).get(target, [])
+    ]
@@ -0,0 +1,377 @@
+import json
+import random
+import re
+import time
+from pathlib import Path
+
+import oras.defaults
+from publish import oci
+from publish.encoding import ENCODINGS, available_encodings, canonical_json
+
+INDEX_REPOSITORY = "biochef-plugins-index"
+INDEX_TAG = "index"
+PACKAGE_PREFIX = "biochef-plugins-"
+SHARD_PREFIX_LENGTH = 2
+
+ROOT_TITLE = "index-root.json"
+ROOT_MEDIA_TYPE = "application/vnd.biochef.index.root.v2+json"
+SHARD_MEDIA_TYPE_PREFIX = "application/vnd.biochef.index.shard.v2"
+SHARD_MEDIA_TYPE = f"{SHARD_MEDIA_TYPE_PREFIX}+json"
+# Single file index.json of format v1. It is still written next to the root
+# and the shards, with every entry, for the clients that pull it.
+LEGACY_TITLE = "index.json"
+LEGACY_MEDIA_TYPE = "application/json"
+
+COMMIT_ATTEMPTS = 10
+COMMIT_BACKOFF = 0.5 # seconds, doubled after every conflict
+# Seconds to wait before reading the index back after writing it, so a publisher
+# that checked the tag just before our write has most likely landed its own by then
+COMMIT_SETTLE = 1.0
+
+INDEX_ANNOTATIONS = {
+    "org.opencontainers.image.title": "BioChef Plugin Index",
+    "biochef.index.format": "v2",
+}
+
+
+class IndexConflict(Exception):
+    """
+    The index changed between reading it and writing the update
+    """
+
+
+def index_entry(bundle):
+    entry = {
+        "id": bundle.get("id"),
+        "name": bundle.get("name"),
+        "description": bundle.get("description"),
+        "category": bundle.get("category"),
+        "inputTypes": sorted(set(t for inp in bundle["io"]["inputs"] for t in inp["types"])),
+        "outputTypes": sorted(set(t for inp in bundle["io"]["outputs"] for t in inp["types"])),
+    }
+
+    # Only the fitted models, clients use them to pick a runtime for an input size
+    if bundle.get("benchmarks"):
+        entry["benchmarks"] = {
+            runtime: {metric: model[metric] for metric in ["wall", "maxrss"] if metric in model}
+            for runtime, model in bundle["benchmarks"]["runtimes"].items()
+        }
+
+    return entry
+
+
+def shard_key(package):
+    """
+    Shards are keyed by the first characters of the plugin id,
+    so clients looking for a plugin know which shard to fetch
+    """
+    plugin_id = package.removeprefix(PACKAGE_PREFIX).lower()
+    return re.sub(r"[^a-z0-9]", "_", plugin_id[:SHARD_PREFIX_LENGTH]).ljust(SHARD_PREFIX_LENGTH, "_")
+
+
+def shard_title(key, suffix=".json"):
+    return f"index-{key}{suffix}"
+
+
+def serialize(data):
+    return canonical_json(data)
+
+
+def shard_layers(key, shard):
+    """
+    The JSON shard followed by its pre-encoded variants
+    """
+    layers = [{
+        "mediaType": SHARD_MEDIA_TYPE,
+        "digest": shard["digest"],
+        "size": shard["size"],
+        "annotations": {oras.defaults.annotation_title: shard_title(key)},
+    }]
+    for name, variant in shard.get("variants", {}).items():
+        title_suffix, media_type_suffix, _, _ = ENCODINGS[name]
+        layers.append({
+            "mediaType": SHARD_MEDIA_TYPE_PREFIX + media_type_suffix,
+            "digest": variant["digest"],
+            "size": variant["size"],
+            "annotations": {oras.defaults.annotation_title: shard_title(key, title_suffix)},
+        })
+    return layers
+
+
+class IndexStore:
+    """
+    The sharded index in the registry: a manifest whose layers are a small
+    root document listing every shard's digest, and the shards themselves
+    """
+
+    def __init__(self, client, registry_url):
+        self.client = client
+        self.registry_url = registry_url
+        self.container = self.tag_container(INDEX_TAG)
+
+    def tag_container(self, tag):
+        return self.client.get_container(f"{self.registry_url}/{INDEX_REPOSITORY}:{tag}")
+
+    def read_blob(self, digest, cache_dir=None):
+        """
+        Blobs are immutable, so they are cached by digest
+        """
+        cached = Path(cache_dir, *digest.split(":")) if cache_dir else None
+        if cached and cached.exists():
+            return cached.read_bytes()
+
+        data = oci.get_blob(self.client, self.container, digest)
+        if cached:
+            cached.parent.mkdir(parents=True, exist_ok=True)
+            cached.write_bytes(data)
+        return data
+
+    def read_manifest(self):
+        """
+        Returns the index manifest and its digest, or (None, None) if no index
+        was published yet. Any other failure raises: an index that can't be
+        read must never be treated as empty.
+        """
+        manifest, response = oci.get_manifest(self.client, self.container)
+        if not manifest:
+            return None, None
+        return manifest, oci.bytes_digest(response.content)
+
+    def read_root(self, manifest, cache_dir=None):
+        """
+        Returns {"shards": {key: {digest, size, count}}} for a v2 index manifest,
+        None for a v1 one
+        """
+        for layer in manifest.get("layers", []):
+            if oci.layer_title(layer) == ROOT_TITLE:
+                return json.loads(self.read_blob(layer["digest"], cache_dir))
+        return None
+
+    def read_legacy(self, manifest):
+        for layer in manifest.get("layers", []):
+            if oci.layer_title(layer) == LEGACY_TITLE:
+                return json.loads(self.read_blob(layer["digest"]))
+        return {}
+
+    def read_shard(self, root, key, cache_dir=None, encoding="json"):
+        shard = root["shards"].get(key)
+        if not shard:
+            return {}
+
+        variant = shard.get("variants", {}).get(encoding)
+        if variant:
+            return ENCODINGS[encoding][3](self.read_blob(variant["digest"], cache_dir))
+        return json.loads(self.read_blob(shard["digest"], cache_dir))
+
+    def fetch(self, packages=None, cache_dir=None, encoding="json"):
+        """
+        Client side read: returns the entries of the shards holding the
+        given packages (every shard without packages), downloading the given
+        encoding of the shards when published. Blobs are cached in cache_dir,
+        so only shards that changed since the last fetch are downloaded.
+        """
+        manifest, _ = self.read_manifest()
+        if not manifest:
+            return {}
+
+        root = self.read_root(manifest, cache_dir)
+        if root is None:
+            return self.read_legacy(manifest)
+
+        keys = {shard_key(package) for package in packages} if packages else root["shards"].keys()
+        entries = {}
+        for key in keys:
+            entries.update(self.read_shard(root, key, cache_dir, encoding))
+        return entries
+
+    def update(self, entries, manifest=None, digest=None):
+        """
+        Merges entries into the index read as `manifest` and pushes it, rewriting
+        only the shards they fall into and the v1 index.json. The manifest is
+        only replaced if the tag still points to `digest`, otherwise
+        IndexConflict is raised. Returns the keys of the shards that changed.
+        """
+        root = self.read_root(manifest) if manifest else None
+        legacy = self.read_legacy(manifest) if manifest else {}
+        has_legacy = bool(manifest) and any(oci.layer_title(layer) == LEGACY_TITLE for layer in manifest.get("layers", []))
+        if root is not None and not has_legacy:
+            # Published without index.json, it is rebuilt from the shards
+            for key in root["shards"]:
+                legacy.update(self.read_shard(root, key))
+        legacy = {**legacy, **entries}
+        if root is None:
+            # No index yet, or a v1 index that is resharded as a whole
+            entries = legacy
+            root = {"format": "v2", "shards": {}}
+
+        by_shard = {}
+        for package, entry in entries.items():
+            by_shard.setdefault(shard_key(package), {})[package] = entry
+
+        changed = []
+        locations = oci.BlobLocations()
+        encodings = available_encodings()
+        for key, shard_entries in by_shard.items():
+            shard = {**self.read_shard(root, key), **shard_entries}
+            data = serialize(shard)
+            shard_digest = oci.bytes_digest(data)
+            current = root["shards"].get(key, {})
+            if current.get("digest") == shard_digest and set(encodings) <= set(current.get("variants", {})):
+                continue
+
+            descriptor = {"mediaType": SHARD_MEDIA_TYPE, "digest": shard_digest, "size": len(data)}
+            oci.push_blob(self.client, self.container, descriptor, lambda data=data: data, locations)
+
+            variants = {}
+            for name in encodings:
+                encoded = ENCODINGS[name][2](data)
+                variants[name] = {"digest": oci.bytes_digest(encoded), "size": len(encoded)}
+                descriptor = {"digest": variants[name]["digest"], "size": len(encoded)}
+                oci.push_blob(self.client, self.container, descriptor, lambda encoded=encoded: encoded, locations)
+
+            root["shards"][key] = {"digest": shard_digest, "size": len(data), "count": len(shard), "variants": variants}
+            changed.append(key)
+
+        if not changed and manifest and has_legacy and self.read_root(manifest) is not None:
+            return changed
+
+        root["shards"] = dict(sorted(root["shards"].items()))
+        root_data = serialize(root)
+        root_layer = {
+            "mediaType": ROOT_MEDIA_TYPE,
+            "digest": oci.bytes_digest(root_data),
+            "size": len(root_data),
+            "annotations": {oras.defaults.annotation_title: ROOT_TITLE},
+        }
+        oci.push_blob(self.client, self.container, root_layer, lambda: root_data, locations)
+        # Same layout as the v1 index, so clients that pull index.json keep working
+        legacy_data = json.dumps(legacy, indent=2).encode()
+        legacy_layer = {
+            "mediaType": LEGACY_MEDIA_TYPE,
+            "digest": oci.bytes_digest(legacy_data),
+            "size": len(legacy_data),
+            "annotations": {oras.defaults.annotation_title: LEGACY_TITLE},
+        }
+        oci.push_blob(self.client, self.container, legacy_layer, lambda: legacy_data, locations)
+        oci.push_blob(self.client, self.container, oci.EMPTY_CONFIG_DESCRIPTOR, lambda: oci.EMPTY_CONFIG, locations)
+
+        layers = [root_layer, legacy_layer]
+        for key, shard in root["shards"].items():
+            layers.extend(shard_layers(key, shard))
+        self.swap_manifest(oci.manifest_bytes(oci.new_manifest(layers, INDEX_ANNOTATIONS)), digest)
+        return changed
+
+    def swap_manifest(self, data, expected_digest):
+        """
+        Compare-and-swap of the index tag. The expected digest is checked right
+        before the write, and sent as If-Match (If-None-Match when creating the
+        index) for registries that can reject the write atomically. Most
+        registries ignore both, commit then confirms the write by reading it back.
+        """
+        _, current_digest = self.read_manifest()
+        if current_digest != expected_digest:
+            raise IndexConflict(f"Index changed from {expected_digest} to {current_digest}")
+
+        condition = {"If-Match": f'"{expected_digest}"'} if expected_digest else {"If-None-Match": "*"}
+        response = oci.request(
+            self.client, self.container.manifest_url(), "PUT", data=data,
+            headers={"Content-Type": oras.defaults.default_manifest_media_type, **condition}
+        )
+        if response.status_code == 412:
+            raise IndexConflict(f"Index changed since {expected_digest}")
+        self.client._check_200_response(response)
+
+    def confirm(self, entries):
+        """
+        Checks, COMMIT_SETTLE seconds after an update, that the index under
+        the tag holds the entries it wrote. A concurrent update that checked
+        the tag before the write and replaced it after drops them.
+        """
+        time.sleep(COMMIT_SETTLE)
+        current = self.fetch(packages=entries.keys())
+        dropped = [package for package, entry in entries.items() if package not in current or serialize(current[package]) != serialize(entry)]
+        if dropped:
+            raise IndexConflict(f"A concurrent update dropped {len(dropped)} entries")
+
+    def commit(self, entries, attempts=COMMIT_ATTEMPTS, backoff=COMMIT_BACKOFF):
+        """
+        Reads the index, merges entries into it and swaps it in, re-reading and
+        re-merging when another publisher updated it in the meantime or
+        replaced the update right after it.
+
+        Registries that ignore If-Match leave a race: a publisher that checked
+        the tag before this update and writes more than COMMIT_SETTLE seconds
+        after it still drops its entries unnoticed. Publishes to a registry
+        are serialized (see the publish workflow), this only covers the
+        updates that overlap anyway.
+        """
+        for attempt in range(1, attempts + 1):
+            manifest, digest = self.read_manifest()
+            try:
+                changed = self.update(entries, manifest, digest)
+                self.confirm(entries)
+                return changed
+            except IndexConflict as e:
+                if attempt == attempts:
+                    raise
+                delay = backoff * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)
+                print(f"[WARNING] {e}, merging again in {delay:.1f}s ({attempt}/{attempts})")
+                time.sleep(delay)
+
+    def publish_artifact(self, tag, name, media_type_prefix, document, annotations):
+        """
+        Pushes a document derived from the index (type graph, search index, ...)
+        under its own tag of the index repository, as canonical JSON
+        followed by the same pre-encoded variants as the shards
+        """
+        container = self.tag_container(tag)
+        locations = oci.BlobLocations()
+        data = canonical_json(document)
+        variants = [(".json", "+json", data)] + [
+            (ENCODINGS[encoding][0], ENCODINGS[encoding][1], ENCODINGS[encoding][2](data))
+            for encoding in available_encodings()
+        ]
+
+        layers = []
+        for title_suffix, media_type_suffix, encoded in variants:
+            layer = {
+                "mediaType": media_type_prefix + media_type_suffix,
+                "digest": oci.bytes_digest(encoded),
+                "size": len(encoded),
+                "annotations": {oras.defaults.annotation_title: name + title_suffix},
+            }
+            oci.push_blob(self.client, container, layer, lambda encoded=encoded: encoded, locations)
+            layers.append(layer)
+
+        oci.push_blob(self.client, container, oci.EMPTY_CONFIG_DESCRIPTOR, lambda: oci.EMPTY_CONFIG, locations)
+        oci.put_manifest(self.client, container, oci.manifest_bytes(oci.new_manifest(layers, annotations)))
+
+    def read_artifact(self, tag, name, encoding="json", cache_dir=None):
+        """
+        Returns the document of an artifact pushed with publish_artifact and
+        the annotations of its manifest, or (None, None) if it doesn't exist
+        """
+        container = self.tag_container(tag)
+        manifest, _ = oci.get_manifest(self.client, container)
+        if not manifest:
+            return None, None
+
+        title = name + (ENCODINGS[encoding][0] if encoding != "json" else ".json")
+        layer = next(
+            (layer for layer in manifest.get("layers", []) if oci.layer_title(layer) == title),
+            None
+        )
+        if not layer:
+            raise ValueError(f"{container} has no {encoding} encoding")
+
+        cached = Path(cache_dir, *layer["digest"].split(":")) if cache_dir else None
+        if cached and cached.exists():
+            data = cached.read_bytes()
+        else:
+            data = oci.get_blob(self.client, container, layer["digest"])
+            if cached:
+                cached.parent.mkdir(parents=True, exist_ok=True)
+                cached.write_bytes(data)
+
+        document = json.loads(data) if encoding == "json" else ENCODINGS[encoding][3](data)
+        return document, manifest.get("annotations", {})
@@ -0,0 +1,235 @@
+# Blob and manifest level registry operations, used to push plugins without
+# re-uploading content the registry already has. Requests go through the
+# ORAS client so they share its session and authentication.
+import hashlib
+import json
+import threading
+from pathlib import Path
+
+import oras.defaults
+
+EMPTY_CONFIG = b"{}"
+EMPTY_CONFIG_DESCRIPTOR = {
+    "mediaType": oras.defaults.unknown_config_media_type,
+    "size": len(EMPTY_CONFIG),
+    "digest": "sha256:" + hashlib.sha256(EMPTY_CONFIG).hexdigest(),
+}
+
+
+def file_digest(path):
+    sha256_hash = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha256_hash.update(chunk)
+    return f"sha256:{sha256_hash.hexdigest()}"
+
+
+def bytes_digest(data):
+    return f"sha256:{hashlib.sha256(data).hexdigest()}"
+
+
+def bundle_digests(version_dir, bundle):
+    """
+    Digests bundle.json already records for the runtime files, by resolved path
+    """
+    runtime_dir = Path(version_dir).resolve() / "runtime"
+    bin_name = bundle.get("bin")
+    runtime = bundle.get("runtime", {})
+    digests = {}
+
+    if "wasm" in runtime:
+        digests[runtime_dir / "wasm" / f"{bin_name}.wasm"] = runtime["wasm"].get("wasm_digest")
+        digests[runtime_dir / "wasm" / f"{bin_name}.js"] = runtime["wasm"].get("js_digest")
+    if "native" in runtime:
+        digests[runtime_dir / "native" / bin_name] = runtime["native"].get("digest")
+
+    return {path: digest for path, digest in digests.items() if digest}
+
+
+def bundle_title_digests(bundle):
+    """
+    Digests bundle.json records for the runtime files, by the layer title they are pushed under
+    """
+    return {path.name: digest for path, digest in bundle_digests(".", bundle).items()}
+
+
+def new_layer(path, media_type, digest=None):
+    path = Path(path)
+    return {
+        "mediaType": media_type,
+        "size": path.stat().st_size,
+        "digest": digest or file_digest(path),
+        # Same title ORAS gives layers, clients pull files by it
+        "annotations": {oras.defaults.annotation_title: path.name},
+    }
+
+
+def layer_title(layer):
+    """
+    Title ORAS gives a layer, None for layers without annotations
+    """
+    return (layer.get("annotations") or {}).get(oras.defaults.annotation_title)
+
+
+def new_manifest(layers, annotations):
+    return {
+        "schemaVersion": 2,
+        "mediaType": oras.defaults.default_manifest_media_type,
+        "config": EMPTY_CONFIG_DESCRIPTOR,
+        "layers": layers,
+        "annotations": annotations,
+    }
+
+
+def manifest_bytes(manifest):
+    return json.dumps(manifest, separators=(",", ":")).encode()
+
+
+def same_content(manifest, remote):
+    """
+    Whether a remote manifest holds the same layers and annotations
+    """
+    def layer_key(layer):
+        return layer["digest"], layer["mediaType"], layer_title(layer)
+
+    return (
+        [layer_key(layer) for layer in manifest["layers"]] == [layer_key(layer) for layer in remote.get("layers", [])]
+        and manifest.get("annotations", {}) == remote.get("annotations", {})
+    )
+
+
+def request(client, url, method, **kwargs):
+    return client.do_request(f"{client.prefix}://{url}", method, **kwargs)
+
+
+def get_manifest(client, container):
+    """
+    Returns the manifest a tag points to and its raw response, or (None, None) if there is none
+    """
+    response = request(
+        client, container.manifest_url(), "GET",
+        headers={"Accept": oras.defaults.default_manifest_media_type}
+    )
+    if response.status_code == 404:
+        return None, None
+
+    client._check_200_response(response)
+    return response.json(), response
+
+
+def manifest_digest(client, container):
+    """
+    Digest of the manifest a tag points to, from a HEAD request, or None if
+    there is none or the registry doesn't report it
+    """
+    response = request(
+        client, container.manifest_url(), "HEAD",
+        headers={"Accept": oras.defaults.default_manifest_media_type}
+    )
+    if response.status_code != 200:
+        return None
+    return response.headers.get("Docker-Content-Digest")
+
+
+def put_manifest(client, container, data, headers=None):
+    response = request(
+        client, container.manifest_url(), "PUT", data=data,
+        headers={"Content-Type": oras.defaults.default_manifest_media_type, **(headers or {})}
+    )
+    client._check_200_response(response)
+    return response
+
+
+def get_blob(client, container, digest):
+    response = request(client, container.get_blob_url(digest), "GET")
+    client._check_200_response(response)
+
+    if bytes_digest(response.content) != digest:
+        raise ValueError(f"Blob {digest} from {container} does not match its digest")
+    return response.content
+
+
+def blob_exists(client, container, digest):
+    return request(client, container.get_blob_url(digest), "HEAD").status_code == 200
+
+
+def mount_blob(client, container, digest, source_repository):
+    """
+    Asks the registry to link a blob from another repository.
+    Registries that can't mount answer 202 and open an upload session instead.
+    Returns whether the blob was mounted, and the URL of that session if one was opened.
+    """
+    response = request(
+        client, f"{container.upload_blob_url()}?mount={digest}&from={source_repository}", "POST"
+    )
+    if response.status_code == 202:
+        return False, client._get_location(response, container) or None
+    return response.status_code == 201, None
+
+
+def upload_blob(client, container, data, digest, session_url=None):
+    """
+    Uploads a blob in a single PUT, through session_url if an upload session
+    is already open, otherwise through a new one
+    """
+    if not session_url:
+        response = request(
+            client, container.upload_blob_url(), "POST",
+            headers={"Content-Type": "application/octet-stream"}
+        )
+        session_url = client._get_location(response, container)
+        if not session_url:
+            raise ValueError(f"Issue retrieving session url for {digest}: {response.status_code}")
+
+    separator = "&" if "?" in session_url else "?"
+    response = client.do_request(
+        f"{session_url}{separator}digest={digest}",
+        "PUT",
+        data=data,
+        headers={"Content-Length": str(len(data)), "Content-Type": "application/octet-stream"},
+    )
+    client._check_200_response(response)
+
+
+class BlobLocations:
+    """
+    Repositories blobs are known to be in, shared by concurrent pushes
+    so a blob already in one plugin repository is mounted into the others
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.repositories = {}
+
+    def add(self, digest, repository):
+        with self.lock:
+            self.repositories.setdefault(digest, repository)
+
+    def get(self, digest, exclude=None):
+        with self.lock:
+            repository = self.repositories.get(digest)
+        return repository if repository != exclude else None
+
+
+def push_blob(client, container, descriptor, read, locations):
+    """
+    Makes sure a blob is in the container's repository: already there,
+    mounted from another repository or uploaded with read().
+    Returns how it got there and the number of bytes uploaded.
+    """
+    digest = descriptor["digest"]
+    repository = container.api_prefix
+
+    if blob_exists(client, container, digest):
+        outcome, transferred = "existing", 0
+    else:
+        source = locations.get(digest, exclude=repository)
+        mounted, session_url = mount_blob(client, container, digest, source) if source else (False, None)
+        if mounted:
+            outcome, transferred = "mounted", 0
+        else:
+            upload_blob(client, container, read(), digest, session_url)
+            outcome, transferred = "uploaded", descriptor["size"]
+
+    locations.add(digest, repository)
+    return outcome, transferred
@@ -1,9 +1,29 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
 from pathlib import Path
 from typing import List
 import json
+import re
+from urllib.parse import urlparse
+import oras.auth
+import oras.auth.utils
 import oras.client
+import oras.decorator
+import oras.defaults
+from publish import oci
+from publish.index import IndexStore, index_entry
+from publish.graph import build_type_graph, GRAPH_TAG, GRAPH_NAME, GRAPH_MEDIA_TYPE_PREFIX
+from publish.search import build_search_index, SEARCH_TAG, SEARCH_NAME, SEARCH_MEDIA_TYPE_PREFIX
 import os
+import threading
+import time
 from dotenv import load_dotenv
+from tracing.tracing import span
+from requests.adapters import HTTPAdapter
+
+PUBLISH_JOBS = 8
+PUSH_ATTEMPTS = 3
+PUSH_BACKOFF = 2 # seconds, doubled after every failed attempt
 
 
 class RegistryFile:
@@ -15,28 +35,171 @@ class RegistryFile:
         return f"{self.path}:{self.media_type}"
 
 
-def get_oras_client(registry_url):
+class RegistryClient(oras.client.OrasClient):
+    """
+    ORAS client keeping one bearer token per repository. oras keeps a single
+    token for all requests and sends it again when the registry refuses it
+    with a 401, so concurrent pushes to different repositories replace each
+    other's token and an expired token is never renewed.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.tokens = {}
+        # Connections the session keeps per host, grown by get_oras_client
+        self.pool_size = 0
+        self.pool_lock = threading.Lock()
+
+    def do_request(self, url, method="GET", data=None, headers=None, json=None, stream=False):
+        if not isinstance(self.auth, oras.auth.TokenAuth):
+            return super().do_request(url, method, data, headers, json, stream)
+        return self.token_request(url, method, data, headers, json, stream)
+
+    @oras.decorator.retry()
+    def token_request(self, url, method, data, headers, json, stream):
+        headers = dict(headers or {})
+        repository = token_scope(url)
+        token = self.tokens.get(repository)
+        if token:
+            headers["Authorization"] = f"Bearer {token}"
+        response = self.session.request(
+            method, url, data=data, json=json, headers=headers, stream=stream, verify=self._tls_verify
+        )
+        if response.status_code not in (401, 403):
+            return response
+
+        # The token is missing, expired or lacks the scope, a new one is requested once
+        token = self.request_token(response)
+        if not token:
+            return response
+        self.tokens[repository] = token
+        headers["Authorization"] = f"Bearer {token}"
+        return self.session.request(
+            method, url, data=data, json=json, headers=headers, stream=stream, verify=self._tls_verify
+        )
+
+    def request_token(self, response):
+        challenge = response.headers.get("Www-Authenticate")
+        if not challenge:
+            return None
+        h = oras.auth.utils.parse_auth_header(challenge)
+        if not getattr(self.auth, "_basic_auth", None):
+            token = self.auth.request_anonymous_token(h)
+            if token:
+                return token
+        return self.auth.request_token(h)
+
+
+def token_scope(url):
+    """
+    Repository a registry URL belongs to, the host for the other endpoints
+    """
+    parsed = urlparse(url)
+    match = re.match(r"/v2/(.+?)/(?:manifests|blobs|tags)/", parsed.path)
+    return match.group(1) if match else parsed.netloc
+
+
+def get_oras_client(registry_url, jobs=PUBLISH_JOBS, read_only=False):
+    """
+    Returns the client for a registry, logging in on first use only.
+    The client is shared by all pushes, so its session keeps a connection
+    pool large enough for the `jobs` concurrent requests it will serve.
+    Read-only clients, for the commands that only pull, log in only when
+    credentials are configured and use anonymous tokens otherwise.
+    """
+    client = login(registry_url, read_only)
+    with client.pool_lock:
+        if jobs > client.pool_size:
+            adapter = HTTPAdapter(pool_connections=jobs, pool_maxsize=jobs * 2)
+            client.session.mount("http://", adapter)
+            client.session.mount("https://", adapter)
+            client.pool_size = jobs
+    return client
+
+
+@lru_cache(maxsize=None)
+def login(registry_url, read_only=False):
     if "localhost" in registry_url:
-        client = oras.client.OrasClient(hostname=registry_url, insecure=True)
+        client = RegistryClient(hostname=registry_url, insecure=True)
     else:
         load_dotenv()
         username = os.getenv("REGISTRY_USERNAME")
         token = os.getenv("REGISTRY_PASSWORD")
-        oras_auth = os.getenv("ORAS_AUTH_BACKED")
+        oras_auth = os.getenv("ORAS_AUTH_BACKED") or "token"
         oras_insecure = True if os.getenv("ORAS_INSECURE") == "true" else False
 
-        if not username or not token:
+        if (not username or not token) and not read_only:
             raise Exception("Registry username or password missing")
 
-        client = oras.client.OrasClient(auth_backend=oras_auth, insecure=oras_insecure)
-        client.login(username=username, password=token)
-
+        client = RegistryClient(auth_backend=oras_auth, insecure=oras_insecure)
+        if username and token:
+            client.login(username=username, password=token)
     return client
 
 
-def publish_plugin(registry_url, plugin_id, plugin_version, files: List[RegistryFile]):
+def with_retry(action, description, attempts=PUSH_ATTEMPTS, backoff=PUSH_BACKOFF):
+    for attempt in range(1, attempts + 1):
+        try:
+            return action()
+        except Exception as e:
+            if attempt == attempts:
+                raise
+            delay = backoff * 2 ** (attempt - 1)
+            print(f"[WARNING] {description} failed ({e}), retrying in {delay}s ({attempt}/{attempts})")
+            time.sleep(delay)
+
+
+def get_version_tags(plugin_version):
+    """
+    Extra tags a version is published under: latest and major.minor
+    """
+    tags = ["latest"]
+    parts = plugin_version.split("-")[0].split(".")
+    if len(parts) >= 2:
+        tags.append(f"{parts[0]}.{parts[1]}")
+    return tags
+
+
+def tag_manifest(client, registry_url, target, source_tag, tags):
+    """
+    Tags an already pushed manifest by PUTting its exact bytes under the new
+    tags. The blobs are referenced by the manifest and are not uploaded again.
+    """
+    container = client.get_container(f"{registry_url}/{target}:{source_tag}")
+    manifest, response = oci.get_manifest(client, container)
+    if not manifest:
+        raise Exception(f"Cannot tag {container}: manifest not found")
+
+    for tag in tags:
+        tagged = client.get_container(f"{registry_url}/{target}:{tag}")
+        oci.put_manifest(
+            client, tagged, response.content,
+            headers={"Content-Type": response.headers.get("Content-Type", oras.defaults.default_manifest_media_type)},
+        )
 
+
+def publish_plugin(registry_url, plugin_id, plugin_version, files: List[RegistryFile], digests=None, locations=None, published_digest=None):
+    """
+    Pushes a plugin unless the registry already has a manifest with the same
+    layers for its version. When the same manifest was recorded as published
+    (published_digest), a HEAD request confirms the registry still has it.
+    Blobs the repository already holds are skipped,
+    blobs pushed to another plugin repository in this run are mounted.
+    Returns the target and push statistics, including the manifest digest.
+    """
+    with span("publish_plugin", "publish", plugin=plugin_id, version=plugin_version) as s:
+        target, stats = _publish_plugin(registry_url, plugin_id, plugin_version, files, digests, locations, published_digest)
+        s.set(
+            cached=stats["unchanged"], bytes=stats["bytes"],
+            uploaded=stats["uploaded"], mounted=stats["mounted"], existing=stats["existing"]
+        )
+    return target, stats
+
+
+def _publish_plugin(registry_url, plugin_id, plugin_version, files, digests, locations, published_digest):
     client = get_oras_client(registry_url)
+    digests = digests or {}
+    locations = locations or oci.BlobLocations()
 
     annotations = {
         "org.opencontainers.image.title": f"BioChef Plugin {plugin_id}",
@@ -49,60 +212,84 @@ def publish_plugin(registry_url, plugin_id, plugin_version, files: List[Registry
 
     target = f"biochef-plugins-{plugin_id}"
     target = target.lower()
-    client.push(
-        target=f'{registry_url}/{target}:{plugin_version}',
-        files=files,
-        manifest_annotations=annotations,
-    )
+    container = client.get_container(f'{registry_url}/{target}:{plugin_version}')
 
-    # TODO figure out a way to tag without pushing
-    client.push(
-        target=f'{registry_url}/{target}:latest',
-        files=files,
-        manifest_annotations=annotations,
-    )
+    layers = [oci.new_layer(file.path, file.media_type, digests.get(file.path)) for file in files]
+    manifest = oci.new_manifest(layers, annotations)
+    data = oci.manifest_bytes(manifest)
+    stats = {"unchanged": False, "bytes": 0, "existing": 0, "mounted": 0, "uploaded": 0, "digest": oci.bytes_digest(data)}
 
-    return target
+    # A registry that was reset or garbage collected no longer has what was recorded
+    if published_digest == stats["digest"] and oci.manifest_digest(client, container) == published_digest:
+        stats["unchanged"] = True
+        return target, stats
 
+    remote, _ = oci.get_manifest(client, container)
+    if remote and oci.same_content(manifest, remote):
+        stats["unchanged"] = True
+        for layer in layers:
+            locations.add(layer["digest"], container.api_prefix)
+        return target, stats
 
-def publish_index(registry_url, plugin_dict):
-    index = {}
-    index_path = Path("registry/index.json")
-    
-    try:
-        client = get_oras_client(registry_url)
-        client.pull(
-            target=f"{registry_url}/biochef-plugins-index:index",
-            outdir=os.path.dirname(index_path),
-            overwrite=True
-        )
-        with open(index_path) as f:
-            index = json.load(f)
-    except Exception as e:
-        print(f"Failed to pull existing index '{e}', creating a new one")
-    
-    for package, bundle in plugin_dict.items():
-        index[package] = {
-            "id": bundle.get("id"),
-            "name": bundle.get("name"),
-            "description": bundle.get("description"),
-            "category": bundle.get("category"),
-            "inputTypes": list(set(t for inp in bundle["io"]["inputs"] for t in inp["types"])),
-            "outputTypes": list(set(t for inp in bundle["io"]["outputs"] for t in inp["types"]))
-        }
+    blobs = [(layer, lambda path=file.path: path.read_bytes()) for file, layer in zip(files, layers)]
+    blobs.append((oci.EMPTY_CONFIG_DESCRIPTOR, lambda: oci.EMPTY_CONFIG))
+    for descriptor, read in blobs:
+        outcome, transferred = oci.push_blob(client, container, descriptor, read, locations)
+        stats[outcome] += 1
+        stats["bytes"] += transferred
 
-    index_path.write_text(json.dumps(index, indent=2))
+    oci.put_manifest(client, container, data)
+    print(f"Successfully pushed {container}")
 
-    client = get_oras_client(registry_url)
-    
-    client.push(
-        target=f"{registry_url}/biochef-plugins-index:index",
-        files=[RegistryFile(index_path, media_type="application/json")],
-        manifest_annotations={
-            "org.opencontainers.image.title": "BioChef Plugin Index",
-            "biochef.index.format": "v1"
-        },
-    )
+    tag_manifest(client, registry_url, target, plugin_version, get_version_tags(plugin_version))
+
+    return target, stats
+
+
+def publish_index(registry_url, plugin_dict):
+    store = IndexStore(get_oras_client(registry_url), registry_url)
+
+    entries = {package: index_entry(bundle) for package, bundle in plugin_dict.items()}
+    with span("publish_index", "publish", entries=len(entries)) as s:
+        changed = store.commit(entries)
+        s.set(changed_shards=len(changed), cached=not changed)
+    print(f"[INFO] Updated index shards: {changed}" if changed else "[INFO] Index is unchanged")
+
+    publish_derived_indexes(store)
+
+
+# (tag, name, media type prefix, title, build), built from the index entries
+DERIVED_INDEXES = [
+    (GRAPH_TAG, GRAPH_NAME, GRAPH_MEDIA_TYPE_PREFIX, "BioChef Type Graph", build_type_graph),
+    (SEARCH_TAG, SEARCH_NAME, SEARCH_MEDIA_TYPE_PREFIX, "BioChef Search Index", build_search_index),
+]
+
+
+def publish_derived_indexes(store):
+    """
+    Rebuilds the artifacts computed from the whole index, unless they
+    were already built from the current index manifest
+    """
+    _, index_digest = store.read_manifest()
+    outdated = []
+    for derived in DERIVED_INDEXES:
+        _, annotations = store.read_artifact(derived[0], derived[1])
+        if not annotations or annotations.get("biochef.index.digest") != index_digest:
+            outdated.append(derived)
+    if not outdated:
+        return
+
+    entries = store.fetch()
+    for tag, name, media_type_prefix, title, build in outdated:
+        with span("publish_derived_index", "publish", tag=tag):
+            store.publish_artifact(
+                tag, name, media_type_prefix, build(entries),
+                {
+                    "org.opencontainers.image.title": title,
+                    "biochef.index.digest": index_digest,
+                },
+            )
+        print(f"[INFO] Published {title} of {len(entries)} operations")
 
 
 media_types = {
@@ -124,36 +311,97 @@ def get_media_type(file: Path) -> str:
     return media_types.get(file.suffix, "application/vnd.oci.image.layer.v1.tar")
 
 
-def publish_plugins(registry_url, registry_dir):
+def load_plugin(version_folder):
+    """
+    Returns the plugin id, version, files, known digests and bundle.json
+    of a plugin version folder, as publish_plugin takes them
+    """
+    plugin_id = version_folder.parent.name
+    plugin_version = version_folder.name
+
+    files = [
+        RegistryFile(file.resolve(), media_type=get_media_type(file))
+        for file in sorted(version_folder.rglob("*"))
+        if file.is_file()
+    ]
+
+    bundle = next(
+        (f for f in files if f.path.name == "bundle.json"), None)
+    if not bundle:
+        raise Exception(f"Plugin {plugin_id} is missing a bundle.json")
+
+    with open(bundle.path) as f:
+        digests = oci.bundle_digests(version_folder, json.load(f))
+
+    return plugin_id, plugin_version, files, digests, bundle
+
+
+def publish_plugins(registry_url, registry_dir, jobs=PUBLISH_JOBS, state=None):
+    """
+    Pushes every plugin in the registry directory with up to `jobs` concurrent
+    pushes, and publishes the index once all of them succeeded.
+    With a state store, plugins recorded as published unchanged are skipped
+    after a HEAD request on their manifest, and every push is recorded.
+    """
     registry_path = Path(registry_dir)
+    plugins = []
     plugin_dict = {}
 
     for plugin_folder in registry_path.iterdir():
         if not plugin_folder.is_dir():
             continue
 
-        plugin_id = plugin_folder.name
-
         for version_folder in plugin_folder.iterdir():
             if not version_folder.is_dir():
                 continue
-            plugin_version = version_folder.name
-
-            files = [
-                RegistryFile(file.resolve(), media_type=get_media_type(file))
-                for file in version_folder.rglob("*")
-                if file.is_file()
-            ]
-
-            bundle = next(
-                (f for f in files if f.path.name == "bundle.json"), None)
-            if not bundle:
-                raise Exception(f"Plugin {plugin_id} is missing a bundle.json")
+            plugins.append(load_plugin(version_folder))
+
+    # Log in once before the workers share the client
+    get_oras_client(registry_url, jobs)
+    locations = oci.BlobLocations()
+
+    failed = []
+    totals = {"unchanged": 0, "bytes": 0, "mounted": 0}
+    with ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+        futures = {
+            executor.submit(
+                with_retry,
+                lambda plugin=plugin: publish_plugin(
+                    registry_url, *plugin[:4], locations,
+                    state.published_digest(registry_url, plugin[0], plugin[1]) if state else None
+                ),
+                f"Push of {plugin[0]}:{plugin[1]}",
+            ): plugin
+            for plugin in plugins
+        }
 
-            package = publish_plugin(
-                registry_url, plugin_id, plugin_version, files)
+        for done, future in enumerate(as_completed(futures), 1):
+            plugin_id, plugin_version, _, _, bundle = futures[future]
+            try:
+                package, stats = future.result()
+            except Exception as e:
+                print(f"[ERROR] [{done}/{len(plugins)}] Failed to publish {plugin_id}:{plugin_version}: {e}")
+                failed.append(f"{plugin_id}:{plugin_version}")
+                continue
 
+            if state:
+                state.record_publish(registry_url, plugin_id, plugin_version, stats["digest"], "published")
+
+            totals["unchanged"] += stats["unchanged"]
+            totals["bytes"] += stats["bytes"]
+            totals["mounted"] += stats["mounted"]
+            if stats["unchanged"]:
+                print(f"[INFO] [{done}/{len(plugins)}] {plugin_id}:{plugin_version} is unchanged")
+            else:
+                print(f"[INFO] [{done}/{len(plugins)}] Published {plugin_id}:{plugin_version} "
+                      f"({stats['uploaded']} uploaded, {stats['mounted']} mounted, {stats['existing']} existing blobs, {stats['bytes']} bytes)")
             with open(bundle.path) as f:
                 plugin_dict[package] = json.load(f)
 
+    print(f"[INFO] {len(plugins) - totals['unchanged'] - len(failed)} plugins pushed, {totals['unchanged']} unchanged, "
+          f"{totals['mounted']} blobs mounted, {totals['bytes']} bytes uploaded")
+
+    if failed:
+        raise RuntimeError(f"The following plugins failed to publish, the index was not updated: {failed}")
+
     publish_index(registry_url, plugin_dict)
@@ -0,0 +1,181 @@
+import json
+import re
+from bisect import bisect_left
+from pathlib import Path
+
+from publish.encoding import canonical_json
+
+SEARCH_TAG = "search"
+SEARCH_NAME = "search"
+SEARCH_MEDIA_TYPE_PREFIX = "application/vnd.biochef.search.v1"
+
+# Fields tokenized into the full text postings
+TEXT_FIELDS = ["id", "name", "description", "category", "inputTypes", "outputTypes"]
+# Query prefix: index entry field matched as a whole value
+FACETS = {
+    "category": "category",
+    "input": "inputTypes",
+    "output": "outputTypes",
+}
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(str(text).lower())
+
+
+def field_values(entry, field):
+    value = entry.get(field)
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def delta_encode(positions):
+    """
+    Postings are sorted operation positions, stored as the gaps between
+    them so they stay small varints in the binary encoding
+    """
+    previous = 0
+    gaps = []
+    for position in positions:
+        gaps.append(position - previous)
+        previous = position
+    return gaps
+
+
+def delta_decode(gaps):
+    position = 0
+    positions = []
+    for gap in gaps:
+        position += gap
+        positions.append(position)
+    return positions
+
+
+def build_search_index(entries):
+    """
+    Builds, for the index entries {package: entry}:
+      operations: [package, name, category] rows, referenced by position
+      terms: sorted tokens of TEXT_FIELDS, so prefixes are a binary search away
+      postings: delta encoded positions of the operations holding each term
+      facets: facet -> lowercased value -> delta encoded positions
+    """
+    packages = sorted(entries)
+
+    terms = {}
+    facets = {facet: {} for facet in FACETS}
+    for position, package in enumerate(packages):
+        entry = entries[package]
+        for field in TEXT_FIELDS:
+            for value in field_values(entry, field):
+                for token in tokenize(value):
+                    postings = terms.setdefault(token, [])
+                    if not postings or postings[-1] != position:
+                        postings.append(position)
+
+        for facet, field in FACETS.items():
+            for value in field_values(entry, field):
+                postings = facets[facet].setdefault(str(value).lower(), [])
+                if not postings or postings[-1] != position:
+                    postings.append(position)
+
+    sorted_terms = sorted(terms)
+    return {
+        "format": "v1",
+        "operations": [[package, entries[package].get("name"), entries[package].get("category")] for package in packages],
+        "terms": sorted_terms,
+        "postings": [delta_encode(terms[term]) for term in sorted_terms],
+        "facets": {
+            facet: {value: delta_encode(postings) for value, postings in sorted(values.items())}
+            for facet, values in facets.items()
+        },
+    }
+
+
+def parse_query(query):
+    """
+    Splits a query into free text tokens and (facet, value) filters,
+    e.g. "fastq category:qc" -> (["fastq"], [("category", "qc")])
+    """
+    tokens = []
+    filters = []
+    for word in query.split():
+        facet, separator, value = word.partition(":")
+        if separator and facet.lower() in FACETS:
+            filters.append((facet.lower(), value.lower()))
+        else:
+            tokens.extend(tokenize(word))
+    return tokens, filters
+
+
+def prefix_matches(index, token):
+    """
+    Operation positions holding any term starting with token,
+    and those holding the token itself
+    """
+    terms = index["terms"]
+    matches = set()
+    exact = set()
+    start = bisect_left(terms, token)
+    for i in range(start, len(terms)):
+        if not terms[i].startswith(token):
+            break
+        positions = delta_decode(index["postings"][i])
+        matches.update(positions)
+        if terms[i] == token:
+            exact.update(positions)
+    return matches, exact
+
+
+def search(index, query, limit=20):
+    """
+    Returns the operations matching every token of the query, as a prefix
+    of any of their terms, and every facet filter. Operations matching
+    more tokens exactly rank first.
+    """
+    tokens, filters = parse_query(query)
+    if not tokens and not filters:
+        return []
+
+    candidates = None
+    for facet, value in filters:
+        positions = set(delta_decode(index["facets"][facet].get(value, [])))
+        candidates = positions if candidates is None else candidates & positions
+
+    exact_counts = {}
+    for token in tokens:
+        matches, exact = prefix_matches(index, token)
+        candidates = matches if candidates is None else candidates & matches
+        for position in exact:
+            exact_counts[position] = exact_counts.get(position, 0) + 1
+        if not candidates:
+            return []
+
+    operations = index["operations"]
+    ranked = sorted(candidates, key=lambda position: (-exact_counts.get(position, 0), operations[position][0]))
+    return [
+        {"package": package, "name": name, "category": category}
+        for package, name, category in (operations[position] for position in ranked[:limit])
+    ]
+
+
+def load_search_index(store, cache_dir, offline=False):
+    """
+    Returns the published search index, downloading it only when its digest
+    changed. The last one downloaded is kept in cache_dir, offline queries
+    read it without contacting the registry.
+    """
+    latest = Path(cache_dir, f"{SEARCH_NAME}.json")
+    if offline:
+        if not latest.exists():
+            raise FileNotFoundError(f"No search index cached in {cache_dir}, search online first")
+        return json.loads(latest.read_bytes())
+
+    index, _ = store.read_artifact(SEARCH_TAG, SEARCH_NAME, cache_dir=cache_dir)
+    if index is None:
+        return None
+    latest.parent.mkdir(parents=True, exist_ok=True)
+    latest.write_bytes(canonical_json(index))
+    return index
@@ -0,0 +1,321 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from functools import lru_cache
+from pathlib import Path
+
+import yaml
+
+BUILDERS_DIR = Path(__file__).resolve().parent.parent / "builders"
+# Fields other commands add to a built bundle.json, hub bench adds benchmarks
+BUNDLE_EXTRA_FIELDS = ["benchmarks"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS validations (
+    id INTEGER PRIMARY KEY,
+    created REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS recipes (
+    path TEXT PRIMARY KEY,
+    hash TEXT NOT NULL,
+    recipe TEXT NOT NULL,
+    status TEXT NOT NULL,
+    validation_id INTEGER,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS recipes_validation ON recipes (validation_id);
+CREATE TABLE IF NOT EXISTS builds (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL,
+    inputs_hash TEXT NOT NULL,
+    status TEXT NOT NULL,
+    outputs TEXT,
+    log TEXT,
+    started REAL NOT NULL,
+    duration REAL
+);
+CREATE INDEX IF NOT EXISTS builds_path ON builds (path, id);
+CREATE INDEX IF NOT EXISTS builds_inputs ON builds (inputs_hash, status);
+CREATE TABLE IF NOT EXISTS artifacts (
+    path TEXT PRIMARY KEY,
+    build_id INTEGER NOT NULL,
+    plugin TEXT NOT NULL,
+    version TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS artifacts_build ON artifacts (build_id);
+CREATE INDEX IF NOT EXISTS artifacts_digest ON artifacts (digest);
+CREATE TABLE IF NOT EXISTS tests (
+    id INTEGER PRIMARY KEY,
+    plugin TEXT NOT NULL,
+    version TEXT NOT NULL,
+    case_id TEXT NOT NULL,
+    status TEXT NOT NULL,
+    cached INTEGER NOT NULL,
+    duration REAL,
+    metrics TEXT,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tests_case ON tests (plugin, version, case_id, id);
+CREATE TABLE IF NOT EXISTS publishes (
+    registry TEXT NOT NULL,
+    plugin TEXT NOT NULL,
+    version TEXT NOT NULL,
+    manifest_digest TEXT NOT NULL,
+    status TEXT NOT NULL,
+    published REAL NOT NULL,
+    PRIMARY KEY (registry, plugin, version)
+);
+"""
+
+
+def bytes_digest(data):
+    return f"sha256:{hashlib.sha256(data).hexdigest()}"
+
+
+def artifact_digest(path):
+    """
+    Digest of a built file. bundle.json is digested without the fields
+    added after the build, so benchmarking a plugin doesn't outdate its build.
+    """
+    path = Path(path)
+    if path.name == "bundle.json":
+        try:
+            bundle = json.loads(path.read_bytes())
+        except ValueError:
+            bundle = None
+        if isinstance(bundle, dict):
+            for field in BUNDLE_EXTRA_FIELDS:
+                bundle.pop(field, None)
+            return bytes_digest(json.dumps(bundle, sort_keys=True).encode())
+
+    sha256_hash = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha256_hash.update(chunk)
+    return f"sha256:{sha256_hash.hexdigest()}"
+
+
+@lru_cache(maxsize=None)
+def builders_digest():
+    # Every build is outdated when the builders change
+    sha256_hash = hashlib.sha256()
+    for path in sorted(BUILDERS_DIR.glob("*")):
+        if path.is_file() and path.suffix in (".py", ".Dockerfile"):
+            sha256_hash.update(path.name.encode())
+            sha256_hash.update(path.read_bytes())
+    return sha256_hash.hexdigest()
+
+
+def build_inputs_hash(recipe_path):
+    """
+    Digest of everything a build reads locally: the recipe, its
+    build script and the builders. The sources are pinned by the recipe.
+    """
+    recipe_path = Path(recipe_path).resolve()
+    data = recipe_path.read_bytes()
+    recipe = yaml.safe_load(data)
+
+    sha256_hash = hashlib.sha256(data)
+    build_script = recipe.get("build", {}).get("wasm", {}).get("emscripten", {}).get("buildScript")
+    if build_script and (recipe_path.parent / build_script).is_file():
+        sha256_hash.update((recipe_path.parent / build_script).read_bytes())
+    sha256_hash.update(builders_digest().encode())
+    return f"sha256:{sha256_hash.hexdigest()}"
+
+
+class StateStore:
+    """
+    Local SQLite database of what every stage did: validated recipes,
+    builds with their inputs and outputs, artifact digests, test results
+    and what was published where. Shared by the threads of a command.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+
+    def execute(self, query, params=()):
+        with self.lock:
+            return self.db.execute(query, params).fetchall()
+
+    def transaction(self, statements):
+        with self.lock:
+            self.db.execute("BEGIN")
+            try:
+                for query, params in statements:
+                    self.db.execute(query, params)
+                self.db.execute("COMMIT")
+            except Exception:
+                self.db.execute("ROLLBACK")
+                raise
+
+    def close(self):
+        self.db.close()
+
+    # Validation
+
+    def new_validation(self):
+        with self.lock:
+            return self.db.execute("INSERT INTO validations (created) VALUES (?)", (time.time(),)).lastrowid
+
+    def record_recipe(self, path, status, validation_id=None):
+        path = str(Path(path).resolve())
+        data = Path(path).read_bytes()
+        self.execute(
+            "INSERT INTO recipes (path, hash, recipe, status, validation_id, updated) VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (path) DO UPDATE SET hash = excluded.hash, recipe = excluded.recipe, "
+            "status = excluded.status, validation_id = excluded.validation_id, updated = excluded.updated",
+            (path, bytes_digest(data), json.dumps(yaml.safe_load(data)), status, validation_id, time.time()),
+        )
+
+    def valid_recipes(self):
+        """
+        Paths validated by the last validation
+        """
+        rows = self.execute(
+            "SELECT path FROM recipes WHERE status = 'valid' "
+            "AND validation_id = (SELECT MAX(id) FROM validations) ORDER BY rowid"
+        )
+        return [row["path"] for row in rows]
+
+    # Builds
+
+    def start_build(self, path, inputs_hash):
+        with self.lock:
+            return self.db.execute(
+                "INSERT INTO builds (path, inputs_hash, status, started) VALUES (?, ?, 'running', ?)",
+                (str(Path(path).resolve()), inputs_hash, time.time()),
+            ).lastrowid
+
+    def finish_build(self, build_id, status, outputs=None, artifacts=None, log=None):
+        """
+        artifacts: [(path, plugin, version, digest, size)] written by the build,
+        with digests from artifact_digest
+        log: where the build output is, or the error of a failed build
+        """
+        statements = [(
+            "UPDATE builds SET status = ?, outputs = ?, log = ?, duration = ? - started WHERE id = ?",
+            (status, json.dumps([str(Path(output).resolve()) for output in outputs or []]), log, time.time(), build_id),
+        )]
+        for path, plugin, version, digest, size in artifacts or []:
+            statements.append((
+                "INSERT OR REPLACE INTO artifacts (path, build_id, plugin, version, digest, size) VALUES (?, ?, ?, ?, ?, ?)",
+                (str(path), build_id, plugin, version, digest, size),
+            ))
+        self.transaction(statements)
+
+    def reusable_build(self, path, inputs_hash):
+        """
+        The outputs of the last build of a recipe, if it succeeded with the
+        same inputs and its artifacts are still on disk with their recorded digest
+        """
+        rows = self.execute(
+            "SELECT id, inputs_hash, status, outputs FROM builds WHERE path = ? ORDER BY id DESC LIMIT 1",
+            (str(Path(path).resolve()),),
+        )
+        if not rows or rows[0]["status"] != "passed" or rows[0]["inputs_hash"] != inputs_hash:
+            return None
+
+        for artifact in self.execute("SELECT path, digest, size FROM artifacts WHERE build_id = ?", (rows[0]["id"],)):
+            artifact_path = Path(artifact["path"])
+            if not artifact_path.is_file():
+                return None
+            # The size rules out most changes without reading the file, bundle.json grows with benchmarks
+            if artifact_path.name != "bundle.json" and artifact_path.stat().st_size != artifact["size"]:
+                return None
+            if artifact_digest(artifact_path) != artifact["digest"]:
+                return None
+        return [Path(output) for output in json.loads(rows[0]["outputs"])]
+
+    # Tests
+
+    def record_tests(self, report):
+        now = time.time()
+        self.transaction([
+            (
+                "INSERT INTO tests (plugin, version, case_id, status, cached, duration, metrics, created) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (result["id"], result["version"], result["case"]["id"], result["status"],
+                 int(bool(result.get("cached"))), result.get("duration"), json.dumps(result.get("metrics")), now),
+            )
+            for result in report
+        ])
+
+    # Publishing
+
+    def published_digest(self, registry, plugin, version):
+        rows = self.execute(
+            "SELECT manifest_digest FROM publishes WHERE registry = ? AND plugin = ? AND version = ? AND status = 'published'",
+            (registry, plugin, version),
+        )
+        return rows[0]["manifest_digest"] if rows else None
+
+    def record_publish(self, registry, plugin, version, manifest_digest, status):
+        self.execute(
+            "INSERT OR REPLACE INTO publishes (registry, plugin, version, manifest_digest, status, published) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (registry, plugin, version, manifest_digest, status, time.time()),
+        )
+
+    # Status
+
+    def status(self):
+        """
+        One row per known recipe with its last build, the artifacts and
+        test results of that build and where its plugins were published
+        """
+        rows = self.execute("""
+            SELECT r.path, r.status AS validation, r.updated,
+                   r.validation_id = (SELECT MAX(id) FROM validations) AS selected,
+                   b.id AS build_id, b.status AS build, b.duration, b.log
+            FROM recipes r
+            LEFT JOIN builds b ON b.id = (SELECT MAX(id) FROM builds WHERE path = r.path)
+            ORDER BY r.path
+        """)
+
+        status = []
+        for row in rows:
+            artifacts = self.execute(
+                "SELECT plugin, version, COUNT(*) AS files, SUM(size) AS bytes FROM artifacts "
+                "WHERE build_id = ? GROUP BY plugin, version ORDER BY plugin",
+                (row["build_id"],),
+            )
+            plugins = []
+            for artifact in artifacts:
+                tests = self.execute(
+                    "SELECT status, COUNT(*) AS count FROM tests t WHERE plugin = ? AND version = ? "
+                    "AND id = (SELECT MAX(id) FROM tests WHERE plugin = t.plugin AND version = t.version AND case_id = t.case_id) "
+                    "GROUP BY status",
+                    (artifact["plugin"], artifact["version"]),
+                )
+                publishes = self.execute(
+                    "SELECT registry, status FROM publishes WHERE plugin = ? AND version = ?",
+                    (artifact["plugin"], artifact["version"]),
+                )
+                plugins.append({
+                    "plugin": artifact["plugin"],
+                    "version": artifact["version"],
+                    "files": artifact["files"],
+                    "bytes": artifact["bytes"],
+                    "tests": {test["status"]: test["count"] for test in tests},
+                    "published": {publish["registry"]: publish["status"] for publish in publishes},
+                })
+
+            status.append({
+                "path": row["path"],
+                "validation": row["validation"],
+                "selected": bool(row["selected"]),
+                "build": row["build"],
+                "build_duration": row["duration"],
+                "build_log": row["log"],
+                "plugins": plugins,
+            })
+        return status
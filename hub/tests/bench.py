@@ -0,0 +1,189 @@
+import json
+from pathlib import Path
+
+import yaml
+
+from tests.test import Fixtures, find_bundles, expand_cases, test_tool_outputs
+from tests.wasm import NodeWorkerPool, node_available
+from utils.generators import get_generated_types, parse_size
+
+BENCH_SIZES = ["64KB", "1MB", "16MB"]
+BENCH_RUNTIMES = ["native", "wasm"]
+BENCH_TIMEOUT = 60
+MIB = 1024 * 1024
+BENCHMARK_FILE = "benchmarks.json" # kept next to the recipe's biochef.yaml, so rebuilds keep the curves
+
+
+def fit_linear(points, metric):
+    """
+    Least squares fit of metric = base + per_mib * input size in MiB
+    """
+    xs = [point["bytes"] / MIB for point in points]
+    ys = [point[metric] for point in points]
+    n = len(xs)
+    mean_x = sum(xs) / n
+    mean_y = sum(ys) / n
+
+    variance = sum((x - mean_x) ** 2 for x in xs)
+    if variance == 0:
+        return {"base": round(mean_y, 6), "per_mib": 0}
+
+    per_mib = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / variance
+    return {"base": round(mean_y - per_mib * mean_x, 6), "per_mib": round(per_mib, 6)}
+
+
+def benchmark_sources(recipe_paths):
+    """
+    Returns {operation id: benchmark file} for every operation of the given recipes
+    """
+    sources = {}
+    for recipe_path in recipe_paths or []:
+        recipe_path = Path(recipe_path)
+        with open(recipe_path) as f:
+            recipe = yaml.safe_load(f)
+        for operation in recipe["operations"]:
+            sources[operation["id"]] = recipe_path.parent / BENCHMARK_FILE
+    return sources
+
+
+def load_benchmarks(recipe_dir, operation_id, version):
+    """
+    Returns the stored benchmarks of one version of an operation, if any
+    """
+    benchmark_path = Path(recipe_dir) / BENCHMARK_FILE
+    if not benchmark_path.exists():
+        return None
+    with open(benchmark_path) as f:
+        return json.load(f).get(operation_id, {}).get(str(version))
+
+
+def store_benchmarks(benchmark_path, operation_id, version, benchmarks):
+    stored = {}
+    if benchmark_path.exists():
+        with open(benchmark_path) as f:
+            stored = json.load(f)
+
+    stored.setdefault(operation_id, {})[str(version)] = benchmarks
+    with open(benchmark_path, "w") as f:
+        json.dump(stored, f, indent=4, sort_keys=True)
+
+
+def bench_runtime(tool_dir, tool_bundle, case, runtime, fixtures, wasm_pool, repeat, timeout):
+    """
+    Runs a case on every size of the ladder, smallest first,
+    stopping at the first size the runtime can't handle
+    """
+    points = []
+
+    for size, size_fixtures in fixtures.items():
+        result = {"log": []}
+        try:
+            status = test_tool_outputs(
+                tool_dir, tool_bundle, case, result, wasm_pool=wasm_pool, repeat=repeat,
+                timeout=timeout, fixtures=size_fixtures, runtime=runtime
+            )
+        except Exception as e:
+            result["log"].append(f"[ERROR] Benchmark crashed: {e}")
+            status = "failed"
+
+        if status == "skipped":
+            print(f"[SKIP] {case['id']} ({runtime}): {result['log'][-1]}")
+            break
+        if status != "passed":
+            print("\n".join(result["log"]))
+            print(f"[WARNING] {case['id']} ({runtime}) failed at {size}, stopping")
+            break
+
+        metrics = result["metrics"]
+        points.append({
+            "size": size,
+            "bytes": result["input_bytes"],
+            **{metric: round(metrics[metric], 4) for metric in ["wall", "maxrss"] if metric in metrics},
+        })
+        print(f"[INFO] {case['id']} ({runtime}) {size}: {metrics.get('wall', 0):.3f}s")
+
+    return points
+
+
+def bench_tools(registry_dir, recipe_paths=None, sizes=BENCH_SIZES, repeat=3, timeout=BENCH_TIMEOUT):
+    """
+    Benchmarks the default case of every bundle on each runtime over a ladder
+    of generated input sizes, and stores the measurements and a linear
+    time/memory model per runtime in the bundle's "benchmarks" field.
+    They are also kept in the benchmark file of the bundle's recipe, which
+    write_plugin merges back into bundle.json when the plugin is rebuilt.
+    Benchmarks run one at a time so they don't disturb each other's measurements.
+    """
+    sources = benchmark_sources(recipe_paths)
+    sizes = sorted(sizes, key=lambda size: parse_size(size)[1])
+    fixtures = {size: Fixtures(size) for size in sizes}
+    generated_types = get_generated_types()
+    report = []
+
+    print(f"[INFO] Benchmarking sizes {sizes}")
+    wasm_pool = NodeWorkerPool(1) if node_available() else None
+    if not wasm_pool:
+        print("[WARNING] node not found, wasm builds will not be benchmarked")
+
+    try:
+        for version_dir, tool_bundle in find_bundles(registry_dir):
+            case = expand_cases(tool_bundle)[0]
+            if not all(input_type in generated_types for input_type in case["inputs"]):
+                print(f"[SKIP] {case['id']}: no generator for {case['inputs']}")
+                continue
+
+            benchmarks = {"sizes": sizes, "runtimes": {}}
+            for runtime in BENCH_RUNTIMES:
+                points = bench_runtime(version_dir, tool_bundle, case, runtime, fixtures, wasm_pool, repeat, timeout)
+                if not points:
+                    continue
+
+                benchmarks["runtimes"][runtime] = {
+                    "points": points,
+                    **{metric: fit_linear(points, metric) for metric in ["wall", "maxrss"] if metric in points[0]},
+                }
+
+            if not benchmarks["runtimes"]:
+                continue
+
+            tool_bundle["benchmarks"] = benchmarks
+            with open(version_dir / "bundle.json", "w") as f:
+                json.dump(tool_bundle, f, indent=4)
+
+            benchmark_path = sources.get(tool_bundle.get("id"))
+            if benchmark_path:
+                store_benchmarks(benchmark_path, tool_bundle["id"], version_dir.name, benchmarks)
+            else:
+                print(f"[WARNING] {case['id']}: no recipe found, a rebuild discards its benchmarks")
+
+            report.append({"id": tool_bundle.get("id"), "version": version_dir.name, "benchmarks": benchmarks})
+    finally:
+        if wasm_pool:
+            wasm_pool.close()
+        for size_fixtures in fixtures.values():
+            size_fixtures.cleanup()
+
+    return report
+
+
+def format_bench_table(report):
+    rows = [["operation", "runtime", "base", "per MiB", "memory base", "memory per MiB"]]
+
+    for entry in sorted(report, key=lambda e: e["id"]):
+        for runtime, model in entry["benchmarks"]["runtimes"].items():
+            wall = model.get("wall", {"base": 0, "per_mib": 0})
+            maxrss = model.get("maxrss", {"base": 0, "per_mib": 0})
+            rows.append([
+                entry["id"],
+                runtime,
+                f"{wall['base']:.3f}s",
+                f"{wall['per_mib']:.4f}s",
+                f"{maxrss['base'] / MIB:.1f}MiB",
+                f"{maxrss['per_mib'] / MIB:.2f}MiB",
+            ])
+
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    return "\n".join(
+        "  ".join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip()
+        for row in rows
+    )
@@ -0,0 +1,103 @@
+import hashlib
+import json
+import os
+import time
+from functools import lru_cache
+from pathlib import Path
+
+GENERATORS_SOURCE = Path(__file__).resolve().parent.parent / "utils" / "generators.py"
+# Entries not hit for this long are dropped when the cache is saved
+CACHE_MAX_AGE = 30 * 24 * 60 * 60
+
+
+def fingerprint(value):
+    data = json.dumps(value, sort_keys=True, separators=(",", ":")).encode()
+    return hashlib.sha256(data).hexdigest()
+
+
+def file_digest(path):
+    sha256_hash = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha256_hash.update(chunk)
+    return sha256_hash.hexdigest()
+
+
+@lru_cache(maxsize=None)
+def generators_digest():
+    # Generated fixtures change whenever the generators do
+    return file_digest(GENERATORS_SOURCE)
+
+
+def artifact_digests(tool_bundle):
+    runtime = tool_bundle.get("runtime", {})
+    return {
+        mode: {key: value for key, value in settings.items() if key.endswith("digest")}
+        for mode, settings in runtime.items()
+        if isinstance(settings, dict)
+    }
+
+
+class TestCache:
+    """
+    Results of passed tests, keyed by everything that can change them:
+    the artifact digests, the operation definition, the inputs and the seed policy
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+        if self.path.exists():
+            try:
+                with open(self.path) as f:
+                    self.entries = json.load(f)
+            except json.JSONDecodeError:
+                print(f"[WARNING] Ignoring corrupt test cache {self.path}")
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if not entry:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        entry["last_used"] = time.time()
+        return {**entry["result"], "cached": True}
+
+    def put(self, key, result):
+        if result["status"] != "passed":
+            # Failures are always re-run
+            self.entries.pop(key, None)
+            return
+
+        self.entries[key] = {"result": result, "last_used": time.time()}
+
+    def save(self):
+        now = time.time()
+        entries = {
+            key: entry for key, entry in self.entries.items()
+            if now - entry["last_used"] < CACHE_MAX_AGE
+        }
+
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(entries, f)
+        os.replace(tmp_path, self.path)
+
+
+def test_cache_key(tool_bundle, inputs, settings):
+    """
+    inputs: fingerprints of the inputs the test feeds to the tool
+    settings: test options that change the outcome (seed policy, scale, ...)
+    """
+    return fingerprint({
+        "artifacts": artifact_digests(tool_bundle),
+        "bin": tool_bundle.get("bin"),
+        "io": tool_bundle.get("io"),
+        "parameters": tool_bundle.get("parameters", []),
+        "inputs": inputs,
+        "settings": settings,
+    })
@@ -0,0 +1,188 @@
+import json
+import os
+import re
+import statistics
+import subprocess
+import threading
+import time
+from pathlib import Path
+
+import yaml
+
+BASELINE_FILE = "baseline.json" # kept next to the recipe's biochef.yaml
+
+DEFAULT_TIMEOUT = 10
+MIN_TIMEOUT = 2
+TIMEOUT_FACTOR = 5
+
+METRICS = ["wall", "user", "system", "maxrss"]
+# Differences below these are treated as noise
+METRIC_SLACK = {
+    "wall": 0.05,
+    "user": 0.05,
+    "system": 0.05,
+    "maxrss": 4 * 1024 * 1024,
+}
+
+
+def run_measured(cmd, cwd, stdin_path, stdout_path, stderr_path, timeout=DEFAULT_TIMEOUT):
+    """
+    Runs a tool with its stdin, stdout and stderr connected to files and
+    returns its exit code along with the wall time, CPU time and peak RSS
+    of the tool from os.wait4
+    """
+    with (
+        open(stdin_path, "rb") if stdin_path else open(os.devnull, "rb") as stdin,
+        open(stdout_path, "wb") as stdout,
+        open(stderr_path, "wb") as stderr,
+    ):
+        start = time.monotonic()
+        process = subprocess.Popen(cmd, cwd=cwd, stdin=stdin, stdout=stdout, stderr=stderr)
+
+        timer = threading.Timer(timeout, process.kill)
+        timer.start()
+        try:
+            _, status, rusage = os.wait4(process.pid, 0)
+        finally:
+            timed_out = not timer.is_alive()
+            timer.cancel()
+
+        wall = time.monotonic() - start
+        process.returncode = os.waitstatus_to_exitcode(status)
+
+    if timed_out:
+        raise subprocess.TimeoutExpired(cmd, timeout)
+
+    metrics = {
+        "wall": wall,
+        "user": rusage.ru_utime,
+        "system": rusage.ru_stime,
+        "maxrss": rusage.ru_maxrss * 1024, # KiB on Linux
+    }
+    return process.returncode, metrics
+
+
+def median_metrics(runs):
+    return {
+        metric: statistics.median(run[metric] for run in runs)
+        for metric in METRICS
+        if all(metric in run for run in runs)
+    }
+
+
+def get_timeout(baseline, default=DEFAULT_TIMEOUT):
+    if not baseline or "wall" not in baseline:
+        return default
+    return max(MIN_TIMEOUT, baseline["wall"] * TIMEOUT_FACTOR)
+
+
+def load_baselines(recipe_paths):
+    """
+    Returns {baseline key: baseline} for every operation of the given
+    recipes, along with the baseline file each operation came from.
+    Keys are the test case id (see tests.test.expand_cases), with '@scale'
+    appended for generated inputs.
+    """
+    baselines = {}
+    sources = {}
+
+    for recipe_path in recipe_paths or []:
+        recipe_path = Path(recipe_path)
+        with open(recipe_path) as f:
+            recipe = yaml.safe_load(f)
+
+        baseline_path = recipe_path.parent / BASELINE_FILE
+        stored = {}
+        if baseline_path.exists():
+            with open(baseline_path) as f:
+                stored = json.load(f)
+
+        for operation in recipe["operations"]:
+            sources[operation["id"]] = baseline_path
+            for key, baseline in stored.items():
+                if re.split(r"[@\[/]", key)[0] == operation["id"]:
+                    baselines[key] = baseline
+
+    return baselines, sources
+
+
+def update_baselines(report, sources):
+    """
+    Stores the metrics of the results as the baselines of their recipes.
+    Cached results were not measured in this run and are skipped.
+    """
+    updated = {}
+
+    for result in report:
+        baseline_path = sources.get(result["id"])
+        key = result.get("baseline_key", result["id"])
+        if not baseline_path or not result.get("metrics") or result.get("cached"):
+            continue
+
+        if baseline_path not in updated:
+            updated[baseline_path] = {}
+            if baseline_path.exists():
+                with open(baseline_path) as f:
+                    updated[baseline_path] = json.load(f)
+
+        updated[baseline_path][key] = {
+            metric: round(value, 4) for metric, value in result["metrics"].items()
+        }
+
+    for baseline_path, baselines in updated.items():
+        with open(baseline_path, "w") as f:
+            json.dump(baselines, f, indent=4, sort_keys=True)
+        print(f"[INFO] Updated baseline {baseline_path}")
+
+
+def find_regressions(metrics, baseline, tolerance):
+    regressions = []
+
+    for metric in METRICS:
+        if metric not in metrics or metric not in baseline:
+            continue
+
+        limit = baseline[metric] * (1 + tolerance) + METRIC_SLACK[metric]
+        if metrics[metric] > limit:
+            regressions.append(metric)
+
+    return regressions
+
+
+def format_value(metric, value):
+    if metric == "maxrss":
+        return f"{value / (1024 * 1024):.1f}MiB"
+    return f"{value:.3f}s"
+
+
+def format_diff_table(report):
+    rows = [["operation", "metric", "baseline", "current", "change", ""]]
+
+    for result in sorted(report, key=lambda r: r.get("baseline_key") or ""):
+        baseline = result.get("baseline")
+        metrics = result.get("metrics")
+        if not baseline or not metrics:
+            continue
+
+        for metric in METRICS:
+            if metric not in baseline or metric not in metrics:
+                continue
+
+            change = (metrics[metric] - baseline[metric]) / baseline[metric] if baseline[metric] else 0
+            rows.append([
+                result.get("baseline_key", result["id"]),
+                metric,
+                format_value(metric, baseline[metric]),
+                format_value(metric, metrics[metric]),
+                f"{change:+.1%}",
+                "REGRESSION" if metric in result.get("regressions", []) else "",
+            ])
+
+    if len(rows) == 1:
+        return ""
+
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    return "\n".join(
+        "  ".join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip()
+        for row in rows
+    )
@@ -1,30 +1,54 @@
 import os
+import itertools
+import math
 import subprocess
 import json
 import shutil
 import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 import random
 import string
 
-from utils.data_types import detect_data_type
+from utils.data_types import detect_file_data_type
 from utils.type_definitions import get_example_inputs
+from utils.generators import generate_input, get_generated_types
+from tests.wasm import NodeWorkerPool, node_available
+from tests.perf import run_measured, median_metrics, get_timeout, find_regressions, METRICS, DEFAULT_TIMEOUT
+from tests.cache import test_cache_key, fingerprint, generators_digest
+from tracing.tracing import span, mark
+
+def make_param_values(rnd):
+    return {
+        "string": ''.join(rnd.choices(string.ascii_lowercase, k=50)),
+        "integer": rnd.randint(1, 5),
+        "float": round(rnd.uniform(1, 100), 2),
+    }
 
 seed = random.randint(0, 10_000)
+seed_fixed = False
 rnd = random.Random(seed)
-example_param_values = {
-    "string": ''.join(rnd.choices(string.ascii_lowercase, k=50)),
-    "integer": rnd.randint(1, 5),
-    "float": round(rnd.uniform(1, 100), 2),
-}
-
-def test_tools(registry_dir):
+example_param_values = make_param_values(rnd)
+
+def set_seed(value):
+    """
+    Fixes the seed used for parameter values, generated inputs and sampling.
+    Cached results of fixed seed runs are only reused with the same seed.
+    """
+    global seed, seed_fixed, rnd, example_param_values
+    seed = value
+    seed_fixed = True
+    rnd = random.Random(seed)
+    example_param_values = make_param_values(rnd)
+
+def seed_policy():
+    return f"fixed:{seed}" if seed_fixed else "random"
+
+def find_bundles(registry_dir):
     registry_path = Path(registry_dir)
 
-    failed = []
-
-    print(f"[INFO] Starting tests with seed {seed}")
-
     for tool_dir in registry_path.iterdir():
         if not tool_dir.is_dir():
             continue
@@ -39,140 +63,474 @@ def test_tools(registry_dir):
                 continue
 
             with open(bundle_path) as f:
-                tool_bundle = json.load(f)
-
-            if not test_tool_outputs(version_dir, tool_bundle):
-                failed.append(tool_bundle["name"])
-
-    return failed
-
-
-example_inputs = get_example_inputs()
-
-def test_tool_outputs(tool_dir, tool_bundle):
-    base_dir = os.getcwd()
-
-    print(f"[INFO] Testing tool '{tool_bundle['name']}'")
+                yield version_dir, json.load(f)
+
+
+class Fixtures:
+    """
+    Generated inputs of a given scale, shared read-only by all tests.
+    Each type is generated once, the first time a test needs it. The files
+    are hardlinked into the sandboxes, so they are made read-only: a tool
+    writing to its input fails instead of corrupting it for the next cases.
+    """
+
+    def __init__(self, scale):
+        self.scale = scale
+        self.dir = Path(tempfile.mkdtemp(prefix="biochef-fixtures-"))
+        self.lock = threading.Lock()
+        self.generated_types = get_generated_types()
+
+    def get(self, type_id):
+        if type_id not in self.generated_types:
+            return None
+
+        path = self.dir / f"{type_id}-{self.scale}-{seed}.txt"
+        with self.lock:
+            if not path.exists():
+                records, size = generate_input(type_id, path, self.scale, seed)
+                path.chmod(0o444)
+                print(f"[INFO] Generated {type_id} input: {records} records, {size} bytes")
+        return path
+
+    def cleanup(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+
+# Upper bound on the input type combinations tested per operation
+MAX_CASES = 64
+
+def expand_cases(tool_bundle):
+    """
+    Expands an operation into test cases: every combination of its declared
+    input types, with the required parameters and, if it has optional ones,
+    with all parameters. The first case (first type of every input, required
+    parameters) keeps the operation id as its case id.
+    Past MAX_CASES combinations the rest are not tested, every case records
+    how many were left out as "untested".
+    """
+    inputs = tool_bundle["io"]["inputs"]
+    combinations = list(itertools.islice(
+        itertools.product(*(input_def["types"] for input_def in inputs)), MAX_CASES
+    ))
+    untested = math.prod(len(input_def["types"]) for input_def in inputs) - len(combinations)
+    parameter_sets = ["required"]
+    if any(not parameter.get("required") for parameter in tool_bundle.get("parameters", [])):
+        parameter_sets.append("all")
+
+    cases = []
+    for types in combinations:
+        for parameter_set in parameter_sets:
+            case_id = str(tool_bundle.get("id", tool_bundle.get("name")))
+            if list(types) != [input_def["types"][0] for input_def in inputs]:
+                case_id = f"{case_id}[{','.join(types)}]"
+            if parameter_set == "all":
+                case_id = f"{case_id}/all-params"
+
+            cases.append({"id": case_id, "inputs": list(types), "parameters": parameter_set, "untested": untested})
+
+    return cases
+
+
+def test_tools(registry_dir, sample_windows=0, jobs=1, repeat=1, baselines=None, tolerance=0.25, scale=None, timeout=DEFAULT_TIMEOUT, cache=None, bundles=None, wasm_pool=None):
+    """
+    Tests every case of every bundle in the registry using up to `jobs` concurrent tests.
+    Only the given (version dir, bundle) pairs are tested instead, when given.
+    Tools are run `repeat` times and the median measurements are
+    compared with the operation's baseline, if it has one.
+    With a scale, inputs are generated with that size instead of using the examples.
+    With a cache, bundles whose last passing result is still valid are not re-run.
+    A given wasm pool is used and left open, so it can be shared by several calls.
+    Returns a report with one entry per case, in completion order.
+    """
+    baselines = baselines or {}
+    fixtures = Fixtures(scale) if scale else None
+    report = []
+    cache_keys = {}
+
+    print(f"[INFO] Starting tests with seed {seed} ({seed_policy()}, {jobs} jobs)")
+    if sample_windows:
+        print(f"[INFO] Sampling large outputs with {sample_windows} windows")
+    if scale:
+        print(f"[INFO] Generating {scale} inputs in {fixtures.dir}")
+
+    own_pool = wasm_pool is None
+    if own_pool:
+        wasm_pool = NodeWorkerPool(jobs) if node_available() else None
+        if not wasm_pool:
+            print("[WARNING] node not found, wasm-only tools will be skipped")
 
     try:
-        with tempfile.TemporaryDirectory() as tmpdir:
-            tmp_path = Path(tmpdir)
-
-            # Copy runtime folder so binary works
-            runtime_src = Path(tool_dir) / "runtime"
-            runtime_dst = tmp_path / "runtime"
-            if runtime_src.exists():
-                shutil.copytree(runtime_src, runtime_dst)
-
-            os.chdir(tmp_path)
+        with span("test_tools", "test", jobs=jobs) as test_span, ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = []
+            for version_dir, tool_bundle in bundles if bundles is not None else find_bundles(registry_dir):
+                cases = expand_cases(tool_bundle)
+                if cases and cases[0]["untested"]:
+                    print(f"[WARNING] {tool_bundle.get('id')}: only the first {MAX_CASES} of "
+                          f"{MAX_CASES + cases[0]['untested']} input type combinations are tested")
+                for case in cases:
+                    baseline = baselines.get(baseline_key(case, scale))
+
+                    if cache is not None:
+                        key = test_cache_key(tool_bundle, input_fingerprints(case, scale), {
+                            "seed": seed_policy(),
+                            "scale": scale,
+                            "parameters": case["parameters"],
+                            "sample_windows": sample_windows,
+                            "repeat": repeat,
+                            "baseline": baseline,
+                            "tolerance": tolerance,
+                        })
+                        cached = cache.get(key)
+                        if cached:
+                            mark("test_case", "test", operation=cached["id"], case=cached["case"]["id"], status=cached["status"], cached=True)
+                            print(f"[CACHED] {cached['case']['id']} {cached['version']}: {cached['status']}")
+                            report.append(cached)
+                            continue
+
+                    future = executor.submit(
+                        run_test, version_dir, tool_bundle, case, wasm_pool, sample_windows, repeat,
+                        baseline, tolerance, fixtures, timeout
+                    )
+                    if cache is not None:
+                        cache_keys[future] = key
+                    futures.append(future)
+
+            for future in as_completed(futures):
+                result = future.result()
+                # Logs are only printed once a test ends so concurrent tests don't interleave
+                print("\n".join(result["log"]))
+                report.append(result)
+                if future in cache_keys:
+                    cache.put(cache_keys[future], result)
+            test_span.set(cases=len(report), cache_hits=sum(bool(result.get("cached")) for result in report))
+    finally:
+        if wasm_pool and own_pool:
+            wasm_pool.close()
+        if fixtures:
+            fixtures.cleanup()
+
+    return report
+
+
+def input_fingerprints(case, scale=None):
+    """
+    Fingerprints of the inputs test_tool_outputs feeds to a tool for a case:
+    the example contents, or how the fixture is generated
+    """
+    generated_types = get_generated_types()
+    fingerprints = []
+
+    for input_type in case["inputs"]:
+        if scale and input_type in generated_types:
+            fingerprints.append({
+                "type": input_type,
+                "scale": scale,
+                "generator": generators_digest(),
+                # With a random seed any generated input is acceptable
+                "seed": seed if seed_fixed else None,
+            })
+        elif input_type in example_inputs:
+            fingerprints.append({"type": input_type, "example": fingerprint(example_inputs[input_type])})
+        else:
+            fingerprints.append(None)
+
+    if seed_fixed:
+        fingerprints.append({"parameters": example_param_values})
+    return fingerprints
+
+
+def baseline_key(case, scale=None):
+    # Measurements on generated inputs are only comparable at the same scale
+    return f"{case['id']}@{scale}" if scale else case["id"]
+
+
+def run_test(tool_dir, tool_bundle, case, wasm_pool=None, sample_windows=0, repeat=1, baseline=None, tolerance=0.25, fixtures=None, timeout=DEFAULT_TIMEOUT):
+    result = {
+        "id": tool_bundle.get("id"),
+        "name": tool_bundle["name"],
+        "version": Path(tool_dir).name,
+        "case": case,
+        "baseline_key": baseline_key(case, fixtures.scale if fixtures else None),
+        "log": [],
+    }
+    start = time.monotonic()
+
+    with span("test_case", "test", operation=result["id"], case=case["id"]) as s:
+        try:
+            status = test_tool_outputs(
+                tool_dir, tool_bundle, case, result, sample_windows, wasm_pool, repeat, get_timeout(baseline, timeout), fixtures
+            )
+        except Exception as e:
+            result["log"].append(f"[ERROR] Test crashed: {e}")
+            status = "failed"
+
+        if baseline and result.get("metrics"):
+            result["baseline"] = baseline
+            result["regressions"] = find_regressions(result["metrics"], baseline, tolerance)
+            if result["regressions"]:
+                result["log"].append(f"[ERROR] Performance regression in {result['regressions']}")
+                status = "failed"
+        s.set(status=status, runtime=result.get("runtime"))
+
+    result["status"] = status
+    result["duration"] = round(time.monotonic() - start, 3)
+    return result
+
+
+STDERR_TAIL = 4096
+
+def format_case_matrix(report):
+    """
+    One row per tested case: the input types, the parameter set and the outcome,
+    followed by the operations whose input type combinations were not all tested
+    """
+    rows = [["operation", "inputs", "parameters", "status", "duration"]]
+
+    for result in sorted(report, key=lambda r: r["case"]["id"]):
+        rows.append([
+            result["id"],
+            ", ".join(result["case"]["inputs"]),
+            result["case"]["parameters"],
+            result["status"] + (" (cached)" if result.get("cached") else ""),
+            f"{result['duration']:.2f}s",
+        ])
+
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    lines = [
+        "  ".join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip()
+        for row in rows
+    ]
+
+    untested = {result["id"]: result["case"].get("untested") for result in report if result["case"].get("untested")}
+    for operation, count in sorted(untested.items()):
+        lines.append(f"{operation}: {count} more input type combinations not tested (limit {MAX_CASES})")
+    return "\n".join(lines)
+
+
+def read_tail(path, limit=STDERR_TAIL):
+    size = path.stat().st_size
+    with open(path, "rb") as f:
+        f.seek(max(size - limit, 0))
+        tail = f.read().decode("utf-8", errors="replace")
+
+    if size > limit:
+        tail = f"[... {size - limit} bytes truncated]\n{tail}"
+    return tail
+
+
+def link_file(source, target):
+    """
+    Hardlinks a shared input into a sandbox, copying it
+    when the sandbox is on another filesystem
+    """
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+
+
+def link_tree(src, dst):
+    """
+    Mirrors src into dst using hardlinks, falling back
+    to symlinks when src is on another filesystem
+    """
+    for root, _, files in os.walk(src):
+        target_dir = Path(dst) / Path(root).relative_to(src)
+        target_dir.mkdir(parents=True, exist_ok=True)
+
+        for name in files:
+            source = Path(root, name).resolve()
+            try:
+                os.link(source, target_dir / name)
+            except OSError:
+                os.symlink(source, target_dir / name)
 
-            bin_name = tool_bundle.get("bin")
-            bin_path = tmp_path / "runtime" / "native" / bin_name
 
-            if not bin_path.is_file():
-                print(f"[SKIP] Binary not found: {bin_name}")
-                return True
+example_inputs = get_example_inputs()
 
-            tool_input = ""
-            cmd = [str(bin_path)]
+def test_tool_outputs(tool_dir, tool_bundle, case, result, sample_windows=0, wasm_pool=None, repeat=1, timeout=DEFAULT_TIMEOUT, fixtures=None, runtime=None):
+    """
+    Runs one test case in a sandbox and checks the types of its outputs.
+    The native binary is preferred unless a runtime is given.
+    """
+    log = result["log"]
+    log.append(f"[INFO] Testing tool '{tool_bundle['name']}' case {case['id']}")
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        tmp_path = Path(tmpdir)
+
+        # Link runtime folder so binary works
+        runtime_src = Path(tool_dir) / "runtime"
+        runtime_dst = tmp_path / "runtime"
+        if runtime_src.exists():
+            link_tree(runtime_src, runtime_dst)
+
+        bin_name = tool_bundle.get("bin")
+        bin_path = runtime_dst / "native" / bin_name
+        wasm_js = runtime_dst / "wasm" / f"{bin_name}.js"
+        wasm_bin = runtime_dst / "wasm" / f"{bin_name}.wasm"
+
+        if runtime is None:
+            runtime = "native" if bin_path.is_file() else "wasm"
+
+        if runtime == "native" and not bin_path.is_file():
+            log.append(f"[SKIP] Binary not found: {bin_name}")
+            return "skipped"
+        if runtime == "wasm":
+            if not (wasm_js.is_file() and wasm_bin.is_file()):
+                log.append(f"[SKIP] Binary not found: {bin_name}")
+                return "skipped"
+            if not wasm_pool:
+                log.append(f"[SKIP] No Node runtime for wasm binary: {bin_name}")
+                return "skipped"
+        result["runtime"] = runtime
+
+        # Tool streams are spooled to files so large outputs never sit in memory
+        io_dir = tmp_path / ".io"
+        io_dir.mkdir()
+        stdin_path = None
+        stdout_path = io_dir / "stdout"
+        stderr_path = io_dir / "stderr"
+        input_files = []
+        result["input_bytes"] = 0
+        cmd = [str(bin_path) if runtime == "native" else bin_name]
+
+        # Parameters
+        for parameter in tool_bundle.get("parameters", []):
+            if not parameter.get("required") and case["parameters"] != "all":
+                continue
 
-            # Parameters
-            for parameter in tool_bundle.get("parameters", []):
-                if not parameter.get("required"):
-                    continue
+            if parameter.get("flag"):
+                cmd.append(parameter["flag"])
 
-                if parameter.get("flag"):
-                    cmd.append(parameter["flag"])
+            if parameter.get("type") == "flag":
+                continue
 
-                if parameter.get("default"):
-                    cmd.append(str(parameter["default"]))
-                    continue
+            if parameter.get("default"):
+                cmd.append(str(parameter["default"]))
+                continue
 
-                if parameter.get("type") in example_param_values:
-                    cmd.append(str(example_param_values[parameter["type"]]))
+            if parameter.get("type") in example_param_values:
+                cmd.append(str(example_param_values[parameter["type"]]))
 
-            # Inputs
-            for input_def in tool_bundle["io"]["inputs"]:
-                input_type = input_def["types"][0]
+        # Inputs
+        for input_def, input_type in zip(tool_bundle["io"]["inputs"], case["inputs"]):
+            fixture = fixtures.get(input_type) if fixtures else None
 
-                if input_type not in example_inputs:
-                    continue
+            if input_type not in example_inputs and not fixture:
+                log.append(f"[SKIP] No example input for type {input_type} ({input_def['name']})")
+                return "skipped"
 
-                if input_def["mode"] == "stdin":
-                    tool_input = example_inputs[input_type]
+            if input_def["mode"] == "stdin":
+                stdin_path = io_dir / "stdin"
+                if fixture:
+                    link_file(fixture, stdin_path)
+                else:
+                    stdin_path.write_text(example_inputs[input_type].strip())
 
-                elif input_def["mode"] == "file":
-                    file_name = f"input_{input_def['name']}.txt"
-                    file_path = tmp_path / file_name
+            elif input_def["mode"] == "file":
+                file_name = f"input_{input_def['name']}.txt"
+                file_path = tmp_path / file_name
 
+                if fixture:
+                    link_file(fixture, file_path)
+                else:
                     with open(file_path, "w") as f:
                         f.write(example_inputs[input_type])
 
-                    if input_def.get("flag"):
-                        cmd.append(input_def["flag"])
-
-                    cmd.append(str(file_path))
-
-                else:
-                    print(f"[TODO] Unsupported input mode: {input_def}")
-                    return False
-
-            # Run tool
-            print(f"Testing tool {tool_bundle['name']} with command {cmd}")
-            try:
-                result = subprocess.run(
-                    cmd,
-                    input=tool_input.strip().encode("ascii") if tool_input else None,
-                    capture_output=True,
-                    timeout=10,
-                )
-            except subprocess.TimeoutExpired:
-                print("[Error] Tool execution timed out")
-                return False
-
-            stdout = result.stdout.decode("ascii", errors="replace")
-            stderr = result.stderr.decode("ascii", errors="replace")
-
-            all_ok = True
-
-            # Outputs
-            for output_def in tool_bundle["io"]["outputs"]:
-                output_name = output_def["name"]
-
-                if output_def["mode"] == "stdout":
-                    content = stdout
-
-                elif output_def["mode"] == "file":
-                    matched = None
-                    for f in tmp_path.iterdir():
-                        if f.is_file() and f.stem.lower() == output_name.lower():
-                            matched = f
-                            break
-
-                    if not matched:
-                        print("[WARNING] Output file not found")
-                        print(f"  Expected name: {output_name}")
-                        continue
-
-                    content = matched.read_text()
-
-                else:
-                    print(f"[TODO] Unsupported output mode: {output_def}")
-                    all_ok = False
+                if input_def.get("flag"):
+                    cmd.append(input_def["flag"])
+
+                cmd.append(file_name)
+                input_files.append(file_name)
+
+            else:
+                log.append(f"[SKIP] Unsupported input mode: {input_def}")
+                return "skipped"
+
+            result["input_bytes"] += (stdin_path if input_def["mode"] == "stdin" else file_path).stat().st_size
+
+        # Run tool
+        log.append(f"Testing case {case['id']} ({runtime}) with command {cmd}")
+        runs = []
+        for _ in range(max(repeat, 1)):
+            if runtime == "native":
+                try:
+                    with span("run_tool", "test", operation=tool_bundle.get("id"), runtime=runtime, bytes=result["input_bytes"]) as s:
+                        exit_code, metrics = run_measured(cmd, tmp_path, stdin_path, stdout_path, stderr_path, timeout)
+                        s.set(exit_code=exit_code)
+                except subprocess.TimeoutExpired:
+                    log.append(f"[Error] Tool execution timed out after {timeout:.1f}s")
+                    return "failed"
+
+            else:
+                wasm_runtime = tool_bundle["runtime"]["wasm"]
+                try:
+                    with span("run_tool", "test", operation=tool_bundle.get("id"), runtime=runtime, bytes=result["input_bytes"]) as s:
+                        response = wasm_pool.run(
+                            wasm_js,
+                            wasm_bin,
+                            wasm_runtime["wasm_digest"] + wasm_runtime["js_digest"],
+                            cmd[1:],
+                            tmp_path,
+                            stdout_path,
+                            stderr_path,
+                            inputs=input_files,
+                            stdin=stdin_path,
+                            timeout=timeout,
+                        )
+                        s.set(exit_code=response.get("exitCode"))
+                except TimeoutError:
+                    log.append(f"[Error] Tool execution timed out after {timeout:.1f}s")
+                    return "failed"
+
+                metrics = {metric: response[metric] for metric in METRICS if metric in response}
+
+            runs.append(metrics)
+
+        result["metrics"] = median_metrics(runs)
+
+        all_ok = True
+
+        # Outputs
+        for output_def in tool_bundle["io"]["outputs"]:
+            output_name = output_def["name"]
+
+            if output_def["mode"] == "stdout":
+                matched = stdout_path
+
+            elif output_def["mode"] == "file":
+                matched = None
+                for f in tmp_path.iterdir():
+                    if f.is_file() and f.stem.lower() == output_name.lower():
+                        matched = f
+                        break
+
+                if not matched:
+                    log.append("[WARNING] Output file not found")
+                    log.append(f"  Expected name: {output_name}")
                     continue
-                detected = detect_data_type(content, output_def["types"])
-
-                if not detected:
-                    print(f"[WARNING] Empty output ({output_name}, {tool_bundle['name']}, {cmd})")
-                    print("stderr:")
-                    print(stderr.strip())
-                elif detected not in output_def["types"]:
-                    print(f"[ERROR] Unexpected output type ({output_name}, {tool_bundle['name']}, {cmd})")
-                    print(f"  Detected : {detected}")
-                    print(f"  Expected : {output_def['types']}")
-                    all_ok = False
 
-            return all_ok
+            else:
+                log.append(f"[TODO] Unsupported output mode: {output_def}")
+                all_ok = False
+                continue
 
-    finally:
-        os.chdir(base_dir)
\ No newline at end of file
+            with span("check_output", "test", operation=tool_bundle.get("id"), output=output_name, bytes=matched.stat().st_size) as s:
+                detected, sample = detect_file_data_type(matched, output_def["types"], sample_windows, seed=seed)
+                s.set(detected=detected, sampled=sample["sampled"])
+            if sample["sampled"]:
+                log.append(f"[INFO] Sampled {output_name}: {sample['windows']} windows, "
+                           f"{sample['bytes_checked']}/{sample['size']} bytes ({sample['coverage']:.2%})")
+
+            if not detected:
+                log.append(f"[WARNING] Empty output ({output_name}, {tool_bundle['name']}, {cmd})")
+                log.append("stderr:")
+                log.append(read_tail(stderr_path).strip())
+            elif detected not in output_def["types"]:
+                log.append(f"[ERROR] Unexpected output type ({output_name}, {tool_bundle['name']}, {cmd})")
+                log.append(f"  Detected : {detected}")
+                log.append(f"  Expected : {output_def['types']}")
+                all_ok = False
+
+        return "passed" if all_ok else "failed"
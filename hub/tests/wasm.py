@@ -0,0 +1,105 @@
+import json
+import queue
+import shutil
+import subprocess
+import threading
+import zlib
+from pathlib import Path
+
+WORKER_SCRIPT = Path(__file__).resolve().parent / "wasm_worker.js"
+
+
+def node_available():
+    return shutil.which("node") is not None
+
+
+class NodeWorker:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.process = None
+        self.responses = None
+        self.next_id = 0
+
+    def start(self):
+        self.process = subprocess.Popen(
+            ["node", str(WORKER_SCRIPT)],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+            bufsize=1,
+        )
+        self.responses = queue.Queue()
+
+        def read_responses(process, responses):
+            for line in process.stdout:
+                responses.put(json.loads(line))
+            responses.put(None)
+
+        threading.Thread(
+            target=read_responses,
+            args=(self.process, self.responses),
+            daemon=True
+        ).start()
+
+    def stop(self):
+        if self.process and self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+        self.process = None
+
+    def call(self, request, timeout):
+        with self.lock:
+            if not self.process or self.process.poll() is not None:
+                self.start()
+
+            self.next_id += 1
+            request = {**request, "id": self.next_id}
+            self.process.stdin.write(json.dumps(request) + "\n")
+            self.process.stdin.flush()
+
+            try:
+                response = self.responses.get(timeout=timeout)
+            except queue.Empty:
+                # The only way to interrupt callMain is to drop the worker
+                self.stop()
+                raise TimeoutError(f"wasm execution timed out after {timeout}s")
+
+            if response is None:
+                self.stop()
+                raise RuntimeError("Node worker exited unexpectedly")
+
+            return response
+
+
+class NodeWorkerPool:
+    """
+    Pool of long-lived Node processes running wasm_worker.js.
+    Requests for the same module always go to the same worker,
+    so each module is only compiled once.
+    """
+
+    def __init__(self, size):
+        self.workers = [NodeWorker() for _ in range(max(size, 1))]
+
+    def run(self, js_path, wasm_path, digest, args, cwd, stdout, stderr, inputs=[], stdin=None, timeout=10):
+        worker = self.workers[zlib.crc32(digest.encode()) % len(self.workers)]
+        response = worker.call({
+            "js": str(js_path),
+            "wasm": str(wasm_path),
+            "digest": digest,
+            "args": [str(arg) for arg in args],
+            "cwd": str(cwd),
+            "inputs": list(inputs),
+            "stdin": str(stdin) if stdin else None,
+            "stdout": str(stdout),
+            "stderr": str(stderr),
+        }, timeout)
+
+        if response.get("error"):
+            raise RuntimeError(response["error"])
+
+        return response
+
+    def close(self):
+        for worker in self.workers:
+            worker.stop()
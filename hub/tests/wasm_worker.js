@@ -0,0 +1,195 @@
+// Long-lived Node worker that runs emscripten builds of the plugins
+// (MODULARIZE=1, INVOKE_RUN=0, FORCE_FILESYSTEM=1, see builders/emscripten.py)
+//
+// Requests and responses are JSON objects, one per line, on stdin/stdout:
+//   request:  {id, js, wasm, digest, args, cwd, inputs, stdin, stdout, stderr}
+//   response: {id, exitCode, outputs, wall, user, system, maxrss, error}
+// stdin, stdout and stderr are paths of files the tool's streams are connected to.
+// Compiled modules are cached per digest so each tool is only compiled once.
+
+const fs = require("fs");
+const path = require("path");
+const readline = require("readline");
+const vm = require("vm");
+const { webcrypto } = require("crypto");
+
+const WORK_DIR = "/work";
+const BUFFER_SIZE = 64 * 1024;
+const modules = new Map();
+
+// Byte at a time stream callbacks for emscripten, backed by files
+function fileSource(filePath) {
+  const fd = filePath ? fs.openSync(filePath, "r") : null;
+  const buffer = Buffer.alloc(BUFFER_SIZE);
+  let length = 0;
+  let pos = 0;
+  return {
+    read() {
+      if (fd === null) return null;
+      if (pos === length) {
+        length = fs.readSync(fd, buffer, 0, BUFFER_SIZE, null);
+        pos = 0;
+        if (length === 0) return null;
+      }
+      return buffer[pos++];
+    },
+    close() {
+      if (fd !== null) fs.closeSync(fd);
+    },
+  };
+}
+
+function fileSink(filePath) {
+  const fd = fs.openSync(filePath, "w");
+  const buffer = Buffer.alloc(BUFFER_SIZE);
+  let length = 0;
+  const flush = () => {
+    fs.writeSync(fd, buffer, 0, length);
+    length = 0;
+  };
+  return {
+    write(c) {
+      if (c === null) return;
+      if (length === BUFFER_SIZE) flush();
+      buffer[length++] = c;
+    },
+    writeLine(line) {
+      for (const c of Buffer.from(line + "\n")) this.write(c);
+    },
+    close() {
+      flush();
+      fs.closeSync(fd);
+    },
+  };
+}
+
+function loadFactory(jsPath) {
+  // The glue is built for ENVIRONMENT=web,worker, so it is evaluated
+  // in a context that looks like a web worker
+  const module = { exports: {} };
+  const context = {
+    module,
+    exports: module.exports,
+    console,
+    WebAssembly,
+    TextDecoder,
+    TextEncoder,
+    URL,
+    performance,
+    setTimeout,
+    clearTimeout,
+    crypto: webcrypto,
+    location: { href: `file://${jsPath}` },
+    importScripts: () => {},
+    WorkerGlobalScope: function WorkerGlobalScope() {},
+    __filename: jsPath,
+  };
+  context.self = context;
+  context.globalThis = context;
+
+  vm.runInNewContext(fs.readFileSync(jsPath, "utf8"), context, { filename: jsPath });
+
+  const factory = typeof module.exports === "function" ? module.exports : context.Module;
+  if (typeof factory !== "function") {
+    throw new Error(`${jsPath} does not export a MODULARIZE factory`);
+  }
+  return factory;
+}
+
+async function getModule(request) {
+  let cached = modules.get(request.digest);
+  if (!cached) {
+    cached = {
+      factory: loadFactory(request.js),
+      compiled: await WebAssembly.compile(fs.readFileSync(request.wasm)),
+    };
+    modules.set(request.digest, cached);
+  }
+  return cached;
+}
+
+async function run(request) {
+  const { factory, compiled } = await getModule(request);
+
+  const stdin = fileSource(request.stdin);
+  const stdout = fileSink(request.stdout);
+  const stderr = fileSink(request.stderr);
+  let exitCode = 0;
+  let memory = null;
+
+  const start = performance.now();
+  const cpuStart = process.cpuUsage();
+  const instance = await factory({
+    noInitialRun: true,
+    stdin: stdin.read,
+    stdout: (c) => stdout.write(c),
+    stderr: (c) => stderr.write(c),
+    print: (line) => stdout.writeLine(line),
+    printErr: (line) => stderr.writeLine(line),
+    onExit: (code) => { exitCode = code; },
+    instantiateWasm: (imports, callback) => {
+      WebAssembly.instantiate(compiled, imports).then((inst) => {
+        memory = inst.exports.memory || (imports.env && imports.env.memory);
+        callback(inst, compiled);
+      });
+      return {};
+    },
+  });
+
+  const FS = instance.FS;
+  FS.mkdirTree(WORK_DIR);
+  FS.chdir(WORK_DIR);
+  for (const name of request.inputs) {
+    FS.writeFile(`${WORK_DIR}/${name}`, fs.readFileSync(path.join(request.cwd, name)));
+  }
+
+  try {
+    const ret = instance.callMain(request.args);
+    if (typeof ret === "number") exitCode = ret;
+  } catch (e) {
+    if (e && e.name === "ExitStatus") exitCode = e.status;
+    else throw e;
+  } finally {
+    stdin.close();
+    stdout.close();
+    stderr.close();
+  }
+
+  // Copy everything the tool created back to the sandbox
+  const outputs = [];
+  for (const name of FS.readdir(WORK_DIR)) {
+    if (name === "." || name === ".." || request.inputs.includes(name)) continue;
+    const file = `${WORK_DIR}/${name}`;
+    if (!FS.isFile(FS.stat(file).mode)) continue;
+    fs.writeFileSync(path.join(request.cwd, name), FS.readFile(file));
+    outputs.push(name);
+  }
+
+  const cpu = process.cpuUsage(cpuStart);
+  return {
+    exitCode,
+    outputs,
+    wall: (performance.now() - start) / 1000,
+    user: cpu.user / 1e6,
+    system: cpu.system / 1e6,
+    // Linear memory only grows, so its final size is the tool's peak
+    ...(memory && { maxrss: memory.buffer.byteLength }),
+  };
+}
+
+const rl = readline.createInterface({ input: process.stdin });
+let queue = Promise.resolve();
+
+rl.on("line", (line) => {
+  // Requests are handled one at a time, each on a fresh module instance
+  queue = queue.then(async () => {
+    const request = JSON.parse(line);
+    let response;
+    try {
+      response = { id: request.id, ...(await run(request)) };
+    } catch (e) {
+      response = { id: request.id, error: String((e && e.stack) || e) };
+    }
+    process.stdout.write(JSON.stringify(response) + "\n");
+  });
+});
@@ -0,0 +1,208 @@
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+# Tracer of the running command, None when tracing is off
+tracer = None
+
+
+class NoSpan:
+    """
+    Span of a disabled tracer, so instrumented code costs a function call
+    """
+
+    def set(self, **attributes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NO_SPAN = NoSpan()
+
+
+class Span:
+    def __init__(self, tracer, name, category, attributes):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.attributes = attributes
+
+    def set(self, **attributes):
+        """
+        Adds attributes known once the span's work is done, e.g. bytes copied or an exit code
+        """
+        self.attributes.update(attributes)
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter_ns()
+        if exc is not None:
+            self.attributes["error"] = str(exc) or exc_type.__name__
+            if getattr(exc, "returncode", None) is not None:
+                self.attributes["exit_code"] = exc.returncode
+        self.tracer.record(self, end)
+        return False
+
+
+class Tracer:
+    """
+    Records the spans every thread runs. Times are nanoseconds since the tracer started.
+    """
+
+    def __init__(self):
+        self.origin = time.perf_counter_ns()
+        self.lock = threading.Lock()
+        self.spans = []
+        self.threads = {}
+
+    def record(self, span, end):
+        thread = threading.current_thread()
+        with self.lock:
+            tid = self.threads.setdefault(thread.ident, (len(self.threads) + 1, thread.name))[0]
+            self.spans.append({
+                "name": span.name,
+                "category": span.category,
+                "start": span.start - self.origin,
+                "duration": end - span.start,
+                "tid": tid,
+                "attributes": span.attributes,
+            })
+
+    def chrome_trace(self):
+        """
+        Spans as Chrome trace events, for chrome://tracing or Perfetto
+        """
+        pid = os.getpid()
+        events = [
+            {"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+            for tid, name in self.threads.values()
+        ]
+        for span in self.spans:
+            events.append({
+                "name": span["name"],
+                "cat": span["category"],
+                "ph": "X",
+                "ts": span["start"] / 1000,
+                "dur": span["duration"] / 1000,
+                "pid": pid,
+                "tid": span["tid"],
+                "args": span["attributes"],
+            })
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def export(self, path):
+        with open(path, "w") as f:
+            json.dump(self.chrome_trace(), f, default=str)
+
+    def self_times(self):
+        """
+        Time of every span not spent in the spans nested in it on the same thread
+        """
+        self_times = [span["duration"] for span in self.spans]
+        by_thread = {}
+        for i, span in enumerate(self.spans):
+            by_thread.setdefault(span["tid"], []).append(i)
+
+        for indexes in by_thread.values():
+            # Parents start first, and last longer when they start together
+            indexes.sort(key=lambda i: (self.spans[i]["start"], -self.spans[i]["duration"]))
+            stack = []
+            for i in indexes:
+                span = self.spans[i]
+                while stack and self.spans[stack[-1]]["start"] + self.spans[stack[-1]]["duration"] <= span["start"]:
+                    stack.pop()
+                if stack:
+                    self_times[stack[-1]] -= span["duration"]
+                stack.append(i)
+        return self_times
+
+
+def tree_size(path):
+    """
+    Bytes of the files under a directory, for the attributes of copy spans
+    """
+    return sum(entry.stat().st_size for entry in Path(path).rglob("*") if entry.is_file())
+
+
+def start_tracing():
+    global tracer
+
+    tracer = Tracer()
+    return tracer
+
+
+def stop_tracing():
+    global tracer
+
+    stopped, tracer = tracer, None
+    return stopped
+
+
+def span(name, category="hub", **attributes):
+    """
+    Context manager timing a phase when tracing is on:
+        with span("git_clone", repo=url) as s:
+            ...
+            s.set(exit_code=0)
+    Exceptions leaving the span are recorded as its error, with their returncode if they have one.
+    """
+    if tracer is None:
+        return NO_SPAN
+    return Span(tracer, name, category, attributes)
+
+
+def mark(name, category="hub", **attributes):
+    """
+    Records a span of no duration, for work that was skipped, e.g. a cache hit
+    """
+    with span(name, category, **attributes):
+        pass
+
+
+def format_bytes(size):
+    return f"{size / (1 << 20):.1f}MiB" if size >= 1 << 20 else f"{size / 1024:.1f}KiB"
+
+
+def format_summary(tracer):
+    """
+    One row per span name: how often it ran, its total and self time, the
+    longest run, the bytes it processed and how many runs were cache hits or failed
+    """
+    rows = [["span", "count", "total", "self", "max", "bytes", "cached", "errors"]]
+    summary = {}
+    for span, self_time in zip(tracer.spans, tracer.self_times()):
+        entry = summary.setdefault(span["name"], {"count": 0, "total": 0, "self": 0, "max": 0, "bytes": 0, "cached": 0, "errors": 0})
+        entry["count"] += 1
+        entry["total"] += span["duration"]
+        entry["self"] += self_time
+        entry["max"] = max(entry["max"], span["duration"])
+        entry["bytes"] += span["attributes"].get("bytes") or 0
+        entry["cached"] += bool(span["attributes"].get("cached"))
+        entry["errors"] += "error" in span["attributes"]
+
+    for name, entry in sorted(summary.items(), key=lambda item: -item[1]["self"]):
+        rows.append([
+            name,
+            str(entry["count"]),
+            f"{entry['total'] / 1e9:.3f}s",
+            f"{entry['self'] / 1e9:.3f}s",
+            f"{entry['max'] / 1e9:.3f}s",
+            format_bytes(entry["bytes"]) if entry["bytes"] else "",
+            str(entry["cached"]) if entry["cached"] else "",
+            str(entry["errors"]) if entry["errors"] else "",
+        ])
+
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    return "\n".join(
+        "  ".join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip()
+        for row in rows
+    )
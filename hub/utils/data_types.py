@@ -1,5 +1,8 @@
 import re
+import os
 import json
+import math
+import random
 
 def validate_fasta(content):
     lines = content.strip().split('\n') if content else []
@@ -257,3 +260,251 @@ def detect_data_type(data, expected=[]):
             return type_info['type']
 
     return 'UNKNOWN' if data else None
+
+
+# Files smaller than this are read and validated in one go,
+# larger ones are sampled or validated in chunks of STREAM_CHUNK_SIZE
+FULL_VALIDATION_BELOW = 4 * 1024 * 1024
+STREAM_CHUNK_SIZE = 4 * 1024 * 1024
+SAMPLE_WINDOW_SIZE = 64 * 1024
+# Bytes of '#' lines read to find a header, VCF meta headers listing
+# every contig of an assembly can take several megabytes
+SAMPLE_HEADER_LIMIT = 64 * 1024 * 1024
+
+# How a type can be cut into windows that validate on their own.
+# Types missing from this mapping (JSON, EFA, TEXT, ...) always require
+# full validation of the whole file at once.
+#   record: 'line'  - one record per line
+#           'fasta' - '>' headers followed by sequence lines
+#           'fastq' - four line records
+#           'raw'   - a single unbroken sequence
+#   header: line that must be prepended to every window besides the head,
+#           the head is read up to it whatever its size
+#   single: the file has a single record, so only the head may have a header
+SAMPLING_POLICIES = {
+    'FASTA': {'record': 'fasta', 'single': True},
+    'Multi-FASTA': {'record': 'fasta'},
+    'FASTQ': {'record': 'fastq'},
+    'NUM': {'record': 'line'},
+    'BIN': {'record': 'line'},
+    'DNA': {'record': 'raw'},
+    'RNA': {'record': 'raw'},
+    'AminoAcids': {'record': 'raw'},
+    'VCF': {'record': 'line', 'header': '#CHROM'},
+    'SAM': {'record': 'line'},
+    'BED': {'record': 'line'},
+    'LIST': {'record': 'line'},
+    'GFF': {'record': 'line'},
+    'FAI': {'record': 'line'},
+}
+
+def sample_windows_for_confidence(confidence, defect_rate):
+    """
+    Number of random windows needed to hit a defect covering
+    defect_rate of the file with the given confidence
+    """
+    if not 0 < confidence < 1 or not 0 < defect_rate < 1:
+        raise ValueError("confidence and defect rate must be between 0 and 1")
+
+    return math.ceil(math.log(1 - confidence) / math.log(1 - defect_rate))
+
+def _align_lines(text, at_start, at_end):
+    if not at_start:
+        text = text[text.find('\n') + 1:] if '\n' in text else ''
+    if not at_end:
+        text = text[:text.rfind('\n') + 1] if '\n' in text else ''
+    return text
+
+def _align_fasta(text, at_start, at_end):
+    lines = _align_lines(text, at_start, at_end).split('\n')
+    while lines and not lines[-1].strip():
+        lines.pop()
+    # A header cut from its sequence is not a record yet
+    while not at_end and lines and lines[-1].startswith('>'):
+        lines.pop()
+    return '\n'.join(lines)
+
+def _align_fastq(text, at_start, at_end):
+    lines = _align_lines(text, at_start, at_end).split('\n')
+    while lines and not lines[-1].strip():
+        lines.pop()
+
+    start = 0
+    if not at_start:
+        # Quality lines may start with '@' too, so check the whole record shape
+        start = next((
+            i for i in range(len(lines) - 3)
+            if lines[i].startswith('@') and lines[i + 2].startswith('+')
+            and len(lines[i + 1]) == len(lines[i + 3])
+        ), len(lines))
+
+    lines = lines[start:]
+    if not at_end:
+        lines = lines[:len(lines) - len(lines) % 4]
+    return '\n'.join(lines)
+
+ALIGNERS = {
+    'line': _align_lines,
+    'fasta': _align_fasta,
+    'fastq': _align_fastq,
+    'raw': lambda text, at_start, at_end: text,
+}
+
+def _read_header(f, marker):
+    """
+    Returns the header line starting with marker and the offset past it,
+    or ('', 0) if the leading '#' lines don't include one
+    """
+    f.seek(0)
+    read = 0
+    while line := f.readline(SAMPLE_HEADER_LIMIT):
+        read += len(line)
+        if read > SAMPLE_HEADER_LIMIT or not line.startswith(b'#'):
+            break
+        if line.startswith(marker.encode()):
+            return line.decode('utf-8', errors='replace').rstrip('\n'), read
+    return '', 0
+
+def _read_windows(f, size, windows, window_size, rnd, head=0):
+    # The head window holds the whole header and the records after it
+    spans = [(0, min(head + window_size, size)), (max(size - window_size, 0), size)]
+    for _ in range(windows):
+        offset = rnd.randrange(0, max(size - window_size, 1))
+        spans.append((offset, min(offset + window_size, size)))
+
+    result = []
+    for start, end in spans:
+        f.seek(start)
+        result.append((start, end, f.read(end - start).decode('utf-8', errors='replace')))
+    return result
+
+def _coverage(spans, size):
+    covered = 0
+    last_end = 0
+    for start, end in sorted(spans):
+        start = max(start, last_end)
+        if end > start:
+            covered += end - start
+            last_end = end
+    return covered, covered / size if size else 1.0
+
+def _validate_piece(type_info, policy, text, first, header):
+    if not first and policy.get('single') and re.search(r'^>', text, re.M):
+        return False
+    if not first and policy['record'] == 'fasta' and not text.startswith('>'):
+        # Sequence lines cut from their header
+        text = f">sample\n{text}"
+    if header and not first:
+        text = f"{header}\n{text}"
+    return type_info['validator'](text)
+
+def _validate_windows(type_info, policy, windows, size, header):
+    align = ALIGNERS[policy['record']]
+    checked = 0
+    for start, end, text in windows:
+        text = align(text, start == 0, end == size)
+        if not text.strip():
+            continue
+        if not _validate_piece(type_info, policy, text, start == 0, header):
+            return False
+        checked += 1
+    return checked > 0
+
+def _split_complete(text, record):
+    """
+    Splits text that starts on a record boundary into
+    its complete records and the incomplete rest
+    """
+    if record == 'raw':
+        return text, ''
+
+    end = text.rfind('\n') + 1
+    if record == 'fastq':
+        lines = text.count('\n', 0, end)
+        end = 0
+        for _ in range(lines - lines % 4):
+            end = text.index('\n', end) + 1
+    elif record == 'fasta':
+        # Headers stay with the sequence that follows them
+        while end > 0:
+            line_start = text.rfind('\n', 0, end - 1) + 1
+            if not text.startswith('>', line_start):
+                break
+            end = line_start
+
+    return text[:end], text[end:]
+
+def _validate_stream(path, type_info, policy, header, head=0):
+    rest = ''
+    first = True
+    with open(path, encoding='utf-8', errors='replace') as f:
+        while True:
+            # The first chunk holds the whole header and the records after it
+            chunk = f.read(STREAM_CHUNK_SIZE + (head if first else 0))
+            if chunk:
+                complete, rest = _split_complete(rest + chunk, policy['record'])
+            else:
+                complete, rest = rest, ''
+
+            if complete.strip():
+                if not _validate_piece(type_info, policy, complete, first, header):
+                    return False
+                first = False
+
+            if not chunk:
+                return not first
+
+def detect_file_data_type(path, expected=[], windows=0, window_size=SAMPLE_WINDOW_SIZE, seed=None):
+    """
+    Detects the data type of a file, validating only the head, the tail
+    and `windows` random record aligned windows when the file is large enough.
+    Without windows, large files are validated in record aligned chunks.
+    Returns the detected type and a report of the sample coverage.
+    """
+    size = os.path.getsize(path)
+    report = {'sampled': False, 'size': size, 'windows': 0, 'bytes_checked': size, 'coverage': 1.0}
+
+    if size < FULL_VALIDATION_BELOW:
+        with open(path, encoding='utf-8', errors='replace') as f:
+            return detect_data_type(f.read(), expected), report
+
+    with open(path, 'rb') as f:
+        headers = {
+            type_id: _read_header(f, policy['header'])
+            for type_id, policy in SAMPLING_POLICIES.items()
+            if 'header' in policy
+        }
+        head = max((end for _, end in headers.values()), default=0)
+
+        sample = None
+        if windows > 0:
+            sample = _read_windows(f, size, windows, window_size, random.Random(seed), head)
+            bytes_checked, coverage = _coverage([(start, end) for start, end, _ in sample], size)
+            report.update({'sampled': True, 'windows': len(sample), 'bytes_checked': bytes_checked, 'coverage': coverage})
+
+    def matches(type_info, mandatory):
+        policy = SAMPLING_POLICIES.get(type_info['type'])
+        if type_info['type'] == 'TEXT':
+            return True
+        header, _ = headers.get(type_info['type'], ('', 0))
+        if policy and sample:
+            return _validate_windows(type_info, policy, sample, size, header)
+        if policy:
+            return _validate_stream(path, type_info, policy, header, head)
+        if not mandatory:
+            # Too big to validate in full just to name an unexpected type
+            return False
+        with open(path, encoding='utf-8', errors='replace') as f:
+            report.update({'bytes_checked': size, 'coverage': 1.0})
+            return type_info['validator'](f.read())
+
+    for type_info in ALL_TYPES:
+        if type_info['type'] in expected and matches(type_info, True):
+            return type_info['type'], report
+
+    for type_info in ALL_TYPES:
+        if type_info['type'] == 'TEXT': continue
+        if type_info['type'] not in expected and matches(type_info, False):
+            return type_info['type'], report
+
+    return 'UNKNOWN', report
@@ -0,0 +1,316 @@
+import io
+import json
+import random
+import re
+from functools import cached_property
+
+# Everything is generated by slicing pools of random residues and quality
+# strings, which is orders of magnitude faster than drawing every base.
+POOL_SIZE = 1 << 20
+LINE_WIDTH = 60
+# Records written per call for types that generate blocks of records
+BLOCK_SIZE = 4096
+
+SIZE_UNITS = {
+    "": 1,
+    "B": 1,
+    "K": 1024,
+    "KB": 1024,
+    "KIB": 1024,
+    "M": 1024 ** 2,
+    "MB": 1024 ** 2,
+    "MIB": 1024 ** 2,
+    "G": 1024 ** 3,
+    "GB": 1024 ** 3,
+    "GIB": 1024 ** 3,
+}
+
+
+def parse_size(size):
+    """
+    Parses sizes like '1GB', '512KiB' or '10000records'
+    into ('bytes', n) or ('records', n)
+    """
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([a-zA-Z]*)\s*", str(size))
+    if not match:
+        raise ValueError(f"Invalid size: {size}")
+
+    value, unit = float(match.group(1)), match.group(2).upper()
+    if unit in ["R", "REC", "RECORDS"]:
+        return "records", int(value)
+    if unit not in SIZE_UNITS:
+        raise ValueError(f"Invalid size unit: {size}")
+
+    return "bytes", int(value * SIZE_UNITS[unit])
+
+
+class SequencePool:
+    def __init__(self, rnd, alphabet, weights=None):
+        self.rnd = rnd
+        self.data = ''.join(rnd.choices(alphabet, weights=weights, k=POOL_SIZE))
+
+    def take(self, length):
+        parts = []
+        while length > 0:
+            chunk = min(length, POOL_SIZE // 2)
+            start = self.rnd.randrange(0, POOL_SIZE - chunk)
+            parts.append(self.data[start:start + chunk])
+            length -= chunk
+        return ''.join(parts)
+
+
+class QualityPool:
+    """
+    Illumina like qualities: high at the start of the read,
+    decaying towards the end, with per base noise
+    """
+
+    def __init__(self, rnd, max_length=300, profiles=256):
+        self.rnd = rnd
+        self.profiles = []
+        for _ in range(profiles):
+            quality = []
+            for position in range(max_length):
+                mean = 38 - 8 * (position / max_length) ** 2
+                q = int(min(41, max(2, rnd.gauss(mean, 3))))
+                quality.append(chr(33 + q))
+            self.profiles.append(''.join(quality))
+
+    def take(self, length):
+        profile = self.rnd.choice(self.profiles)
+        while len(profile) < length:
+            profile += self.rnd.choice(self.profiles)
+        return profile[:length]
+
+
+def wrap(sequence, width=LINE_WIDTH):
+    return ''.join(sequence[i:i + width] + '\n' for i in range(0, len(sequence), width))
+
+
+def read_length(rnd):
+    # Mostly full length reads, some adapter/quality trimmed
+    return 150 if rnd.random() < 0.8 else rnd.randint(35, 149)
+
+
+def contig_length(rnd):
+    return max(20, int(rnd.lognormvariate(6.5, 0.8)))
+
+
+def chromosome(rnd):
+    return f"chr{rnd.randint(1, 22)}"
+
+
+class GeneratorContext:
+    """
+    State shared by the records of one generated input.
+    Pools are only built for the types that use them.
+    """
+
+    def __init__(self, rnd):
+        self.rnd = rnd
+        self.position = 0
+
+    @cached_property
+    def dna(self):
+        return SequencePool(self.rnd, "ACGT", weights=[0.29, 0.21, 0.21, 0.29])
+
+    @cached_property
+    def rna(self):
+        return SequencePool(self.rnd, "ACGU")
+
+    @cached_property
+    def protein(self):
+        return SequencePool(self.rnd, "ACDEFGHIKLMNPQRSTVWY")
+
+    @cached_property
+    def quality(self):
+        return QualityPool(self.rnd)
+
+    @cached_property
+    def numbers(self):
+        return [f"{self.rnd.lognormvariate(0, 1):.3f}\n" for _ in range(BLOCK_SIZE)]
+
+
+def fasta_record(ctx, i):
+    return wrap(ctx.dna.take(LINE_WIDTH * 64))
+
+
+def multi_fasta_record(ctx, i):
+    return f">seq{i} synthetic\n" + wrap(ctx.dna.take(contig_length(ctx.rnd)))
+
+
+def efa_record(ctx, i):
+    rnd = ctx.rnd
+    length = rnd.randint(16, 120)
+    reference = ctx.dna.take(length)
+    lines = [f"<block.{i}\n"]
+    for k in range(rnd.randint(3, 6)):
+        # Aligned sequences are mutated copies of the same reference
+        sequence = list(reference)
+        for _ in range(length // 20):
+            sequence[rnd.randrange(length)] = rnd.choice("ACGT")
+        lines.append(f">s{k}\n{''.join(sequence)}\n")
+    return ''.join(lines)
+
+
+def fastq_record(ctx, i):
+    length = read_length(ctx.rnd)
+    return f"@read{i}\n{ctx.dna.take(length)}\n+\n{ctx.quality.take(length)}\n"
+
+
+def vcf_header(ctx):
+    return (
+        "##fileformat=VCFv4.2\n"
+        "##source=biochef-hub\n"
+        '##INFO=<ID=DP,Number=1,Type=Integer,Description="Total Depth">\n'
+        "#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n"
+    )
+
+
+def vcf_record(ctx, i):
+    rnd = ctx.rnd
+    ctx.position += int(rnd.expovariate(1 / 500)) + 1
+    ref = rnd.choice("ACGT") if rnd.random() < 0.9 else ctx.dna.take(rnd.randint(2, 6))
+    alt = rnd.choice([b for b in "ACGT" if b != ref[0]])
+    qual = round(rnd.uniform(10, 99), 1)
+    return f"chr1\t{ctx.position}\t.\t{ref}\t{alt}\t{qual}\tPASS\tDP={rnd.randint(5, 120)}\n"
+
+
+def sam_header(ctx):
+    return "@HD\tVN:1.6\tSO:unsorted\n" + ''.join(
+        f"@SQ\tSN:chr{n}\tLN:{250_000_000 - n * 5_000_000}\n" for n in range(1, 23)
+    )
+
+
+def sam_record(ctx, i):
+    rnd = ctx.rnd
+    length = read_length(rnd)
+    flag = rnd.choice([0, 16, 99, 147, 83, 163])
+    return (
+        f"read{i}\t{flag}\t{chromosome(rnd)}\t{rnd.randint(1, 200_000_000)}\t{rnd.randint(0, 60)}\t"
+        f"{length}M\t*\t0\t0\t{ctx.dna.take(length)}\t{ctx.quality.take(length)}\n"
+    )
+
+
+def bed_record(ctx, i):
+    rnd = ctx.rnd
+    start = rnd.randint(0, 200_000_000)
+    return f"{chromosome(rnd)}\t{start}\t{start + contig_length(rnd)}\tfeature{i}\t{rnd.randint(0, 1000)}\t{rnd.choice('+-')}\n"
+
+
+def gff_record(ctx, i):
+    rnd = ctx.rnd
+    start = rnd.randint(1, 200_000_000)
+    end = start + contig_length(rnd)
+    strand = rnd.choice("+-")
+    seqid = chromosome(rnd)
+    return (
+        f"{seqid}\tsynthetic\tgene\t{start}\t{end}\t.\t{strand}\t.\tID=gene{i}\n"
+        f"{seqid}\tsynthetic\tmRNA\t{start}\t{end}\t.\t{strand}\t.\tID=tx{i};Parent=gene{i}\n"
+        f"{seqid}\tsynthetic\texon\t{start}\t{end}\t.\t{strand}\t.\tParent=tx{i}\n"
+        f"{seqid}\tsynthetic\tCDS\t{start}\t{end}\t.\t{strand}\t0\tParent=tx{i}\n"
+    )
+
+
+def fai_record(ctx, i):
+    rnd = ctx.rnd
+    length = contig_length(rnd)
+    offset = ctx.position
+    ctx.position += length + length // LINE_WIDTH + 20
+    return f"seq{i}\t{length}\t{offset}\t{LINE_WIDTH}\t{LINE_WIDTH + 1}\n"
+
+
+def json_record(ctx, i):
+    rnd = ctx.rnd
+    return json.dumps({
+        "id": f"sample_{i}",
+        "condition": rnd.choice(["control", "treated"]),
+        "value": round(rnd.gauss(15, 4), 2),
+    })
+
+
+WORDS = ["gene", "sample", "read", "sequence", "protein", "variant", "alignment", "genome", "cell", "assay"]
+
+# header/footer are written once, records are generated until the size is reached.
+# Single sequence types (FASTA, DNA, RNA, AminoAcids) count chunks of sequence as records.
+# Types with a "block" generator produce up to BLOCK_SIZE records per call.
+GENERATORS = {
+    "FASTA": {"header": lambda ctx: ">seq synthetic\n", "record": fasta_record},
+    "Multi-FASTA": {"record": multi_fasta_record},
+    "EFA": {"record": efa_record},
+    "FASTQ": {"record": fastq_record},
+    "DNA": {"record": lambda ctx, i: ctx.dna.take(BLOCK_SIZE), "footer": "\n"},
+    "RNA": {"record": lambda ctx, i: ctx.rna.take(BLOCK_SIZE), "footer": "\n"},
+    "AminoAcids": {"record": lambda ctx, i: ctx.protein.take(BLOCK_SIZE), "footer": "\n"},
+    "NUM": {"block": lambda ctx, i, n: ''.join(ctx.rnd.choices(ctx.numbers, k=n))},
+    "BIN": {"block": lambda ctx, i, n: ''.join(ctx.rnd.choices(("0\n", "1\n"), k=n))},
+    "LIST": {"block": lambda ctx, i, n: ''.join(f"seq{j}\n" for j in range(i, i + n))},
+    "VCF": {"header": vcf_header, "record": vcf_record},
+    "SAM": {"header": sam_header, "record": sam_record},
+    "BED": {"record": bed_record},
+    "GFF": {"header": lambda ctx: "##gff-version 3\n", "record": gff_record},
+    "FAI": {"record": fai_record},
+    "JSON": {"header": lambda ctx: '{"samples":[', "record": json_record, "separator": ",", "footer": "]}\n"},
+    "TEXT": {"block": lambda ctx, i, n: ''.join(' '.join(ctx.rnd.choices(WORDS, k=12)) + "\n" for _ in range(n))},
+}
+
+
+def get_generated_types():
+    return list(GENERATORS.keys())
+
+
+def write_input(type_id, f, size, seed=0):
+    if type_id not in GENERATORS:
+        raise ValueError(f"No generator for type {type_id}")
+
+    unit, target = parse_size(size)
+    spec = GENERATORS[type_id]
+    ctx = GeneratorContext(random.Random(f"{type_id}:{seed}"))
+
+    header = spec["header"](ctx) if "header" in spec else ""
+    footer = spec.get("footer", "")
+    separator = spec.get("separator", "")
+
+    written = f.write(header)
+    records = 0
+    # Always write at least one record so the output is valid
+    while records == 0 or (written + len(footer) < target if unit == "bytes" else records < target):
+        if records:
+            written += f.write(separator)
+
+        if "block" in spec:
+            count = BLOCK_SIZE if unit == "bytes" else max(min(BLOCK_SIZE, target - records), 1)
+            written += f.write(spec["block"](ctx, records, count))
+            records += count
+        else:
+            written += f.write(spec["record"](ctx, records))
+            records += 1
+
+    written += f.write(footer)
+    return records, written
+
+
+def generate_input(type_id, path, size="1MB", seed=0):
+    """
+    Streams a valid, reproducible input of the given type and size to path.
+    Returns the number of records and bytes written.
+    """
+    with open(path, "w", buffering=1 << 20) as f:
+        return write_input(type_id, f, size, seed)
+
+
+def validate_generators(size="16KB", seed=0):
+    from utils.data_types import ALL_TYPES
+
+    validators = {type_info["type"]: type_info["validator"] for type_info in ALL_TYPES}
+    failures = []
+
+    for type_id in GENERATORS:
+        buffer = io.StringIO()
+        write_input(type_id, buffer, size, seed)
+
+        validator = validators.get(type_id)
+        if validator and not validator(buffer.getvalue()):
+            failures.append(f"{type_id}: generated input does not validate as {type_id}")
+
+    return failures
@@ -0,0 +1,49 @@
+import os
+import tempfile
+import unittest
+
+from utils.data_types import detect_file_data_type, FULL_VALIDATION_BELOW, SAMPLE_WINDOW_SIZE, STREAM_CHUNK_SIZE
+
+
+def write_vcf(path, header_size, size):
+    with open(path, 'w') as f:
+        written = f.write('##fileformat=VCFv4.2\n')
+        contig = 0
+        while written < header_size:
+            written += f.write(f'##contig=<ID=scaffold_{contig},length={1000 + contig}>\n')
+            contig += 1
+        written += f.write('#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n')
+        pos = 1
+        while written < size:
+            written += f.write(f'chr1\t{pos}\t.\tA\tG,T\t50\tPASS\tDP=10\n')
+            pos += 1
+
+
+class LongHeaderTest(unittest.TestCase):
+    """
+    VCF meta headers longer than the head window or the first stream chunk
+    """
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'calls.vcf')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_sampled_header_longer_than_head_window(self):
+        write_vcf(self.path, 4 * SAMPLE_WINDOW_SIZE, FULL_VALIDATION_BELOW + SAMPLE_WINDOW_SIZE)
+        for expected in (['VCF'], []):
+            data_type, report = detect_file_data_type(self.path, expected, windows=8, seed=1)
+            self.assertEqual(data_type, 'VCF')
+            self.assertTrue(report['sampled'])
+
+    def test_streamed_header_longer_than_chunk(self):
+        write_vcf(self.path, STREAM_CHUNK_SIZE + SAMPLE_WINDOW_SIZE, STREAM_CHUNK_SIZE * 2)
+        data_type, report = detect_file_data_type(self.path, ['VCF'])
+        self.assertEqual(data_type, 'VCF')
+        self.assertFalse(report['sampled'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,3 +1,4 @@
+from functools import lru_cache
 from cerberus import Validator
 from utils.type_definitions import get_allowed_input_types, get_allowed_output_types, is_binary_type
 
@@ -227,9 +228,15 @@ schema = {
 }
 
 
-def validate_recipe(recipe: dict):
+@lru_cache(maxsize=None)
+def get_validator():
+    # Checking the schema itself is the slowest part of validating, so it is done once
     v = Validator(schema)
     v.require_all = True
+    return v
+
+def validate_recipe(recipe: dict):
+    v = get_validator()
     result = v.validate(recipe)
 
     if not result:
@@ -0,0 +1,188 @@
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from publish import oci
+from publish.index import index_entry, INDEX_REPOSITORY, PACKAGE_PREFIX
+from mirror.mirror import MirrorStore, verify_bundle
+
+# hashlib releases the GIL on large updates, so threads hash files in parallel
+# and a few large reads per file keep the disks, not Python, the bottleneck
+HASH_BUFFER = 8 << 20
+VERIFY_JOBS = os.cpu_count()
+
+
+def hash_file(path):
+    sha256_hash = hashlib.sha256()
+    buffer = bytearray(HASH_BUFFER)
+    view = memoryview(buffer)
+    with open(path, "rb", buffering=0) as f:
+        while size := f.readinto(buffer):
+            sha256_hash.update(view[:size])
+    return f"sha256:{sha256_hash.hexdigest()}"
+
+
+class DigestCache:
+    """
+    Digests of files already hashed, keyed by their path and reused while
+    their size and modification time are unchanged
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        if self.path.exists():
+            try:
+                with open(self.path) as f:
+                    self.entries = json.load(f)
+            except json.JSONDecodeError:
+                print(f"[WARNING] Ignoring corrupt digest cache {self.path}")
+
+    def digest(self, path):
+        path = Path(path).resolve()
+        stat = path.stat()
+        key = str(path)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[:2] == [stat.st_size, stat.st_mtime_ns]:
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+
+        digest = hash_file(path)
+        with self.lock:
+            self.entries[key] = [stat.st_size, stat.st_mtime_ns, digest]
+        return digest
+
+    def save(self):
+        # Files that no longer exist are dropped
+        entries = {key: entry for key, entry in self.entries.items() if os.path.exists(key)}
+
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(entries, f)
+        os.replace(tmp_path, self.path)
+
+
+def find_targets(paths):
+    """
+    Splits the given paths into bundle.json files and mirror stores.
+    Directories are searched for bundle.json files, unless they are a mirror.
+    """
+    bundles = []
+    mirrors = []
+    for path in map(Path, paths):
+        if path.is_file():
+            bundles.append(path)
+        elif (path / "refs.json").exists():
+            mirrors.append(MirrorStore(path))
+        elif path.is_dir():
+            bundles.extend(sorted(path.rglob("bundle.json")))
+        else:
+            raise FileNotFoundError(f"Nothing to verify at {path}")
+    return bundles, mirrors
+
+
+def bundle_checks(bundle_path):
+    with open(bundle_path) as f:
+        bundle = json.load(f)
+    return bundle, oci.bundle_digests(bundle_path.parent, bundle)
+
+
+def mirror_checks(store):
+    """
+    Every blob must match the digest it is stored under
+    """
+    return {
+        path: f"{path.parent.name}:{path.name}"
+        for path in store.root.glob("blobs/*/*")
+        if not path.name.endswith(".partial")
+    }
+
+
+def mirror_mismatches(store, corrupt):
+    """
+    Every blob a mirrored manifest references must be in the store, and every
+    plugin manifest must match the digests its bundle.json records.
+    Blobs in corrupt already failed their digest check and are not parsed.
+    """
+    mismatches = []
+    for repository, tags in store.read_refs().items():
+        for tag, digest in tags.items():
+            if not store.has(digest) or digest in corrupt:
+                mismatches.append({"path": f"{repository}:{tag}", "expected": digest, "actual": None, "reason": "manifest missing or corrupt"})
+                continue
+
+            manifest = store.manifest(digest)
+            for descriptor in [manifest["config"]] + manifest["layers"]:
+                if not store.has(descriptor["digest"]):
+                    mismatches.append({"path": f"{repository}:{tag}", "expected": descriptor["digest"], "actual": None, "reason": "blob missing"})
+            if repository == INDEX_REPOSITORY or any(layer["digest"] in corrupt for layer in manifest["layers"]):
+                continue
+
+            for failure in verify_bundle(store, manifest):
+                mismatches.append({"path": f"{repository}:{tag}", "expected": None, "actual": None, "reason": failure})
+    return mismatches
+
+
+def index_mismatches(bundles, entries):
+    mismatches = []
+    for path, bundle in bundles:
+        package = f"{PACKAGE_PREFIX}{bundle.get('id')}".lower()
+        entry = entries.get(package)
+        if entry is None:
+            mismatches.append({"path": str(path), "expected": package, "actual": None, "reason": "not in the index"})
+        elif entry != index_entry(bundle):
+            mismatches.append({"path": str(path), "expected": entry, "actual": index_entry(bundle), "reason": "differs from the index"})
+    return mismatches
+
+
+def verify(paths, jobs=VERIFY_JOBS, cache=None, index_entries=None):
+    """
+    Checks bundles, registry trees and mirrors against their recorded digests,
+    and bundles against the index entries when given.
+    Returns the mismatches and the number of files checked.
+    """
+    bundle_paths, mirrors = find_targets(paths)
+
+    checks = {}
+    mismatches = []
+    bundles = []
+    for bundle_path in bundle_paths:
+        bundle, expected = bundle_checks(bundle_path)
+        bundles.append((bundle_path, bundle))
+        runtime = bundle.get("runtime", {})
+        if not expected and ("wasm" in runtime or "native" in runtime):
+            mismatches.append({"path": str(bundle_path), "expected": None, "actual": None, "reason": "no runtime digests"})
+        checks.update(expected)
+    for store in mirrors:
+        checks.update(mirror_checks(store))
+
+    def check(item):
+        path, expected = item
+        if not Path(path).exists():
+            return {"path": str(path), "expected": expected, "actual": None, "reason": "missing"}
+        actual = cache.digest(path) if cache else hash_file(path)
+        if actual != expected:
+            return {"path": str(path), "expected": expected, "actual": actual, "reason": "digest mismatch"}
+        return None
+
+    with ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+        failed = [result for result in executor.map(check, checks.items()) if result]
+    mismatches.extend(failed)
+
+    corrupt = {mismatch["expected"] for mismatch in failed}
+    for store in mirrors:
+        mismatches.extend(mirror_mismatches(store, corrupt))
+
+    if index_entries is not None:
+        mismatches.extend(index_mismatches(bundles, index_entries))
+
+    return mismatches, len(checks)
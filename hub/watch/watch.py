@@ -0,0 +1,408 @@
+import copy
+import ctypes
+import ctypes.util
+import json
+import os
+import select
+import shutil
+import struct
+import subprocess
+import time
+from pathlib import Path
+
+import yaml
+
+RECIPE_FILE = "biochef.yaml"
+# Changes closer together than this are handled as one, editors often write a file in several steps
+DEBOUNCE = 0.2
+# Interval between scans where inotify is not available
+POLL_INTERVAL = 0.5
+# Fields of a recipe whose change requires building again, the others only change the bundles
+BUILD_FIELDS = ["name", "version", "source", "build"]
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class Watcher:
+    """
+    Reports the files changed in a set of directories, through inotify
+    on Linux and by comparing modification times elsewhere
+    """
+
+    def __init__(self):
+        self.dirs = {}
+        self.recursive = set()
+        self.snapshot = {}
+        self.libc = None
+        self.fd = None
+
+        library = ctypes.util.find_library("c")
+        if library:
+            libc = ctypes.CDLL(library, use_errno=True)
+            if hasattr(libc, "inotify_init1"):
+                fd = libc.inotify_init1(IN_NONBLOCK)
+                if fd >= 0:
+                    self.libc, self.fd = libc, fd
+        if self.fd is None:
+            print(f"[WARNING] inotify is not available, checking for changes every {POLL_INTERVAL}s")
+
+    def add(self, directory, recursive=False):
+        directory = Path(directory).resolve()
+        if recursive:
+            self.recursive.add(directory)
+        for path in [directory] + (sorted(walk_dirs(directory)) if recursive else []):
+            if path in self.dirs.values():
+                continue
+            if self.fd is None:
+                self.dirs[len(self.dirs)] = path
+                continue
+            wd = self.libc.inotify_add_watch(self.fd, str(path).encode(), WATCH_MASK)
+            if wd < 0:
+                raise OSError(ctypes.get_errno(), f"Can't watch {path}")
+            self.dirs[wd] = path
+        if self.fd is None:
+            self.snapshot = self.scan()
+
+    def scan(self):
+        files = {}
+        for directory in set(self.dirs.values()):
+            for entry in os.scandir(directory):
+                if entry.is_file(follow_symlinks=False):
+                    stat = entry.stat(follow_symlinks=False)
+                    files[Path(entry.path)] = (stat.st_mtime_ns, stat.st_size)
+        return files
+
+    def read(self, timeout):
+        """
+        Changed paths reported within timeout seconds, None for no timeout
+        """
+        if self.fd is None:
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while True:
+                snapshot = self.scan()
+                changed = {
+                    path for path in snapshot.keys() | self.snapshot.keys()
+                    if snapshot.get(path) != self.snapshot.get(path)
+                }
+                self.snapshot = snapshot
+                if changed or (deadline is not None and time.monotonic() >= deadline):
+                    return changed
+                time.sleep(POLL_INTERVAL if deadline is None else min(POLL_INTERVAL, max(deadline - time.monotonic(), 0)))
+
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return set()
+
+        changed = set()
+        try:
+            data = os.read(self.fd, 1 << 16)
+        except BlockingIOError:
+            return changed
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b"\0").decode(errors="replace")
+            offset += length
+            if wd not in self.dirs or not name:
+                continue
+
+            path = self.dirs[wd] / name
+            # Directories created in a recursively watched tree are watched too
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                if any(path.is_relative_to(root) for root in self.recursive) and path.name != ".git":
+                    self.add(path, recursive=True)
+                continue
+            changed.add(path)
+        return changed
+
+    def wait(self):
+        """
+        Blocks until files change and returns them, once no more
+        changes arrived for DEBOUNCE seconds
+        """
+        changed = set()
+        while not changed:
+            changed = self.read(None)
+        while more := self.read(DEBOUNCE):
+            changed |= more
+        return changed
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+
+
+def walk_dirs(root):
+    for dirpath, dirnames, _ in os.walk(root):
+        dirnames[:] = [name for name in dirnames if name != ".git"]
+        for name in dirnames:
+            yield Path(dirpath, name)
+
+
+def source_files(checkout):
+    """
+    Paths of the files in a checkout, relative to it, outside its .git directory
+    """
+    checkout = Path(checkout)
+    for dirpath, dirnames, filenames in os.walk(checkout):
+        dirnames[:] = [name for name in dirnames if name != ".git"]
+        for name in filenames:
+            yield Path(dirpath, name).relative_to(checkout)
+
+
+def sync_tree(source, destination, previous):
+    """
+    Copies the files of source that changed since the last sync into
+    destination, with their modification times, and removes those that were
+    deleted. Other files in destination, e.g. build outputs, are kept.
+    Returns the files copied this time, to pass as previous to the next sync.
+    """
+    files = set(source_files(source))
+    for name in previous - files:
+        (destination / name).unlink(missing_ok=True)
+    for name in files:
+        stat = (source / name).stat(follow_symlinks=False)
+        target = destination / name
+        try:
+            current = target.stat(follow_symlinks=False)
+            if (current.st_mtime_ns, current.st_size) == (stat.st_mtime_ns, stat.st_size):
+                continue
+        except FileNotFoundError:
+            pass
+        target.parent.mkdir(parents=True, exist_ok=True)
+        target.unlink(missing_ok=True)
+        shutil.copy2(source / name, target, follow_symlinks=False)
+    return files
+
+
+def tracked_files(checkout):
+    """
+    Files git tracks in a checkout, or None if it isn't a git repository.
+    Build outputs written into the checkout are untracked, so they don't trigger builds.
+    """
+    result = subprocess.run(
+        ["git", "ls-files", "-z"], cwd=checkout, capture_output=True
+    )
+    if result.returncode != 0:
+        return None
+    return {Path(checkout, name.decode()) for name in result.stdout.split(b"\0") if name}
+
+
+class RecipeWatch:
+    """
+    Validates, builds and tests one recipe, then repeats only what a change
+    affects: a recipe edit is revalidated and rebuilt only if its build,
+    source, name or version changed; a build script or source edit is
+    rebuilt in the preserved checkout, so only changed files are recompiled.
+    Only the operations whose bundle.json changed are retested.
+
+    Everything is written under watch_dir, apart from the builds and
+    registry tree of the other commands:
+      src/<runtime>   clones of the pinned source, kept between builds
+      copy/<runtime>  copies of the --source checkout, kept between builds so
+                      every runtime builds in its own tree and nothing is
+                      written into the checkout
+      build/          outputs of the last build
+      registry/       plugins of the recipe's operations
+    """
+
+    def __init__(self, recipe_path, watch_dir, source=None, jobs=1, cache=None, tolerance=0.25):
+        recipe_path = Path(recipe_path).resolve()
+        self.recipe_path = recipe_path / RECIPE_FILE if recipe_path.is_dir() else recipe_path
+        self.recipe_dir = self.recipe_path.parent
+        self.watch_dir = Path(watch_dir).resolve()
+        self.build_dir = self.watch_dir / "build"
+        self.registry_dir = self.watch_dir / "registry"
+        self.source = Path(source).resolve() if source else None
+        self.jobs = jobs
+        self.cache = cache
+        self.tolerance = tolerance
+
+        self.recipe = None
+        self.outputs = None
+        self.tracked = None
+        self.synced = {}
+        self.watcher = Watcher()
+        self.wasm_pool = None
+
+    def build_script(self, recipe):
+        script = recipe.get("build", {}).get("wasm", {}).get("emscripten", {}).get("buildScript")
+        return (self.recipe_dir / script).resolve() if script else None
+
+    def source_dirs(self, recipe):
+        trees = self.watch_dir / ("copy" if self.source else "src")
+        return {runtime: trees / runtime for runtime in recipe["build"]}
+
+    def sync_sources(self, recipe):
+        """
+        Brings the copy of --source of every runtime up to date. Copied files
+        keep their modification time, so only edited files are recompiled.
+        """
+        for runtime, source_dir in self.source_dirs(recipe).items():
+            self.synced[runtime] = sync_tree(self.source, source_dir, self.synced.get(runtime, set()))
+
+    def update_watches(self):
+        self.watcher.add(self.recipe_dir)
+        build_script = self.build_script(self.recipe) if self.recipe else None
+        if build_script:
+            self.watcher.add(build_script.parent)
+        if self.source:
+            self.watcher.add(self.source, recursive=True)
+            self.tracked = tracked_files(self.source)
+
+    def relevant(self, changes):
+        """
+        The changes a cycle has to handle: the recipe, its build script and the source files
+        """
+        build_script = self.build_script(self.recipe) if self.recipe else None
+        relevant = set()
+        for path in changes:
+            if path == self.recipe_path or path == build_script:
+                relevant.add(path)
+            elif self.source and path.is_relative_to(self.source) and ".git" not in path.relative_to(self.source).parts:
+                if self.tracked is None or path in self.tracked:
+                    relevant.add(path)
+        return relevant
+
+    def load(self):
+        from validate.validate import validate_recipe
+
+        try:
+            with open(self.recipe_path) as f:
+                recipe = yaml.safe_load(f)
+        except (OSError, yaml.YAMLError) as e:
+            print(f"[ERROR] Can't read {self.recipe_path}: {e}")
+            return None
+        if not validate_recipe(recipe):
+            print(f"[ERROR] Recipe validation failed: {self.recipe_path}")
+            return None
+        return recipe
+
+    def write_plugins(self):
+        """
+        Writes the plugin of every operation and removes those of operations
+        that are gone. Returns the (version dir, bundle) pairs whose bundle.json changed.
+        """
+        from builders.builder import write_plugin, prune_registry
+
+        # write_plugin turns the operations into bundles, the recipe is kept as it was loaded
+        recipe = copy.deepcopy(self.recipe)
+        changed = []
+        plugin_dirs = []
+        for operation in recipe["operations"]:
+            plugin_dir = self.registry_dir / operation["id"] / str(recipe["version"])
+            bundle_path = plugin_dir / "bundle.json"
+            previous = bundle_path.read_text() if bundle_path.exists() else None
+
+            plugin_dirs.append(write_plugin(
+                recipe, operation, self.outputs, self.registry_dir,
+                fetch_license=not (plugin_dir / "LICENSE").exists(),
+                recipe_dir=self.recipe_dir
+            ))
+            if bundle_path.read_text() != previous:
+                with open(bundle_path) as f:
+                    changed.append((plugin_dirs[-1], json.load(f)))
+
+        prune_registry(self.registry_dir, plugin_dirs)
+        return changed
+
+    def test(self, bundles):
+        from tests.test import test_tools
+        from tests.perf import load_baselines
+
+        baselines, _ = load_baselines([self.recipe_path])
+        report = test_tools(
+            self.registry_dir, jobs=self.jobs, baselines=baselines, tolerance=self.tolerance,
+            cache=self.cache, bundles=bundles, wasm_pool=self.wasm_pool
+        )
+        if self.cache is not None:
+            self.cache.save()
+        return report
+
+    def cycle(self, changes=None):
+        """
+        Runs the stages affected by the changed paths, or every stage without changes
+        """
+        from builders.builder import build_outputs
+
+        start = time.monotonic()
+        stages = []
+        rebuild = self.outputs is None
+
+        if changes is None or self.recipe_path in changes:
+            stages.append("validate")
+            recipe = self.load()
+            if recipe is None:
+                return
+            if self.recipe is not None:
+                rebuild = rebuild or any(recipe.get(field) != self.recipe.get(field) for field in BUILD_FIELDS)
+                # Clones of another source would build the wrong code
+                if recipe["source"] != self.recipe["source"] and not self.source:
+                    shutil.rmtree(self.watch_dir / "src", ignore_errors=True)
+            self.recipe = recipe
+            self.update_watches()
+        elif self.recipe is None:
+            # Nothing else can be done until the recipe is valid
+            return
+
+        if changes and any(path != self.recipe_path for path in changes):
+            rebuild = True
+
+        if rebuild:
+            stages.append("build")
+            try:
+                if self.source:
+                    self.sync_sources(self.recipe)
+                    self.tracked = tracked_files(self.source)
+                outputs = build_outputs(self.recipe, self.recipe_dir, self.build_dir, self.source_dirs(self.recipe))
+            except Exception as e:
+                print(f"[ERROR] Build failed: {e}")
+                return
+            if not all(outputs.values()):
+                print(f"[ERROR] Build failed for {[runtime for runtime, output in outputs.items() if not output]}")
+                return
+            self.outputs = outputs
+
+        stages.append("bundle")
+        changed = self.write_plugins()
+
+        failed = []
+        if changed:
+            stages.append("test")
+            report = self.test(changed)
+            failed = [result["case"]["id"] for result in report if result["status"] == "failed"]
+
+        elapsed = time.monotonic() - start
+        result = f"{len(failed)} failed: {failed}" if failed else "all passed"
+        print(f"[INFO] {' -> '.join(stages)} in {elapsed:.1f}s, {len(changed)} operations retested, {result}")
+
+    def run(self):
+        from tests.wasm import NodeWorkerPool, node_available
+
+        self.wasm_pool = NodeWorkerPool(self.jobs) if node_available() else None
+        if not self.wasm_pool:
+            print("[WARNING] node not found, wasm-only tools will be skipped")
+        try:
+            self.watcher.add(self.recipe_dir)
+            self.cycle()
+            while True:
+                print(f"[INFO] Watching {self.recipe_path} for changes")
+                changes = set()
+                while not changes:
+                    changes = self.relevant(self.watcher.wait())
+                print(f"[INFO] Changed: {', '.join(str(path) for path in sorted(changes))}")
+                self.cycle(changes)
+        except KeyboardInterrupt:
+            print("[INFO] Stopped watching")
+        finally:
+            self.watcher.close()
+            if self.wasm_pool:
+                self.wasm_pool.close()